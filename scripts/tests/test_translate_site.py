@@ -0,0 +1,1418 @@
+"""
+Unit tests for scripts/translate_site.py and its provider, pipeline and
+dictionary modules.
+No network access or API keys are required – provider calls are patched.
+Run: python -m pytest scripts/tests/ -v
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+# scripts/ is not a package – import the script and its modules as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import translate_common as tc
+import translate_pipeline as tp
+import translate_providers as tpr
+import translate_site as ts
+
+# What TermProtector puts in place of the n-th protected span.
+M0, M1, M2 = (f'<x id="{i}"></x>' for i in range(3))
+
+PAGE = """<!DOCTYPE html>
+<html lang="de"><head><title>Sicherheit &amp; Schutz</title>
+<meta name="description" content='Der "beste" Scan'>
+</head><body>
+<h1>Willkommen</h1>
+<p>Server <a href="/scan">jetzt prüfen</a> &lt;sofort&gt;</p>
+<img src="a.png" alt="Logo">
+<script>var s = "<p>nicht</p>";</script>
+</body></html>"""
+
+
+def _cfg(**overrides):
+    cfg = dict(ts.DEFAULT_CONFIG)
+    cfg["translation_memory"] = ""
+    cfg["report_file"] = ""
+    cfg["output_manifest"] = ""
+    cfg["progress_interval_seconds"] = 0
+    cfg["hreflang_options"] = {"inject_hreflang_tags": True, "x_default_lang": "de"}
+    cfg.update(overrides)
+    return cfg
+
+
+def _fake_batch(texts, target_lang, source_lang, cfg):
+    return [f"{target_lang}:{t} & <x>" for t in texts]
+
+
+def _reference(html, page_url, lang, cfg):
+    """The pre-template pipeline: apply translations to the soup, then str()."""
+    soup = BeautifulSoup(html, "lxml")
+    nodes = tp.extract_text_nodes(soup)
+    tp.apply_translations(nodes, _fake_batch([n.original for n in nodes], lang, "de", cfg))
+    tp.inject_hreflang_tags(soup, page_url, "de", cfg["target_langs"], "de",
+                            cfg["output_dir"], {})
+    soup.find("html")["lang"] = lang
+    return str(soup)
+
+
+class TestExtraction(unittest.TestCase):
+
+    def test_original_functions_are_still_importable_from_the_script(self):
+        self.assertIs(ts.extract_text_nodes, tp.extract_text_nodes)
+        self.assertIs(ts.translate_page, tp.translate_page)
+        self.assertIs(ts.translate_batch, tpr.translate_batch)
+
+    def test_single_pass_keeps_document_section_order(self):
+        html = ("<html><head><title>Titel</title><meta name='twitter:title' content='Tw'>"
+                "</head><body><p>Eins<!-- nein --></p><svg><title>Icon</title></svg>"
+                "<img alt='Bild'><meta property='og:title' content=' Og '>"
+                "<pre><b>Code</b></pre><div> Zwei </div></body></html>")
+        nodes = tp.extract_text_nodes(BeautifulSoup(html, "lxml"))
+        self.assertEqual([(n.original, n.attr) for n in nodes], [
+            ("Titel", None), ("Tw", "content"), ("Og", "content"), ("Bild", "alt"),
+            ("Eins", None), ("Code", None), ("Zwei", None),
+        ])
+
+    def test_inline_markup_is_merged_into_one_segment(self):
+        html = ("<html><body><h1>Willkommen</h1>"
+                "<p> Server <a href='/scan' class='btn'>jetzt <b>prüfen</b></a><br>&lt;sofort&gt; </p>"
+                "<li>Nur <code>x</code> Code</li><div><p>A <i>b</i></p></div></body></html>")
+        nodes = tp.extract_text_nodes(BeautifulSoup(html, "lxml"), merge_inline=True)
+        self.assertEqual([n.original for n in nodes], [
+            "Willkommen",
+            'Server <a i="0">jetzt <b i="1">prüfen</b></a><br i="2"/>&lt;sofort&gt;',
+            "Nur", "Code",  # <code> is not inline markup: strings as before
+            'A <i i="0">b</i>',
+        ])
+        self.assertEqual(nodes[1].markup, ['<a class="btn" href="/scan">', "<b>", "<br/>"])
+
+    def test_restore_rejects_mangled_markup(self):
+        markup = ['<a href="/scan">', "<b>", "<br/>"]
+        self.assertEqual(
+            tp.restore_inline_markup('<b i="1">Check</b> <a i="0">server</a><br i="2">now', markup),
+            '<b>Check</b> <a href="/scan">server</a><br/>now',
+        )
+        for broken in ('<a i="0">server', '<a i="0">x</a><b i="1">y</b>',
+                       '<a i="0"><b i="1">x</a></b><br i="2"/>',
+                       '<a i="0">x</a><b i="0">y</b><br i="2"/>', '<a i="0">x</a> < <b i="1">y</b><br/>'):
+            self.assertIsNone(tp.restore_inline_markup(broken, markup), broken)
+
+
+class TestPageTemplate(unittest.TestCase):
+
+    def test_render_matches_soup_serialization(self):
+        cfg = _cfg()
+        with patch.object(tpr, "translate_batch", side_effect=_fake_batch):
+            template = tp.build_page_template(PAGE, "https://ex.com/a", cfg)
+            for lang in ("en", "fr"):
+                self.assertEqual(
+                    tp.translate_template(template, lang, cfg),
+                    _reference(PAGE, "https://ex.com/a", lang, cfg),
+                )
+
+    def test_merged_segments_render_like_the_soup(self):
+        cfg = _cfg(merge_inline_segments=True)
+
+        def translate(texts, target_lang, source_lang, cfg):
+            return [t.replace("jetzt", "now").replace("Willkommen", "Welcome") for t in texts]
+
+        with patch.object(tpr, "translate_batch", side_effect=translate) as batch:
+            template = tp.build_page_template(PAGE, "https://ex.com/a", cfg)
+            html = tp.translate_template(template, "en", cfg)
+        self.assertIn('<p>Server <a href="/scan">now prüfen</a> &lt;sofort&gt;</p>', html)
+        self.assertEqual(len(batch.call_args[0][0]), len(template.originals))
+
+        soup = BeautifulSoup(PAGE, "lxml")
+        nodes = tp.extract_text_nodes(soup, merge_inline=True)
+        tp.apply_translations(nodes, translate([n.original for n in nodes], "en", "de", cfg))
+        tp.inject_hreflang_tags(soup, "https://ex.com/a", "de", cfg["target_langs"], "de",
+                                cfg["output_dir"], {})
+        soup.find("html")["lang"] = "en"
+        self.assertEqual(html, str(soup))
+
+    def test_mangled_segment_keeps_the_source(self):
+        tc.STATS.reset()
+        template = tp.build_page_template(PAGE, "https://ex.com/a", _cfg(merge_inline_segments=True))
+        values = [t.replace("</a>", "") for t in template.originals]
+        self.assertIn('<a href="/scan">jetzt prüfen</a>', template.render(values, "en"))
+        self.assertEqual(tc.STATS.get("inline_segments_rejected"), 1)
+
+    def test_empty_translation_keeps_original(self):
+        template = tp.build_page_template(PAGE, "https://ex.com/a", _cfg())
+        html = template.render([""] * len(template.originals), "en")
+        self.assertIn("Willkommen", html)
+        self.assertIn('content=\'Der "beste" Scan\'', html)
+        self.assertIn('<html lang="en">', html)
+
+    def test_page_without_text_is_returned_unchanged(self):
+        html = "<html><body><script>x()</script></body></html>"
+        template = tp.build_page_template(html, "https://ex.com/", _cfg())
+        self.assertEqual(template.originals, [])
+        self.assertEqual(template.render(None, "en"), str(BeautifulSoup(html, "lxml")))
+
+    def test_page_is_parsed_once_for_all_languages(self):
+        cfg = _cfg(target_langs=["en", "fr", "es"])
+        with patch.object(tpr, "translate_batch", side_effect=_fake_batch), \
+                patch.object(tp, "BeautifulSoup", wraps=BeautifulSoup) as parser:
+            template = tp.build_page_template(PAGE, "https://ex.com/a", cfg)
+            outputs = {lang: tp.translate_template(template, lang, cfg) for lang in cfg["target_langs"]}
+        self.assertEqual(parser.call_count, 1)
+        self.assertIn("es:Willkommen", outputs["es"])
+
+    def test_parse_pool_builds_the_same_template(self):
+        cfg = _cfg(parse_workers=1, merge_inline_segments=True)
+        local = tp.build_page_template(PAGE, "https://ex.com/a", cfg)
+        tc.STATS.reset()
+        tp.start_parse_pool(cfg)
+        try:
+            pooled = tp.parse_page_template(PAGE, "https://ex.com/a", cfg)
+        finally:
+            tp.shutdown_parse_pool()
+        self.assertEqual(pooled.originals, local.originals)
+        values = [t.upper() for t in local.originals]
+        self.assertEqual(pooled.render(values, "en"), local.render(values, "en"))
+        self.assertEqual(tc.STATS.get("stage_parse_count"), 1)
+
+
+class TestTranslationMemory(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "tm.sqlite")
+        tc.STATS.reset()
+
+    def tearDown(self) -> None:
+        tpr.close_translation_memory()
+        self.tmp.cleanup()
+
+    def test_lookup_normalizes_whitespace(self):
+        tm = tpr.TranslationMemory(self.path, 100)
+        tm.store("deepl", "de", "en", [("Hallo  Welt", "Hello world")])
+        self.assertEqual(tm.lookup("deepl", "de", "en", ["Hallo Welt", "Neu"]),
+                         ["Hello world", None])
+        self.assertEqual(tm.lookup("google", "de", "en", ["Hallo Welt"]), [None])
+        tm.close()
+
+    def test_eviction_keeps_most_recent(self):
+        tm = tpr.TranslationMemory(self.path, 2)
+        tm.store("deepl", "de", "en", [("a", "A")])
+        tm._db.execute("UPDATE tm SET last_used = 0")
+        tm.store("deepl", "de", "en", [("b", "B"), ("c", "C")])
+        tm.close()
+        tm = tpr.TranslationMemory(self.path, 2)
+        self.assertEqual(tm.lookup("deepl", "de", "en", ["a", "b", "c"]), [None, "B", "C"])
+        tm.close()
+
+    def test_only_misses_are_sent_and_failures_not_cached(self):
+        cfg = _cfg(translation_memory=self.path)
+        with patch.object(tpr, "translate_batch", side_effect=_fake_batch) as api:
+            tpr.translate_texts(["Start", "Kontakt", "Start"], "en", cfg)
+            self.assertEqual(api.call_args[0][0], ["Start", "Kontakt"])
+            out = tpr.translate_texts(["Kontakt", "Preise"], "en", cfg)
+            self.assertEqual(api.call_args[0][0], ["Preise"])
+        self.assertEqual(out, ["en:Kontakt & <x>", "en:Preise & <x>"])
+        self.assertEqual(tc.STATS.get("tm_hits"), 1)
+        self.assertEqual(tc.STATS.get("tm_chars_saved"), len("Kontakt"))
+
+        with patch.object(tpr, "translate_batch", side_effect=tpr.TranslationError("down")):
+            self.assertEqual(tpr.translate_texts(["Neu"], "en", cfg), ["Neu"])
+        with patch.object(tpr, "translate_batch", side_effect=_fake_batch) as api:
+            tpr.translate_texts(["Neu"], "en", cfg)
+            self.assertEqual(api.call_count, 1)
+
+    def test_routed_entries_are_kept_under_the_provider_that_answered(self):
+        cfg = _cfg(translation_memory=self.path,
+                   routing={"providers": ["deepl", "google"], "hedge_after_ms": 0})
+
+        def provider(name, texts, target_lang, source_lang, cfg):
+            if name == "deepl":
+                raise tpr.ProviderUnavailable("quota exceeded (HTTP 456)")
+            return [f"{name}:{t}" for t in texts]
+
+        tpr.reset_router()
+        self.addCleanup(tpr.reset_router)
+        with patch.object(tpr, "provider_translate", side_effect=provider) as api:
+            self.assertEqual(tpr.translate_texts(["Hallo"], "en", cfg), ["google:Hallo"])
+            # A later run finds the entry whichever provider is now preferred.
+            self.assertEqual(tpr.translate_texts(["Hallo"], "en", cfg), ["google:Hallo"])
+        self.assertEqual(api.call_count, 2)
+        memory = tpr.get_translation_memory(cfg)
+        self.assertEqual(memory.lookup("google", "de", "en", ["Hallo"]), ["google:Hallo"])
+        self.assertEqual(memory.lookup("deepl", "de", "en", ["Hallo"]), [None])
+
+
+class TestSiteDedup(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, "src")
+        for name, heading in (("a", "Willkommen"), ("b", "Preise"), ("c", "Willkommen")):
+            os.makedirs(os.path.join(self.src, name))
+            with open(os.path.join(self.src, name, "index.html"), "w", encoding="utf-8") as fh:
+                fh.write(PAGE.replace("Willkommen", heading))
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def _run(self, **overrides) -> dict[str, str]:
+        settings = {"local_html_dir": self.src, "output_dir": os.path.join(self.tmp.name, "out"),
+                    "target_langs": ["en", "fr"], "resume": False}
+        settings.update(overrides)
+        cfg = _cfg(**settings)
+        with patch.object(tpr, "translate_batch", side_effect=_fake_batch) as api:
+            ts.run(cfg)
+        self.api_calls = api.call_count
+        files = {}
+        for root, _, names in os.walk(cfg["output_dir"]):
+            for name in names:
+                path = os.path.join(root, name)
+                with open(path, encoding="utf-8") as fh:
+                    files[os.path.relpath(path, cfg["output_dir"])] = fh.read()
+        shutil.rmtree(cfg["output_dir"], ignore_errors=True)
+        return files
+
+    def test_string_table_interns(self):
+        table = tp.StringTable()
+        self.assertEqual(list(table.add(["a", "b", "a"])), [0, 1, 0])
+        self.assertEqual(list(table.add(["b", "c"])), [1, 2])
+        self.assertEqual(table.strings, ["a", "b", "c"])
+
+    def test_output_matches_per_page_mode_with_fewer_calls(self):
+        per_page = self._run()
+        per_page_calls = self.api_calls
+        dedup = self._run(site_dedup=True)
+        self.assertEqual(len(per_page), 6)
+        self.assertEqual(per_page, dedup)
+        self.assertEqual(self.api_calls, 2)
+        self.assertLess(self.api_calls, per_page_calls)
+        self.assertEqual(tc.STATS.get("dedup_strings_total"), 2 * 3 * 7)
+        self.assertEqual(tc.STATS.get("dedup_strings_unique"), 2 * 8)
+
+
+class TestPipeline(unittest.TestCase):
+
+    setUp = TestSiteDedup.setUp
+    tearDown = TestSiteDedup.tearDown
+    _run = TestSiteDedup._run
+
+    def test_output_independent_of_worker_counts(self):
+        serial = self._run(fetch_workers=1, translate_workers=1, write_workers=1,
+                           max_inflight_batches=1, pipeline_queue_size=1)
+        parallel = self._run(fetch_workers=3, translate_workers=3, write_workers=2)
+        self.assertEqual(len(serial), 6)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(tc.STATS.get("pages"), 3)
+
+    def test_run_report_covers_stages_and_languages(self):
+        report_file = os.path.join(self.tmp.name, "report.json")
+        self._run(report_file=report_file)
+        with open(report_file, encoding="utf-8") as fh:
+            report = json.load(fh)
+        self.assertEqual(report["pages"]["translated"], 3)
+        self.assertEqual(report["pages"]["files_written"], 6)
+        self.assertGreater(report["pages"]["bytes_fetched"], 2 * len(PAGE))
+        for stage in ("discover", "fetch", "parse", "extract", "hreflang", "serialize",
+                      "translate", "api_call", "render", "write"):
+            self.assertIn(stage, report["stages"])
+        self.assertEqual(report["stages"]["parse"]["count"], 3)
+        self.assertEqual(report["languages"]["fr"]["strings_sent"], 3 * 7)
+        self.assertEqual(report["api"]["calls"],
+                         sum(lang["api_calls"] for lang in report["languages"].values()))
+        self.assertGreater(report["memory"]["peak_rss_mb"], 0)
+
+    def test_inflight_pages_are_bounded(self):
+        active = peak = 0
+        lock = threading.Lock()
+        load, write = tp.load_page_source, tp.write_output
+
+        def counting_load(local_path, page_url):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            return load(local_path, page_url)
+
+        def counting_write(out_file, html):
+            nonlocal active
+            time.sleep(0.01)
+            if out_file.parts[-3] == "fr":  # each page's last language
+                with lock:
+                    active -= 1
+            return write(out_file, html)
+
+        with patch.object(tp, "load_page_source", side_effect=counting_load), \
+                patch.object(tp, "write_output", side_effect=counting_write):
+            files = self._run(fetch_workers=3, write_workers=1, max_inflight_pages=1)
+        self.assertEqual(len(files), 6)
+        self.assertEqual(peak, 1)
+
+    def test_dead_workers_stop_the_pipeline(self):
+        outcome: list[BaseException] = []
+
+        def run() -> None:
+            try:
+                self._run(write_workers=1, pipeline_queue_size=1, max_inflight_pages=0)
+            except RuntimeError as exc:
+                outcome.append(exc)
+
+        with patch.object(tp, "write_output", side_effect=RuntimeError("disk gone")):
+            thread = threading.Thread(target=run, daemon=True)
+            thread.start()
+            thread.join(10)
+        self.assertFalse(thread.is_alive())  # translators and fetchers did not block
+        self.assertEqual([str(exc) for exc in outcome], ["disk gone"])
+
+    def test_configuration_error_starts_nothing(self):
+        manifest = os.path.join(self.tmp.name, "manifest.jsonl")
+        with self.assertRaises(SystemExit):
+            ts.run(_cfg(local_html_dir="", sitemap_url="", output_manifest=manifest,
+                        parse_workers=1, resume=False))
+        self.assertFalse(os.path.exists(manifest + ".tmp"))
+        self.assertIsNone(tp._output_writer)
+        self.assertIsNone(tp._parse_pool)
+
+    def test_unchanged_output_is_not_rewritten(self):
+        manifest = os.path.join(self.tmp.name, "manifest.jsonl")
+        out = os.path.join(self.tmp.name, "out")
+        cfg = _cfg(local_html_dir=self.src, output_dir=out, target_langs=["en", "fr"],
+                   resume=False, output_manifest=manifest)
+        with patch.object(tpr, "translate_batch", side_effect=_fake_batch):
+            ts.run(cfg)
+            self.assertEqual(tc.STATS.get("files_written"), 6)
+            page = os.path.join(out, "fr", "b", "index.html")
+            os.utime(page, (0, 0))
+            with open(os.path.join(out, "en", "a", "index.html"), "a", encoding="utf-8") as fh:
+                fh.write("<!-- edited -->")
+            ts.run(cfg)
+        self.assertEqual(tc.STATS.get("files_written"), 1)
+        self.assertEqual(tc.STATS.get("files_unchanged"), 5)
+        self.assertEqual(os.stat(page).st_mtime, 0)
+        with open(manifest, encoding="utf-8") as fh:
+            entries = {e["path"]: e for e in map(json.loads, fh)}
+        self.assertEqual(len(entries), 6)
+        self.assertEqual([p for p, e in entries.items() if e["written"]], ["en/a/index.html"])
+        with open(page, "rb") as fh:
+            self.assertEqual(entries["fr/b/index.html"]["sha256"], hashlib.sha256(fh.read()).hexdigest())
+        leftovers = [n for _, _, names in os.walk(out) for n in names if n.endswith(".tmp")]
+        self.assertEqual(leftovers, [])
+
+    def test_untranslated_pages_are_reported(self):
+        def no_french(texts, target_lang, source_lang, cfg):
+            if target_lang == "fr":
+                raise tpr.TranslationError("fr down")
+            return _fake_batch(texts, target_lang, source_lang, cfg)
+
+        report_file = os.path.join(self.tmp.name, "report.json")
+        cfg = _cfg(local_html_dir=self.src, output_dir=os.path.join(self.tmp.name, "out"),
+                   target_langs=["en", "fr"], resume=False, report_file=report_file)
+        journal = os.path.join(self.tmp.name, "resume.jsonl")
+        open_journal = tp.ResumeJournal
+        with patch.object(tpr, "translate_batch", side_effect=no_french), \
+                patch.object(ts, "ResumeJournal", lambda: open_journal(journal, legacy_path=None)):
+            ts.run(dict(cfg, resume=True))
+        with open(journal, encoding="utf-8") as fh:
+            done = sorted(json.loads(line) for line in fh)
+        self.assertEqual(done, [f"http://localhost/{p}/index.html:en" for p in "abc"])
+        with open(report_file, encoding="utf-8") as fh:
+            report = json.load(fh)
+        self.assertEqual(report["pages"]["with_untranslated_strings"], 3)
+        self.assertEqual(report["pages"]["files_written"], 6)
+        self.assertEqual(report["languages"]["en"]["untranslated"], 0)
+        self.assertGreater(report["languages"]["fr"]["untranslated"], 0)
+
+    def test_local_discovery_streams_in_name_order(self):
+        os.makedirs(os.path.join(self.src, "a", "z"))
+        for rel in ("a/z/index.htm", "a/b.html", "notes.txt"):
+            with open(os.path.join(self.src, rel), "w", encoding="utf-8") as fh:
+                fh.write(PAGE)
+        found = tp.iter_local_html_files(self.src)
+        self.assertEqual(next(found)[1], "/a/b.html")
+        self.assertEqual([rel for _, rel in found],
+                         ["/a/index.html", "/a/z/index.htm", "/b/index.html", "/c/index.html"])
+
+    def test_local_discovery_does_not_follow_directory_links(self):
+        os.symlink(self.src, os.path.join(self.src, "a", "loop"))  # a cycle back to the root
+        os.symlink(os.path.join(self.src, "b", "index.html"), os.path.join(self.src, "alias.html"))
+        self.assertEqual([rel for _, rel in tp.iter_local_html_files(self.src)],
+                         ["/alias.html", "/a/index.html", "/b/index.html", "/c/index.html"])
+
+    def test_inflight_batches_are_bounded(self):
+        active = peak = 0
+        lock = threading.Lock()
+
+        def slow_batch(texts, target_lang, source_lang, cfg):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.02)
+            with lock:
+                active -= 1
+            return _fake_batch(texts, target_lang, source_lang, cfg)
+
+        cfg = _cfg(batch_size=1, max_inflight_batches=3)
+        texts = [f"Satz {i}" for i in range(12)]
+        with patch.object(tpr, "translate_batch", side_effect=slow_batch):
+            result = tpr.translate_texts(texts, "en", cfg)
+        tpr.shutdown_batch_executors()
+        self.assertEqual(result, _fake_batch(texts, "en", "de", cfg))
+        self.assertGreater(peak, 1)
+        self.assertLessEqual(peak, 3)
+
+
+class TestIncremental(unittest.TestCase):
+
+    setUp = TestSiteDedup.setUp
+    tearDown = TestSiteDedup.tearDown
+
+    def _run(self) -> list[str]:
+        cfg = _cfg(local_html_dir=self.src, output_dir=os.path.join(self.tmp.name, "out"),
+                   target_langs=["en", "fr"], incremental=True,
+                   incremental_state=os.path.join(self.tmp.name, "state.sqlite"))
+        self.cfg = cfg
+        sent: list[str] = []
+
+        def _record(texts, target_lang, source_lang, cfg):
+            sent.extend(texts)
+            return _fake_batch(texts, target_lang, source_lang, cfg)
+
+        with patch.object(tpr, "translate_batch", side_effect=_record):
+            ts.run(cfg)
+        return sent
+
+    def test_unchanged_pages_are_skipped(self):
+        self.assertTrue(self._run())
+        self.assertEqual(self._run(), [])
+        self.assertEqual(tc.STATS.get("incremental_pages_unchanged"), 3)
+
+    def test_only_modified_strings_are_sent(self):
+        self._run()
+        path = os.path.join(self.src, "b", "index.html")
+        with open(path, encoding="utf-8") as fh:
+            html = fh.read()
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(html.replace("Preise", "Neue Preise"))
+        self.assertEqual(sorted(self._run()), ["Neue Preise", "Neue Preise"])
+        self.assertEqual(tc.STATS.get("incremental_pages_changed"), 1)
+        out = tp.output_path_for("http://localhost/b/index.html", "en", self.cfg["output_dir"])
+        rendered = out.read_text(encoding="utf-8")
+        self.assertIn("en:Neue Preise", rendered)
+        self.assertIn("en:Sicherheit", rendered)
+
+    def test_missing_output_is_rewritten_from_state(self):
+        self._run()
+        tp.output_path_for("http://localhost/a/index.html", "fr", self.cfg["output_dir"]).unlink()
+        self.assertEqual(self._run(), [])
+        self.assertTrue(tp.output_path_for(
+            "http://localhost/a/index.html", "fr", self.cfg["output_dir"]).exists())
+
+    def test_sitemap_lastmod_skips_before_fetching(self):
+        state = tp.PageState(os.path.join(self.tmp.name, "lastmod.sqlite"))
+        cfg = _cfg(output_dir=os.path.join(self.tmp.name, "out"))
+        url = "https://ex.com/a"
+        state.record_page(url, "2026-01-01", b"x" * 16)
+        for lang in ("en", "fr"):
+            out = tp.output_path_for(url, lang, cfg["output_dir"])
+            out.parent.mkdir(parents=True, exist_ok=True)
+            out.write_text("", encoding="utf-8")
+        self.assertEqual(tp._unchanged_pending(state, url, "2026-01-01", None, ["en", "fr"], cfg), [])
+        self.assertIsNone(tp._unchanged_pending(state, url, "2026-02-01", None, ["en"], cfg))
+        self.assertIsNone(tp._unchanged_pending(state, url, None, None, ["en"], cfg))
+        state.close()
+
+
+class TestResumeJournal(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "resume.jsonl")
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def _lines(self) -> list[str]:
+        with open(self.path, encoding="utf-8") as fh:
+            return fh.read().splitlines()
+
+    def test_entries_are_durable_before_close(self):
+        journal = tp.ResumeJournal(self.path, legacy_path=None)
+        journal.add("https://ex.com/ä:en")
+        self.assertEqual(self._lines(), ['"https://ex.com/ä:en"'])
+        self.assertIn("https://ex.com/ä:en", tp.ResumeJournal(self.path, legacy_path=None))
+        journal.close()
+
+    def test_torn_last_line_is_ignored(self):
+        with open(self.path, "w", encoding="utf-8") as fh:
+            fh.write('"a:en"\n"b:en"\n"c:e')
+        journal = tp.ResumeJournal(self.path, legacy_path=None)
+        self.assertEqual(len(journal), 2)
+        self.assertNotIn("c:en", journal)
+        journal.close()
+
+    def test_legacy_log_is_imported_once(self):
+        legacy = os.path.join(self.tmp.name, "resume.json")
+        with open(legacy, "w", encoding="utf-8") as fh:
+            json.dump({"done": ["b:fr", "a:en"]}, fh)
+        journal = tp.ResumeJournal(self.path, legacy_path=legacy)
+        journal.close()
+        self.assertFalse(os.path.exists(legacy))
+        self.assertEqual(self._lines(), ['"a:en"', '"b:fr"'])
+
+    def test_duplicates_are_compacted_on_open(self):
+        with open(self.path, "w", encoding="utf-8") as fh:
+            fh.write('"a:en"\n' * 5 + '"b:en"\n')
+        tp.ResumeJournal(self.path, legacy_path=None).close()
+        self.assertEqual(self._lines(), ['"a:en"', '"b:en"'])
+
+    def test_concurrent_writers_share_one_journal(self):
+        first = tp.ResumeJournal(self.path, legacy_path=None)
+        second = tp.ResumeJournal(self.path, legacy_path=None)  # e.g. another process
+        threads = [threading.Thread(target=lambda j=j, w=w: [j.add(f"{w}/{i}:en") for i in range(200)])
+                   for w, j in enumerate((first, second, first, second))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        second._lines = -1
+        second._maybe_compact()  # rewrite the file under the other writer
+        first.add("after:en")
+        first.close()
+        second.close()
+        self.assertEqual(len(tp.ResumeJournal(self.path, legacy_path=None)), 4 * 200 + 1)
+
+
+class TestPackBatches(unittest.TestCase):
+
+    def _check(self, texts, limits, batches):
+        self.assertEqual(sorted(i for b in batches for i in b), list(range(len(texts))))
+        for batch in batches:
+            if len(batch) == 1:
+                continue
+            self.assertLessEqual(len(batch), limits.max_items)
+            self.assertLessEqual(sum(len(texts[i]) for i in batch), limits.max_chars)
+
+    def test_short_strings_fill_item_budget(self):
+        texts = [f"Label {i}" for i in range(120)]
+        limits = tpr.BatchLimits(max_items=50, max_chars=10_000, max_bytes=100_000)
+        batches = tpr.pack_batches(texts, limits)
+        self.assertEqual(sorted(len(b) for b in batches), [20, 50, 50])
+        self._check(texts, limits, batches)
+
+    def test_long_strings_respect_char_budget(self):
+        texts = ["x" * 400] * 10 + ["kurz"] * 10
+        limits = tpr.BatchLimits(max_items=50, max_chars=1000, max_bytes=100_000)
+        batches = tpr.pack_batches(texts, limits)
+        self.assertEqual(len(batches), 5)
+        self._check(texts, limits, batches)
+
+    def test_oversized_string_goes_alone(self):
+        texts = ["a", "y" * 5000, "b"]
+        limits = tpr.BatchLimits(max_items=50, max_chars=1000, max_bytes=100_000)
+        self.assertEqual(tpr.pack_batches(texts, limits), [[0, 2], [1]])
+
+    def test_limits_from_config(self):
+        cfg = _cfg(batch_size=20, batch_limits={"google": {"max_chars": 500}})
+        self.assertEqual(tpr.batch_limits_for("google", cfg),
+                         tpr.BatchLimits(max_items=20, max_chars=500, max_bytes=120_000))
+        self.assertEqual(tpr.batch_limits_for("deepl", cfg).max_items, 20)
+
+
+class _Response:
+    def __init__(self, status, body=None, headers=None):
+        self.status_code = status
+        self._body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise tpr.requests.HTTPError(f"HTTP {self.status_code}")
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+
+    def setUp(self) -> None:
+        tc.STATS.reset()
+
+    def test_throttle_halves_window_and_success_grows_it(self):
+        limiter = tpr.AdaptiveLimiter("x", requests_per_second=100, max_concurrency=8, backoff_cap=1)
+        self.assertEqual(limiter.window, 4)
+        limiter.acquire()
+        limiter.release(limiter.THROTTLED, retry_after=0)
+        self.assertEqual(limiter.window, 2)
+        self.assertEqual(limiter.rate, 50)
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(limiter.OK)
+        self.assertGreater(limiter.window, 2)
+        self.assertGreater(limiter.rate, 50)
+
+    def test_retry_after_cools_down_every_worker(self):
+        limiter = tpr.AdaptiveLimiter("x", requests_per_second=100, max_concurrency=4, backoff_cap=1)
+        limiter.acquire()
+        limiter.release(limiter.THROTTLED, retry_after=0.2)
+        start = tpr.time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(tpr.time.monotonic() - start, 0.19)
+        self.assertGreaterEqual(tc.STATS.get("throttle_ms"), 190)
+
+    def test_backoff_is_capped(self):
+        limiter = tpr.AdaptiveLimiter("x", requests_per_second=1, max_concurrency=1, backoff_cap=4)
+        limiter.consecutive_failures = 10
+        self.assertTrue(2 <= limiter.backoff_delay() <= 4)
+
+    def test_retry_after_header_parsing(self):
+        self.assertEqual(tpr._retry_after(_Response(429, headers={"Retry-After": "7"})), 7.0)
+        self.assertIsNone(tpr._retry_after(_Response(429)))
+        self.assertEqual(tpr._retry_after(_Response(429, headers={
+            "X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "3"})), 3.0)
+
+    def test_deepl_retries_429_then_succeeds(self):
+        limiter = tpr.AdaptiveLimiter("deepl", requests_per_second=100, max_concurrency=2, backoff_cap=1)
+        responses = [
+            _Response(429, headers={"Retry-After": "0"}),
+            _Response(200, {"translations": [{"text": "Hello"}]}),
+        ]
+        with patch.object(tpr.requests.Session, "post", side_effect=responses) as post, \
+                patch.object(tpr.time, "sleep") as sleep:
+            out = tpr._deepl_translate(["Hallo"], "en", "de", "key:fx", 60, 3, limiter)
+        self.assertEqual(out, ["Hello"])
+        self.assertEqual(post.call_count, 2)
+        sleep.assert_not_called()
+        self.assertEqual(tc.STATS.get("throttled_responses"), 1)
+
+    def test_quota_exceeded_is_not_retried(self):
+        limiter = tpr.AdaptiveLimiter("deepl", requests_per_second=100, max_concurrency=8, backoff_cap=1)
+        with patch.object(tpr.requests.Session, "post", return_value=_Response(456)) as post:
+            with self.assertRaises(tpr.ProviderUnavailable):
+                tpr._deepl_translate(["Hallo"], "en", "de", "key", 60, 3, limiter)
+        self.assertEqual(post.call_count, 1)
+        # Released as a failure: the window shrinks and the provider cools down.
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertEqual(limiter.window, 2)
+        self.assertGreater(limiter.cooldown_until, tpr.time.monotonic())
+
+    def test_quota_exceeded_fails_later_batches_without_a_request(self):
+        cfg = _cfg(rate_limit_backoff_seconds=1)
+        self.addCleanup(tpr.reset_router)
+        with patch.dict(os.environ, {"DEEPL_API_KEY": "key:fx"}), \
+                patch.object(tpr.requests.Session, "post", return_value=_Response(456)) as post:
+            for text in ("Hallo", "Welt"):
+                with self.assertRaises(tpr.ProviderUnavailable):
+                    tpr.translate_batch([text], "en", "de", cfg)
+        self.assertEqual(post.call_count, 1)
+        tpr.reset_router()
+        with patch.dict(os.environ, {"DEEPL_API_KEY": "key:fx"}), \
+                patch.object(tpr.requests.Session, "post",
+                             return_value=_Response(200, {"translations": [{"text": "Hello"}]})):
+            self.assertEqual(tpr.translate_batch(["Hallo"], "en", "de", cfg), ["Hello"])
+
+
+class _StandIn(BaseHTTPRequestHandler):
+    """HTTP/1.1 keep-alive server returning gzip pages and DeepL-style JSON."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, body: bytes, content_type: str, gzipped: bool = False) -> None:
+        if gzipped:
+            body = gzip.compress(body)
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        self._send(PAGE.encode("utf-8"), "text/html; charset=utf-8", gzipped)
+
+    def do_POST(self) -> None:
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        body = {"translations": [{"text": t.upper()} for t in payload["text"]]}
+        self._send(json.dumps(body).encode("utf-8"), "application/json")
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class TestHttpSessions(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StandIn)
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        tc.STATS.reset()
+
+    def tearDown(self) -> None:
+        tc.close_http_sessions()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_pages_are_fetched_gzipped_over_one_connection(self):
+        for i in range(5):
+            self.assertEqual(tp.fetch_html(f"{self.base}/page/{i}"), PAGE)
+        self.assertIn("gzip", tc.http_session(self.base).headers["Accept-Encoding"])
+        self.assertEqual(tc.http_pool_stats(), (5, 1))
+
+    def test_api_calls_reuse_the_pooled_connection(self):
+        limiter = tpr.AdaptiveLimiter("deepl", requests_per_second=1000, max_concurrency=2, backoff_cap=1)
+        with patch.object(tpr, "_deepl_endpoint", return_value=f"{self.base}/v2/translate"):
+            for _ in range(3):
+                out = tpr._deepl_translate(["Hallo"], "en", "de", "key", 60, 3, limiter)
+                self.assertEqual(out, ["HALLO"])
+        tc.close_http_sessions()
+        self.assertEqual(tc.STATS.get("http_requests"), 3)
+        self.assertEqual(tc.STATS.get("http_connections"), 1)
+
+
+_URLSET = ('<?xml version="1.0" encoding="UTF-8"?>'
+           '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{}</urlset>')
+
+
+class _SitemapStandIn(BaseHTTPRequestHandler):
+    """Serves a sitemap index with a plain and a gzip-compressed child sitemap."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        if self.path == "/sitemap.xml":
+            body = ('<?xml version="1.0"?>'
+                    '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                    f"<sitemap><loc>{base}/a.xml</loc></sitemap>"
+                    f"<sitemap><loc>{base}/b.xml.gz</loc></sitemap>"
+                    f"<sitemap><loc>{base}/a.xml</loc></sitemap>"
+                    "</sitemapindex>").encode()
+        elif self.path == "/a.xml":
+            body = _URLSET.format(
+                "<url><loc>https://ex.com/1</loc><lastmod>2026-01-01</lastmod></url>"
+                "<url><loc>https://ex.com/2</loc></url>").encode()
+        elif self.path == "/b.xml.gz":
+            body = gzip.compress(_URLSET.format(
+                "<url><loc>https://ex.com/2</loc></url>"
+                "<url>\n <loc> https://ex.com/3 </loc>\n</url>").encode())
+        else:
+            body = b"<broken"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class TestSitemapStreaming(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _SitemapStandIn)
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def tearDown(self) -> None:
+        tc.close_http_sessions()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_index_with_gzip_children_is_streamed_and_deduplicated(self):
+        entries = tp.iter_sitemap_entries(f"{self.base}/sitemap.xml", workers=2)
+        self.assertNotIsInstance(entries, list)
+        self.assertEqual(sorted(entries), [
+            ("https://ex.com/1", "2026-01-01"),
+            ("https://ex.com/2", None),
+            ("https://ex.com/3", None),
+        ])
+
+    def test_broken_sitemap_is_logged_not_raised(self):
+        with self.assertLogs(tp.logger, "ERROR"):
+            self.assertEqual(tp.fetch_sitemap_entries(f"{self.base}/missing.xml"), [])
+
+    def test_consumer_can_stop_early(self):
+        entries = tp.iter_sitemap_entries(f"{self.base}/sitemap.xml", workers=2, buffer=1)
+        next(entries)
+        entries.close()
+
+
+class TestSitemapWriter(unittest.TestCase):
+
+    setUp = TestSiteDedup.setUp
+    tearDown = TestSiteDedup.tearDown
+    _run = TestSiteDedup._run
+
+    NS = {"s": "http://www.sitemaps.org/schemas/sitemap/0.9", "x": "http://www.w3.org/1999/xhtml"}
+
+    def _sitemaps(self, max_urls, **overrides):
+        directory = os.path.join(self.tmp.name, "maps")
+        self._run(sitemap_output={"dir": directory, "base_url": "https://ex.com/",
+                                  "max_urls": max_urls}, **overrides)
+        return directory, sorted(os.listdir(directory))
+
+    def test_chunked_per_language_with_alternates_and_index(self):
+        self._sitemaps(1)
+        directory, names = self._sitemaps(2, site_dedup=True)
+        self.assertEqual(names, ["sitemap-en-1.xml", "sitemap-en-2.xml", "sitemap-fr-1.xml",
+                                 "sitemap-fr-2.xml", "sitemap-index.xml"])
+        index = etree.parse(os.path.join(directory, "sitemap-index.xml"))
+        self.assertEqual(index.xpath("//s:loc/text()", namespaces=self.NS)[0],
+                         f"https://ex.com{directory}/sitemap-en-1.xml")
+        urls = etree.parse(os.path.join(directory, "sitemap-fr-1.xml")).xpath("//s:url", namespaces=self.NS)
+        self.assertEqual(len(urls), 2)
+        out = f"https://ex.com/{os.path.join(self.tmp.name, 'out')}"
+        self.assertEqual(urls[0].findtext("s:loc", namespaces=self.NS), f"{out}/fr/a/index.html")
+        links = {link.get("hreflang"): link.get("href")
+                 for link in urls[0].findall("x:link", namespaces=self.NS)}
+        self.assertEqual(links, {
+            "de": "http://localhost/a/index.html",
+            "en": f"{out}/en/a/index.html",
+            "fr": f"{out}/fr/a/index.html",
+            "x-default": "http://localhost/a/index.html",
+        })
+        self.assertEqual(tc.STATS.get("sitemap_urls"), 6)
+
+    def test_only_chunks_listed_in_the_previous_index_are_removed(self):
+        directory, _ = self._sitemaps(1)
+        for name in ("sitemap-blog-1.xml", "sitemap-en-9.xml"):  # not ours / not listed
+            with open(os.path.join(directory, name), "w", encoding="utf-8") as fh:
+                fh.write("<urlset/>")
+        _, names = self._sitemaps(2)
+        self.assertEqual(names, ["sitemap-blog-1.xml", "sitemap-en-1.xml", "sitemap-en-2.xml",
+                                 "sitemap-en-9.xml", "sitemap-fr-1.xml", "sitemap-fr-2.xml",
+                                 "sitemap-index.xml"])
+
+    def test_no_relative_index_without_base_url_or_pages(self):
+        directory, names = self._sitemaps(1)
+        with open(os.path.join(directory, "sitemap-index.xml"), encoding="utf-8") as fh:
+            index = fh.read()
+        cfg = _cfg(target_langs=["en", "fr"], output_dir=os.path.join(self.tmp.name, "out"))
+        writer = tp.SitemapWriter(directory, "", tp.get_hreflang_map(cfg))
+        with self.assertLogs(tp.logger, "WARNING"):
+            writer.close()
+        self.assertEqual(sorted(os.listdir(directory)), names)
+        with open(os.path.join(directory, "sitemap-index.xml"), encoding="utf-8") as fh:
+            self.assertEqual(fh.read(), index)
+
+    def test_domain_mapping_applies_to_the_full_url(self):
+        hreflang_map = tp.HreflangMap("de", ["en"], "en", "i18n",
+                                      {"https://ex.com": "https://ex.org", "/i18n/en/blog/": "/en/news/"})
+        self.assertEqual(dict(hreflang_map.links("https://ex.com/blog/a.html")), {
+            "de": "https://ex.org/blog/a.html",
+            "en": "/en/news/a.html",  # spans the language prefix and the page path
+            "x-default": "/en/news/a.html",
+        })
+
+    def test_pages_skipped_as_done_stay_listed(self):
+        journal = os.path.join(self.tmp.name, "resume.jsonl")
+        open_journal = tp.ResumeJournal
+        with patch.object(ts, "ResumeJournal", lambda: open_journal(journal, legacy_path=None)):
+            self._sitemaps(10, resume=True)
+            directory, names = self._sitemaps(10, resume=True)
+        self.assertEqual(self.api_calls, 0)
+        urls = etree.parse(os.path.join(directory, "sitemap-en-1.xml")).xpath("//s:url", namespaces=self.NS)
+        self.assertEqual(len(urls), 3)
+
+
+class TestMockProvider(unittest.TestCase):
+
+    def setUp(self) -> None:
+        tc.STATS.reset()
+        tpr.reset_limiters()
+        tpr.reset_mock_adapter()
+
+    def tearDown(self) -> None:
+        tc.close_http_sessions()
+        tpr.reset_mock_adapter()
+
+    def _cfg(self, **mock):
+        return _cfg(api_provider="mock", rate_limit_backoff_seconds=1,
+                    rate_limits={"mock": {"requests_per_second": 1000}},
+                    mock_provider=dict({"latency_ms": 0}, **mock))
+
+    def test_in_process_provider_bills_successful_requests(self):
+        cfg = self._cfg(throttle_rate=0.5, seed=3)
+        for _ in range(4):
+            try:
+                out = tpr.translate_batch(["Hallo", "Welt"], "en-US", "de", cfg)
+            except tpr.TranslationError:
+                continue
+            self.assertEqual(out, ["[EN] Hallo", "[EN] Welt"])
+        self.assertGreater(tc.STATS.get("throttled_responses"), 0)
+        self.assertEqual(tc.STATS.get("mock_billed_chars"), 9 * tc.STATS.get("mock_requests"))
+
+    def test_http_stand_in_speaks_the_same_shapes(self):
+        import translate_bench
+
+        cfg = self._cfg()
+        server = translate_bench.start_http_stand_in(tpr.get_mock_adapter(cfg))
+        try:
+            cfg["mock_provider"]["url"] = f"http://127.0.0.1:{server.server_port}/v2/translate"
+            self.assertEqual(tpr.translate_batch(["Hallo"], "fr", "de", cfg), ["[FR] Hallo"])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestProviderRouting(unittest.TestCase):
+
+    def setUp(self) -> None:
+        tc.STATS.reset()
+        tpr.reset_limiters()
+        tpr.reset_router()
+        self.calls: list[str] = []
+        self.behaviour = {}
+
+    def tearDown(self) -> None:
+        tpr.reset_router()
+
+    def _provider(self, provider, texts, target_lang, source_lang, cfg):
+        self.calls.append(provider)
+        action = self.behaviour.get(provider)
+        if isinstance(action, Exception):
+            raise action
+        if action:
+            time.sleep(action)
+        return [f"{provider}:{t}" for t in texts]
+
+    def _translate(self, texts, **routing):
+        cfg = _cfg(routing=dict({"providers": ["deepl", "google", "llm"], "hedge_after_ms": 0},
+                                **routing))
+        with patch.object(tpr, "provider_translate", side_effect=self._provider):
+            return tpr.translate_batch(texts, "en", "de", cfg)
+
+    def test_exhausted_provider_fails_over_and_is_routed_around(self):
+        self.behaviour["deepl"] = tpr.ProviderUnavailable("quota exceeded (HTTP 456)")
+        self.assertEqual(self._translate(["Hallo"]), ["google:Hallo"])
+        self.assertEqual(self._translate(["Welt"]), ["google:Welt"])
+        self.assertEqual(self.calls, ["deepl", "google", "google"])
+        self.assertEqual(tc.STATS.get("route_failovers"), 1)
+        self.assertEqual(tc.STATS.get("provider_deepl_errors"), 1)
+
+    def test_batch_beyond_quota_goes_to_the_next_provider(self):
+        self.assertEqual(self._translate(["Hallo Welt"], quota_chars={"deepl": 5}),
+                         ["google:Hallo Welt"])
+        self.assertEqual(self.calls, ["google"])
+
+    def test_only_successful_requests_use_quota(self):
+        self.behaviour["deepl"] = tpr.TranslationError("deepl down")
+        self.assertEqual(self._translate(["Hallo"], quota_chars={"deepl": 8}), ["google:Hallo"])
+        router = tpr.get_router(_cfg())
+        self.assertEqual(router._health("deepl").chars_used, 0)
+        self.assertEqual(router._health("google").chars_used, 5)
+        # The failed request released its reservation: deepl can still take it.
+        self.assertEqual(router._health("deepl").chars_reserved, 0)
+        self.assertTrue(router._health("deepl").headroom(8))
+        self.assertEqual(tc.STATS.get("provider_deepl_chars_billed"), 0)
+
+    def test_slow_request_is_hedged(self):
+        self.behaviour["deepl"] = 0.5
+        started = time.monotonic()
+        self.assertEqual(self._translate(["Hallo"], hedge_after_ms=50), ["google:Hallo"])
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(tc.STATS.get("route_hedged"), 1)
+        self.assertEqual(tc.STATS.get("route_won_by_fallback"), 1)
+        self.assertEqual(tc.STATS.get("route_hedges_lost"), 1)  # deepl was already running
+
+    def test_every_provider_failing_raises(self):
+        for name in ("deepl", "google", "llm"):
+            self.behaviour[name] = tpr.TranslationError(f"{name} down")
+        with self.assertRaises(tpr.TranslationError):
+            self._translate(["Hallo"])
+        self.assertEqual(sorted(self.calls), ["deepl", "google", "llm"])
+
+
+class _LlmStandIn(BaseHTTPRequestHandler):
+    """
+    Streams numbered replies like a local chat model, as OpenAI SSE or
+    Ollama NDJSON. Strings in ``server.mangle`` come back without their
+    markup on first sight; strings in ``server.refuse`` never come back.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        lines = payload["messages"][-1]["content"].split("\n")
+        sources = [json.loads(line.split(": ", 1)[1]) for line in lines]
+        server = self.server
+        with server.lock:
+            server.requests.append(sources)
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+        time.sleep(server.latency)
+        reply = ["Sure, here are the translations:"]
+        for n, text in enumerate(sources, 1):
+            if text in server.refuse:
+                continue
+            out = f"[EN] {text}"
+            if text in server.mangle:
+                server.mangle.discard(text)
+                out = out.replace("<b>", "").replace("</b>", "")
+            reply.append(f"{n}: {json.dumps(out, ensure_ascii=False)}")
+        content = "\n".join(reply)
+        pieces = [content[i:i + 7] for i in range(0, len(content), 7)]  # split mid-line
+        ollama = self.path == "/api/chat"
+        with server.lock:
+            broken, server.broken = server.broken > 0, max(0, server.broken - 1)
+        if broken:
+            pieces.insert(1, None)  # a chunk that is not JSON
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson" if ollama else "text/event-stream")
+        self.end_headers()
+        for piece in pieces:
+            if piece is None:
+                event = "data: {not json"
+            elif ollama:
+                event = json.dumps({"message": {"role": "assistant", "content": piece}, "done": False})
+            else:
+                event = "data: " + json.dumps({"choices": [{"delta": {"content": piece}}]}) + "\n"
+            self.wfile.write(event.encode("utf-8") + b"\n")
+        self.wfile.write(b'{"done": true}\n' if ollama else b"data: [DONE]\n\n")
+        with server.lock:
+            server.active -= 1
+        self.close_connection = True
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class TestLlmProvider(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _LlmStandIn)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.mangle = set()
+        self.server.refuse = set()
+        self.server.broken = 0
+        self.server.latency = 0.0
+        self.server.active = self.server.peak = 0
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        tc.STATS.reset()
+        tpr.reset_limiters()
+
+    def tearDown(self) -> None:
+        tpr.shutdown_batch_executors()
+        tc.close_http_sessions()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _cfg(self, **llm):
+        return _cfg(api_provider="llm", rate_limit_backoff_seconds=1,
+                    llm_provider=dict({"url": f"http://127.0.0.1:{self.server.server_port}"}, **llm))
+
+    def test_parser_validates_lines_incrementally(self):
+        parser = tpr.NumberedOutputParser(["Hallo", "Die <b>Welt</b>", "{n} Server"])
+        for piece in ['Here you go:\n1: "Hel', 'lo"\n2: "The world"\n', '2: "The <b>world</b>"\n',
+                      '1: "Dup"\n7: "Out of range"\n3: {n} servers']:
+            parser.feed(piece)
+        self.assertEqual(parser.results, {0: "Hello", 1: "The <b>world</b>"})
+        self.assertFalse(parser.done)
+        parser.close()
+        self.assertTrue(parser.done)
+        self.assertEqual(parser.results[2], "{n} servers")
+        self.assertEqual(parser.invalid, 3)  # dropped markup, duplicate, out of range
+
+    def test_only_malformed_items_are_retried(self):
+        self.server.mangle = {"Die <b>Welt</b>"}
+        out = tpr.translate_batch(["Hallo", "Die <b>Welt</b>", "Zeile\nzwei"], "en", "de", self._cfg())
+        self.assertEqual(out, ["[EN] Hallo", "[EN] Die <b>Welt</b>", "[EN] Zeile\nzwei"])
+        self.assertEqual(self.server.requests[1:], [["Die <b>Welt</b>"]])
+        self.assertEqual(tc.STATS.get("llm_items_retried"), 1)
+
+    def test_malformed_chunk_is_retried_without_throttling(self):
+        self.server.broken = 1
+        cfg = self._cfg()
+        window = tpr.get_limiter("llm", cfg).window
+        out = tpr.translate_batch(["Hallo", "Welt"], "en", "de", cfg)
+        self.assertEqual(out, ["[EN] Hallo", "[EN] Welt"])
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertGreaterEqual(tpr.get_limiter("llm", cfg).window, window)  # never halved
+        self.assertEqual(tc.STATS.get("throttled_responses"), 0)
+        self.assertEqual(tc.STATS.get("provider_errors"), 1)
+
+    def test_ollama_native_stream(self):
+        out = tpr.translate_batch(["Hallo", "Welt"], "en", "de", self._cfg(api="ollama"))
+        self.assertEqual(out, ["[EN] Hallo", "[EN] Welt"])
+
+    def test_unanswered_string_falls_back_to_the_source(self):
+        self.server.refuse = {"Welt"}
+        failed: list[int] = []
+        out = tpr.translate_texts(["Hallo", "Welt"], "en", self._cfg(), failed)
+        self.assertEqual(out, ["[EN] Hallo", "Welt"])
+        self.assertEqual(failed, [1])
+        self.assertEqual(tc.STATS.get("untranslated"), 1)
+        self.assertEqual(len(self.server.requests), 3)  # max_retries attempts
+
+    def test_batches_stream_concurrently(self):
+        self.server.latency = 0.2
+        cfg = self._cfg()
+        cfg["batch_size"] = 2
+        texts = [f"Satz {i}" for i in range(8)]
+        self.assertEqual(tpr.translate_texts(texts, "en", cfg), [f"[EN] {t}" for t in texts])
+        self.assertGreater(self.server.peak, 1)
+
+
+class TestDictionaries(unittest.TestCase):
+
+    SOURCE = {"nav": {"home": "Home", "pricing": "Pricing", "about": "About us"},
+              "items": ["One", "Two"], "roast": {"joke": "Knock knock"}, "count": 3}
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.mkdtemp()
+        self.calls: list[tuple[str, list[str]]] = []
+        tc.STATS.reset()
+
+    def tearDown(self) -> None:
+        tpr.shutdown_batch_executors()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.tmpdir, name)
+
+    def _write(self, name: str, data, ascii_only: bool = False) -> None:
+        with open(self._path(name), "w", encoding="utf-8") as fh:
+            fh.write(json.dumps(data, indent=2, ensure_ascii=ascii_only) + "\n")
+
+    def _batch(self, texts, target_lang, source_lang, cfg):
+        self.calls.append((target_lang, list(texts)))
+        return [f"{target_lang}:{t}" for t in texts]
+
+    def _sync(self) -> None:
+        cfg = _cfg(dictionary_mode=True, dictionary_state=self._path("hashes.json"),
+                   dictionaries=[{"path": self._path("{lang}.json"), "source_lang": "en",
+                                  "skip_keys": ["roast"]}])
+        with patch.object(tpr, "translate_batch", side_effect=self._batch):
+            ts.run(cfg)
+
+    def _read(self, name: str):
+        with open(self._path(name), encoding="utf-8") as fh:
+            return fh.read()
+
+    def test_only_missing_and_stale_keys_are_sent(self):
+        self._write("en.json", self.SOURCE)
+        # "about" is missing, "pricing" is an untranslated copy of the source.
+        self._write("fr.json", {"nav": {"pricing": "Pricing", "home": "Accueil"},
+                                "items": ["Un", "Deux"], "extra": "garde"}, ascii_only=True)
+        self._write("nl.json", {})
+        self._sync()
+        sent = dict(self.calls)
+        self.assertEqual(sorted(sent["fr"]), ["About us", "Pricing"])
+        self.assertEqual(sent["nl"], ["Home", "Pricing", "About us", "One", "Two"])
+
+        fr = self._read("fr.json")
+        self.assertTrue(fr.isascii())  # the file's own escaping is kept
+        data = json.loads(fr)
+        self.assertEqual(list(data), ["nav", "items", "count", "extra"])
+        # Existing keys keep their order; new keys follow their source predecessor.
+        self.assertEqual(list(data["nav"]), ["pricing", "about", "home"])
+        self.assertEqual(data["nav"]["about"], "fr:About us")
+        self.assertNotIn("roast", data)
+        self.assertEqual(json.loads(self._read("nl.json"))["items"], ["nl:One", "nl:Two"])
+
+        # Nothing changed: no calls, no writes.
+        self.calls.clear()
+        before = self._read("fr.json")
+        self._sync()
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self._read("fr.json"), before)
+
+        # A changed source string is stale everywhere, including for keys
+        # translated before the sidecar existed.
+        source = json.loads(json.dumps(self.SOURCE))
+        source["nav"]["home"] = "Start page"
+        self._write("en.json", source)
+        self._sync()
+        self.assertEqual(dict(self.calls), {"fr": ["Start page"], "nl": ["Start page"]})
+        self.assertEqual(tc.STATS.get("dict_keys_stale"), 2)
+
+    def test_placeholders_are_masked_and_checked(self):
+        self._write("en.json", {"hits": "{count} results for {q}", "hi": "Hello {{name}}"})
+        self._write("fr.json", {})
+        self._sync()
+        self.assertEqual(sorted(dict(self.calls)["fr"]), [f"{M0} results for {M1}", f"Hello {M0}"])
+        self.assertEqual(json.loads(self._read("fr.json")),
+                         {"hits": "fr:{count} results for {q}", "hi": "fr:Hello {{name}}"})
+
+        # Without masking, a translation that loses a placeholder is rejected.
+        self._write("nl.json", {})
+        cfg = _cfg(dictionary_mode=True, dictionary_state=self._path("hashes.json"),
+                   protected_terms=False, target_langs=["nl"],
+                   dictionaries=[{"path": self._path("{lang}.json"), "source_lang": "en"}])
+        with patch.object(tpr, "translate_batch",
+                          side_effect=lambda texts, *a: [t.replace("{q}", "q") for t in texts]):
+            ts.run(cfg)
+        # The source stays in place, so the key is sent again next run.
+        self.assertEqual(json.loads(self._read("nl.json"))["hits"], "{count} results for {q}")
+        self.assertEqual(tc.STATS.get("translations_rejected"), 1)
+
+    def test_plain_strings_come_back_without_html_entities(self):
+        # Real providers answer in HTML: "&" as &amp;, and Google "'" as &#39;.
+        def provider(texts, target_lang, source_lang, cfg):
+            self.calls.append((target_lang, list(texts)))
+            return [f"{target_lang}:{t}".replace("'", "&#39;").replace('"', "&quot;")
+                    for t in texts]
+
+        self._write("en.json", {"terms": "Terms & Conditions", "quote": "Don't \"panic\"",
+                                "tag": "a < b &amp; c"})
+        self._write("fr.json", {})
+        cfg = _cfg(dictionary_mode=True, dictionary_state=self._path("hashes.json"),
+                   dictionaries=[{"path": self._path("{lang}.json"), "source_lang": "en"}])
+        with patch.object(tpr, "translate_batch", side_effect=provider):
+            ts.run(cfg)
+        self.assertIn("Terms &amp; Conditions", dict(self.calls)["fr"])
+        self.assertEqual(json.loads(self._read("fr.json")), {
+            "terms": "fr:Terms & Conditions", "quote": "fr:Don't \"panic\"",
+            "tag": "fr:a < b &amp; c",
+        })
+
+    def test_invalid_target_file_is_left_alone(self):
+        self._write("en.json", self.SOURCE)
+        with open(self._path("de.json"), "w", encoding="utf-8") as fh:
+            fh.write('{"nav": {"home": "Start"')
+        self._sync()
+        self.assertEqual(self._read("de.json"), '{"nav": {"home": "Start"')
+        self.assertEqual(tc.STATS.get("dict_files_skipped"), 1)
+
+    def test_atomic_writes_do_not_share_a_temp_file(self):
+        path = self._path("out/de.json")
+        texts = [str(i) * 5000 for i in range(8)]
+        threads = [threading.Thread(target=lambda t=t: [tc.write_atomic(path, t) for _ in range(20)])
+                   for t in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIn(self._read("out/de.json"), texts)
+        with patch.object(tc.os, "replace", side_effect=OSError("disk gone")):
+            with self.assertRaises(OSError):
+                tc.write_atomic(path, "lost")
+        self.assertEqual(os.listdir(self._path("out")), ["de.json"])
+
+
+class TestProtectedTerms(unittest.TestCase):
+
+    GLOSSARY = os.path.join(os.path.dirname(__file__), "..", "..", "locales", "glossary.json")
+
+    def setUp(self) -> None:
+        tc.STATS.reset()
+        tpr.reset_protectors()
+        self.sent: list[str] = []
+
+    def tearDown(self) -> None:
+        tpr.reset_protectors()
+
+    def _batch(self, texts, target_lang, source_lang, cfg):
+        self.sent.extend(texts)
+        return [f"{target_lang}:{t}" for t in texts]
+
+    def test_matcher_finds_whole_words_leftmost_longest(self):
+        matcher = tpr.TermMatcher(["Claw", "ClawGuru", "Guru Pro", "Intel Feed"])
+        text = "ClawGuru Pro, Intel Feeds und der ClawGuru-Scan"
+        self.assertEqual([text[a:b] for a, b in tpr._non_overlapping(matcher.spans(text))],
+                         ["ClawGuru", "ClawGuru"])
+
+    def test_glossary_terms_depend_on_the_target_language(self):
+        path = self.GLOSSARY
+        en = tpr.glossary_terms(path, "de", "en")
+        self.assertIn("ClawGuru", en)
+        self.assertIn("Zero Trust", en)  # the same in English …
+        self.assertNotIn("Zero Trust", tpr.glossary_terms(path, "de", "es"))  # … not in Spanish
+        self.assertNotIn("Zero Trust", tpr.glossary_terms(path, "de", "fi"))  # not listed: global only
+        self.assertIn("Moltbot", tpr.glossary_terms(path, "de", "fi"))
+
+    def test_protected_spans_are_masked_and_restored(self):
+        texts = ["ClawGuru prüft https://example.com/a?b=1 mit v2.4.1", "© 2026 – 99,9 %", "🚀 →",
+                 "Setze max_retries in config.json", "Moltbot"]
+        with patch.object(tpr, "translate_batch", side_effect=self._batch):
+            out = tpr.translate_texts(texts, "en", _cfg(glossary=""))
+        self.assertEqual(self.sent, [f"ClawGuru prüft {M0} mit {M1}", f"Setze {M0} in {M1}", "Moltbot"])
+        self.assertEqual(out, ["en:ClawGuru prüft https://example.com/a?b=1 mit v2.4.1",
+                               "© 2026 – 99,9 %", "🚀 →",
+                               "en:Setze max_retries in config.json", "en:Moltbot"])
+        self.assertEqual(tc.STATS.get("protected_strings_skipped"), 2)
+
+        tpr.reset_protectors()
+        self.sent.clear()
+        with patch.object(tpr, "translate_batch", side_effect=self._batch):
+            out = tpr.translate_texts(texts, "en", _cfg(glossary=self.GLOSSARY))
+        self.assertEqual(self.sent[0], f"{M0} prüft {M1} mit {M2}")
+        self.assertEqual(out[4], "Moltbot")  # nothing but a brand name: never sent
+        self.assertGreater(tc.STATS.get("protected_chars_saved"), 25)  # masks are 14 chars
+
+    def test_german_numbers_and_dates_are_not_masked(self):
+        protector = tpr.TermProtector([])
+        for text in ["Über 10.000 Nutzer", "Preis 1.299 Euro", "Stand: 12.05.2024",
+                     "Seit 1.1.2025 aktiv", "Version 1.299 kommt am 3.10.24"]:
+            self.assertEqual(protector.spans(text), [], text)
+        texts = ["Update auf v2.4.1", "Ab Version 3.2 neu", "Über 10.000 Nutzer"]
+        with patch.object(tpr, "translate_batch", side_effect=self._batch):
+            out = tpr.translate_texts(texts, "en", _cfg(glossary=""))
+        self.assertEqual(self.sent, [f"Update auf {M0}", f"Ab Version {M0} neu", "Über 10.000 Nutzer"])
+        self.assertEqual(out, [f"en:{t}" for t in texts])
+
+    def test_only_real_paths_are_masked(self):
+        protector = tpr.TermProtector([])
+        for text in ["Nur 9 €/Monat und Ein-/Ausgabe", "und/oder", "Die /home Seite",
+                     "Kosten pro Nutzer/Jahr"]:
+            self.assertEqual(protector.spans(text), [], text)
+        for text, path in [("Siehe /etc/nginx/nginx.conf.", "/etc/nginx/nginx.conf"),
+                           ('Datei "/robots.txt" prüfen', "/robots.txt"),
+                           ("/api/v1/ aufrufen", "/api/v1")]:
+            self.assertEqual([text[a:b] for a, b in protector.spans(text)], [path], text)
+        with patch.object(tpr, "translate_batch", side_effect=self._batch):
+            tpr.translate_texts(["Nur 9 €/Monat und Ein-/Ausgabe"], "en", _cfg(glossary=""))
+        self.assertEqual(self.sent, ["Nur 9 €/Monat und Ein-/Ausgabe"])
+
+    def test_masks_are_restored_from_html_handled_replies(self):
+        # What DeepL/Google HTML handling may make of <x id="0"></x>.
+        values = ["max_retries", "config.json"]
+        for reply in ['Set <x id="0"/> in <x id="1" />', 'Set <x id="0"> in <x id="1"></x>',
+                      'Set <x id="0"> in </x><x id="1"></x>', 'Set <x id="0"></x> in <x id="1">']:
+            self.assertEqual(tpr.TermProtector.unmask(reply, values),
+                             "Set max_retries in config.json", reply)
+        self.assertIsNone(tpr.TermProtector.unmask('Set <x id="0"></x> in', values))
+
+        def provider(texts, target_lang, source_lang, cfg):
+            return [t.replace("Setze ", "Set ").replace("></x> in", "> in</x>") for t in texts]
+
+        failed: list[int] = []
+        with patch.object(tpr, "translate_batch", side_effect=provider):
+            out = tpr.translate_texts(["Setze max_retries in config.json"], "en",
+                                      _cfg(glossary=""), failed)
+        self.assertEqual((out, failed), (["Set max_retries in config.json"], []))
+
+    def test_dropped_placeholder_keeps_the_source(self):
+        failed: list[int] = []
+        with patch.object(tpr, "translate_batch", return_value=["Use in"]):
+            out = tpr.translate_texts(["Setze max_retries in"], "en", _cfg(glossary=""), failed)
+        self.assertEqual(out, ["Setze max_retries in"])
+        self.assertEqual(failed, [0])
+
+    def test_can_be_disabled(self):
+        with patch.object(tpr, "translate_batch", side_effect=self._batch):
+            tpr.translate_texts(["© 2026", "ClawGuru v2.0"], "en", _cfg(protected_terms=False))
+        self.assertEqual(self.sent, ["© 2026", "ClawGuru v2.0"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+scripts/translate_bench.py
+==========================
+Benchmarks for scripts/translate_site.py that need no API key or network.
+
+Pages come from a local directory of HTML files (e.g. a static export of the
+site) or from a generated corpus shaped like our runbook pages: a full
+<head> with description/OpenGraph/Twitter meta, navigation, several
+sections of paragraphs, lists, tables, code blocks and a footer.
+
+Usage
+-----
+    python scripts/translate_bench.py extract [--corpus DIR | --pages N] [--merge-inline]
+    python scripts/translate_bench.py scale [--corpus DIR | --pages N] [--workers 0,1,2,4]
+    python scripts/translate_bench.py run [--pages N] [--langs M] [--latency-ms MS]
+                                          [--throttle-rate P] [--http] [--set KEY=JSON ...]
+
+Sub-commands
+------------
+    extract   – parse, extract and template every page; reports ms/page per stage
+                and items/characters per page (--merge-inline: inline segments)
+    scale     – build every page's template with parse_workers = each of --workers
+                (0: in the calling threads); reports pages/s and the speedup over 0
+    run       – full run() over the corpus against the mock provider (in-process,
+                or an HTTP stand-in with --http); reports pages/s, API calls,
+                characters sent/billed, estimated cost, peak RSS and per-stage
+                wall/CPU time.
+                --set overrides any config key, e.g. --set site_dedup=true, so
+                optimizations can be compared on the same corpus.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import translate_common as tc  # noqa: E402
+import translate_pipeline as tp  # noqa: E402
+import translate_providers as tpr  # noqa: E402
+import translate_site as ts  # noqa: E402
+
+# ---------------------------------------------------------------------------
+# Corpus
+# ---------------------------------------------------------------------------
+
+_WORDS = (
+    "Sicherheit Server Angriff Schutz Firewall Zugriff Konto Richtlinie Prüfung "
+    "Schwachstelle Härtung Protokoll Zertifikat Netzwerk Dienst Anmeldung Token "
+    "Datenbank Sicherung Wiederherstellung Überwachung Warnung Regel Benutzer "
+    "Konfiguration Verschlüsselung jetzt sofort automatisch für alle mit ohne & <"
+).split()
+
+
+def generate_page(i: int, sections: int = 8) -> str:
+    """A synthetic runbook page of roughly 15–20 KB."""
+    rng = random.Random(i)
+
+    def words(n: int) -> str:
+        return " ".join(rng.choice(_WORDS) for _ in range(n)).replace("&", "&amp;").replace("<", "&lt;")
+
+    body = []
+    for s in range(sections):
+        items = "".join(f"<li>{words(6)} <a href='/runbook/{i}/{s}/{j}'>{words(2)}</a></li>"
+                        for j in range(rng.randint(3, 8)))
+        rows = "".join(f"<tr><th>{words(1)}</th><td>{words(4)}</td><td><code>cfg_{j}</code></td></tr>"
+                       for j in range(rng.randint(2, 6)))
+        body.append(
+            f"<section id='s{s}'><h2>{words(4)}</h2>"
+            f"<p>{words(30)} <strong>{words(2)}</strong> {words(15)} <em>{words(1)}</em>.</p>"
+            f"<p>{words(25)}</p><ul>{items}</ul>"
+            f"<div class='note'><span>{words(3)}</span><div>{words(8)}</div></div>"
+            f"<pre><code>$ clawguru scan --target host-{s} # {words(3)}</code></pre>"
+            f"<table>{rows}</table>"
+            f"<img src='/img/{s}.png' alt='{words(4)}'></section>"
+        )
+    nav = "".join(f"<a href='/nav/{n}'>{words(1)}</a>" for n in range(12))
+    return (
+        "<!DOCTYPE html>\n<html lang=\"de\"><head><meta charset=\"utf-8\">"
+        f"<title>{words(6)} | ClawGuru</title>"
+        f"<meta name=\"description\" content=\"{words(20)}\">"
+        f"<meta property=\"og:title\" content=\"{words(6)}\">"
+        f"<meta property=\"og:description\" content=\"{words(18)}\">"
+        f"<meta name=\"twitter:title\" content=\"{words(6)}\">"
+        "<link rel=\"stylesheet\" href=\"/app.css\">"
+        "<script>window.__DATA__ = {\"page\": " + str(i) + "};</script>"
+        f"</head><body><header><nav>{nav}</nav></header>"
+        f"<main><h1>{words(7)}</h1>{''.join(body)}</main>"
+        f"<footer><p>© 2026 ClawGuru — {words(6)}</p><button>{words(2)}</button></footer>"
+        "</body></html>"
+    )
+
+
+def load_corpus(corpus: str | None, pages: int) -> list[tuple[str, str]]:
+    """Return (page_url, html) pairs from *corpus* or *pages* generated pages."""
+    if corpus:
+        return [(f"http://localhost{rel}", Path(path).read_text(encoding="utf-8", errors="replace"))
+                for path, rel in tp.collect_local_html_files(corpus)[:pages or None]]
+    return [(f"https://www.clawguru.com/de/runbook/{i}", generate_page(i)) for i in range(pages)]
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+def bench_extract(pages: list[tuple[str, str]], merge_inline: bool = False) -> dict[str, float]:
+    """Time parsing, node extraction and template building separately."""
+    parse = extract = template = 0.0
+    nodes = chars = 0
+    for page_url, html in pages:
+        t0 = time.perf_counter()
+        soup = BeautifulSoup(html, "lxml")
+        t1 = time.perf_counter()
+        found = tp.extract_text_nodes(soup, merge_inline)
+        t2 = time.perf_counter()
+        tp.PageTemplate.from_soup(soup, found)
+        t3 = time.perf_counter()
+        parse += t1 - t0
+        extract += t2 - t1
+        template += t3 - t2
+        nodes += len(found)
+        chars += sum(len(node.original) for node in found)
+        soup.decompose()
+    n = max(1, len(pages))
+    return {
+        "pages": len(pages),
+        "kb_per_page": round(sum(len(h) for _, h in pages) / n / 1024, 1),
+        "nodes_per_page": round(nodes / n, 1),
+        "chars_per_page": round(chars / n, 1),
+        "parse_ms_per_page": round(parse * 1000 / n, 3),
+        "extract_ms_per_page": round(extract * 1000 / n, 3),
+        "template_ms_per_page": round(template * 1000 / n, 3),
+    }
+
+
+def bench_scale(pages: list[tuple[str, str]], workers: list[int]) -> dict[str, Any]:
+    """Template throughput of the parse stage for each parse_workers value."""
+    results: dict[str, Any] = {"pages": len(pages), "cpus": os.cpu_count()}
+    baseline = None
+    for count in workers:
+        cfg = dict(ts.DEFAULT_CONFIG, parse_workers=count, log_level="WARNING")
+        tp.start_parse_pool(cfg)
+        try:
+            # Warm the pool up so process start-up is not timed.
+            for page_url, html in pages[:count]:
+                tp.parse_page_template(html, page_url, cfg)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max(1, count)) as pool:
+                built = sum(t is not None for t in pool.map(
+                    lambda page: tp.parse_page_template(page[1], page[0], cfg), pages))
+            elapsed = time.perf_counter() - started
+        finally:
+            tp.shutdown_parse_pool()
+        rate = built / elapsed if elapsed else 0.0
+        baseline = baseline or rate
+        results[f"workers_{count}"] = {
+            "pages_per_s": round(rate, 1),
+            "speedup": round(rate / baseline, 2) if baseline else None,
+        }
+    return results
+
+
+def start_http_stand_in(adapter: tpr.MockTranslationAdapter) -> ThreadingHTTPServer:
+    """Serve *adapter* over HTTP/1.1 keep-alive on a free local port."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self) -> None:
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            status, headers, body = adapter.respond(payload)
+            data = json.dumps(body).encode("utf-8") if body is not None else b""
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_run(pages: int, langs: int, overrides: dict[str, Any], http: bool = False) -> dict[str, Any]:
+    """Run translate_site.run() over *pages* generated pages into *langs* languages."""
+    target_langs = ["en", "fr", "es", "it", "nl", "pl", "pt", "sv", "da", "fi",
+                    "cs", "ro", "hu", "el", "bg", "sk", "sl", "et", "lv", "lt"][:langs]
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "src")
+        for i in range(pages):
+            path = os.path.join(src, "runbook", str(i), "index.html")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as fh:
+                fh.write(generate_page(i))
+
+        cfg = dict(ts.DEFAULT_CONFIG)
+        cfg.update({
+            "local_html_dir": src,
+            "output_dir": os.path.join(tmp, "out"),
+            "target_langs": target_langs,
+            "api_provider": "mock",
+            "resume": False,
+            "translation_memory": "",
+            "report_file": "",
+            "progress_interval_seconds": 0,
+            "log_level": "WARNING",
+        })
+        cfg.update(overrides)
+        server = None
+        if http:
+            server = start_http_stand_in(tpr.get_mock_adapter(cfg))
+            cfg["mock_provider"] = dict(cfg.get("mock_provider", {}),
+                                        url=f"http://127.0.0.1:{server.server_port}/v2/translate")
+        started = time.perf_counter()
+        try:
+            ts.run(cfg)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        elapsed = time.perf_counter() - started
+
+    stats = tc.STATS
+    price = tpr.price_per_million_chars("mock", cfg)
+    return {
+        "pages": pages,
+        "languages": len(target_langs),
+        "wall_s": round(elapsed, 3),
+        "pages_per_s": round(pages / elapsed, 2) if elapsed else None,
+        "api_calls": stats.get("api_calls"),
+        "chars_sent": stats.get("chars_sent"),
+        "chars_billed": stats.get("mock_billed_chars"),
+        "estimated_cost": round(stats.get("mock_billed_chars") * price / 1e6, 4),
+        "throttled_responses": stats.get("throttled_responses"),
+        "untranslated": stats.get("untranslated"),
+        "peak_rss_mb": ts.peak_rss_mb(),
+        "stages": stats.stages(),  # summed over worker threads
+    }
+
+
+def _parse_overrides(pairs: list[str]) -> dict[str, Any]:
+    overrides: dict[str, Any] = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for translate_site.py.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    extract = sub.add_parser("extract", help="parse/extract/template cost per page")
+    extract.add_argument("--corpus", help="directory of HTML files (default: generated pages)")
+    extract.add_argument("--pages", type=int, default=200, help="number of pages (default: 200)")
+    extract.add_argument("--merge-inline", action="store_true",
+                         help="extract inline segments (merge_inline_segments)")
+    scale = sub.add_parser("scale", help="parse-stage throughput per parse_workers value")
+    scale.add_argument("--corpus", help="directory of HTML files (default: generated pages)")
+    scale.add_argument("--pages", type=int, default=200, help="number of pages (default: 200)")
+    scale.add_argument("--workers", default="0,1,2,4",
+                       help="comma-separated parse_workers values (default: 0,1,2,4)")
+    run = sub.add_parser("run", help="end-to-end run against the mock provider")
+    run.add_argument("--pages", type=int, default=100, help="number of pages (default: 100)")
+    run.add_argument("--langs", type=int, default=3, help="number of target languages (default: 3)")
+    run.add_argument("--latency-ms", type=float, default=50, help="mock latency per request")
+    run.add_argument("--jitter-ms", type=float, default=10, help="mock latency jitter")
+    run.add_argument("--throttle-rate", type=float, default=0.0,
+                     help="share of requests answered with HTTP 429 (default: 0)")
+    run.add_argument("--http", action="store_true", help="use a local HTTP stand-in server")
+    run.add_argument("--set", action="append", default=[], metavar="KEY=JSON",
+                     help="override a config key (repeatable)")
+    args = parser.parse_args()
+
+    if args.command == "extract":
+        result = bench_extract(load_corpus(args.corpus, args.pages), args.merge_inline)
+    elif args.command == "scale":
+        result = bench_scale(load_corpus(args.corpus, args.pages),
+                             [int(w) for w in args.workers.split(",")])
+    else:
+        overrides = {"mock_provider": {"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms,
+                                       "throttle_rate": args.throttle_rate}}
+        overrides.update(_parse_overrides(args.set))
+        result = bench_run(args.pages, args.langs, overrides, http=args.http)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
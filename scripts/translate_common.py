@@ -0,0 +1,183 @@
+"""
+scripts/translate_common.py
+===========================
+Shared plumbing of translate_site.py and its subsystems: logging setup,
+pooled keep-alive HTTP sessions, run statistics and atomic file writes.
+"""
+
+import contextlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+
+# ---------------------------------------------------------------------------
+# Logging
+# ---------------------------------------------------------------------------
+
+def setup_logging(level_name: str) -> None:
+    level = getattr(logging, level_name.upper(), logging.INFO)
+    logging.basicConfig(
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        datefmt="%Y-%m-%dT%H:%M:%S",
+        level=level,
+    )
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# HTTP sessions
+# ---------------------------------------------------------------------------
+
+# One pooled keep-alive session per host (sitemap/page host, provider API).
+# Pools are sized to the pipeline's concurrency so workers never queue for a
+# connection or open throw-away ones.
+_http_sessions: dict[str, requests.Session] = {}
+_http_lock = threading.Lock()
+_http_pool_size = 10
+
+# gzip/deflate, plus br/zstd when urllib3 can decode them (brotli installed).
+_ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+
+
+def configure_http(cfg: dict[str, Any]) -> None:
+    """Size the connection pools for the configured worker counts."""
+    global _http_pool_size
+    _http_pool_size = int(cfg.get("http_pool_size") or max(
+        int(cfg.get("fetch_workers", 4)), int(cfg.get("max_inflight_batches", 4)), 1,
+    ))
+
+
+def http_session(url: str) -> requests.Session:
+    """Return the shared session for the host of *url*."""
+    parsed = urlparse(url)
+    host = f"{parsed.scheme}://{parsed.netloc}"
+    with _http_lock:
+        session = _http_sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=_http_pool_size,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["Accept-Encoding"] = _ACCEPT_ENCODING
+            _http_sessions[host] = session
+        return session
+
+
+def http_pool_stats() -> tuple[int, int]:
+    """Return (requests, new connections) over all pooled sessions."""
+    n_requests = n_connections = 0
+    with _http_lock:
+        for session in _http_sessions.values():
+            for adapter in {id(a): a for a in session.adapters.values()}.values():
+                if not isinstance(adapter, HTTPAdapter):
+                    continue
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    n_requests += pool.num_requests
+                    n_connections += pool.num_connections
+    return n_requests, n_connections
+
+
+def close_http_sessions() -> None:
+    """Record connection-reuse stats and close every pooled session."""
+    n_requests, n_connections = http_pool_stats()
+    STATS.add("http_requests", n_requests)
+    STATS.add("http_connections", n_connections)
+    with _http_lock:
+        for session in _http_sessions.values():
+            session.close()
+        _http_sessions.clear()
+
+# ---------------------------------------------------------------------------
+# Run statistics
+# ---------------------------------------------------------------------------
+
+class RunStats:
+    """Thread-safe named counters summarised at the end of a run."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: dict[str, int] = {}
+
+    def add(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get(self, name: str) -> int:
+        return self.counters.get(name, 0)
+
+    @contextlib.contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        """
+        Add the wall and CPU time of the block to ``stage_<stage>_us`` and
+        ``stage_<stage>_cpu_us`` and count it in ``stage_<stage>_count``.
+        CPU time is the calling thread's, so waiting on I/O costs none.
+        """
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall_us = int((time.perf_counter() - wall) * 1e6)
+            cpu_us = int((time.thread_time() - cpu) * 1e6)
+            with self._lock:
+                counters = self.counters
+                for name, value in ((f"stage_{stage}_us", wall_us),
+                                    (f"stage_{stage}_cpu_us", cpu_us),
+                                    (f"stage_{stage}_count", 1)):
+                    counters[name] = counters.get(name, 0) + value
+
+    def stages(self) -> dict[str, dict[str, float]]:
+        """{stage: {"wall_s", "cpu_s", "count"}} from the timed() counters."""
+        out: dict[str, dict[str, float]] = {}
+        for name, value in list(self.counters.items()):
+            if name.startswith("stage_") and name.endswith("_count"):
+                stage = name[len("stage_"):-len("_count")]
+                out[stage] = {
+                    "wall_s": round(self.get(f"stage_{stage}_us") / 1e6, 3),
+                    "cpu_s": round(self.get(f"stage_{stage}_cpu_us") / 1e6, 3),
+                    "count": value,
+                }
+        return dict(sorted(out.items()))
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+
+
+STATS = RunStats()
+
+# ---------------------------------------------------------------------------
+# Atomic file writes
+# ---------------------------------------------------------------------------
+
+def write_atomic(path: str, text: str) -> None:
+    """Replace *path* with *text* via a uniquely named temp file in the same directory."""
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=target.parent,
+                                     prefix=f".{target.name}.", suffix=".tmp",
+                                     delete=False) as fh:
+        tmp = fh.name
+        try:
+            fh.write(text)
+        except BaseException:
+            fh.close()
+            os.unlink(tmp)
+            raise
+    try:
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
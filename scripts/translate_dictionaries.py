@@ -0,0 +1,278 @@
+"""
+scripts/translate_dictionaries.py
+=================================
+Dictionary mode of translate_site.py: brings JSON locale files in line with
+their source language, sending only missing, empty or stale keys.
+"""
+
+import glob
+import html
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterator, NamedTuple
+
+from translate_common import STATS, write_atomic
+from translate_providers import text_hash, translate_texts
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Dictionary mode (JSON locale files)
+# ---------------------------------------------------------------------------
+
+# Matches a language code in a dictionary path pattern's {lang} slot.
+_LANG_SLOT = "(?P<lang>[a-z]{2,3}(?:-[A-Za-z0-9]+)?)"
+
+
+class DictionaryFile(NamedTuple):
+    """One source-language JSON file and the file it is translated into."""
+    source: str
+    target: str
+
+
+def _dictionary_regex(pattern: str) -> re.Pattern[str]:
+    escaped = re.escape(pattern).replace(r"\{lang\}", _LANG_SLOT)
+    return re.compile(escaped.replace(r"\*", "[^/]*") + "$")
+
+
+def discover_dictionary_files(group: dict[str, Any]) -> dict[str, list[DictionaryFile]]:
+    """
+    Expand a ``dictionaries`` entry into {target lang: files}. Target
+    languages are the group's ``target_langs`` or, by default, every
+    language that already has a file matching the pattern.
+    """
+    pattern = group["path"]
+    source_lang = group["source_lang"]
+    regex = _dictionary_regex(pattern)
+    found: set[str] = set()
+    for path in glob.glob(pattern.replace("{lang}", "*")):
+        match = regex.match(Path(path).as_posix())
+        if match:
+            found.add(match.group("lang"))
+    langs = group.get("target_langs") or sorted(found)
+    sources = sorted(Path(p).as_posix() for p in glob.glob(pattern.replace("{lang}", source_lang)))
+    files: dict[str, list[DictionaryFile]] = {}
+    for lang in langs:
+        if lang == source_lang:
+            continue
+        files[lang] = []
+        for source in sources:
+            match = regex.match(source)
+            if match:
+                start, end = match.span("lang")
+                files[lang].append(DictionaryFile(source, source[:start] + lang + source[end:]))
+    return files
+
+
+def _flatten_strings(node: Any, path: tuple = ()) -> Iterator[tuple[tuple, str]]:
+    """(path, value) of every string leaf; paths hold dict keys and list indices."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from _flatten_strings(value, path + (key,))
+    elif isinstance(node, list):
+        for index, value in enumerate(node):
+            yield from _flatten_strings(value, path + (index,))
+    elif isinstance(node, str):
+        yield path, node
+
+
+def _lookup(node: Any, path: tuple) -> Any:
+    for step in path:
+        if isinstance(node, dict) and isinstance(step, str):
+            node = node.get(step)
+        elif isinstance(node, list) and isinstance(step, int) and step < len(node):
+            node = node[step]
+        else:
+            return None
+    return node
+
+
+def _dictionary_key(path: tuple) -> str:
+    return ".".join(str(step) for step in path)
+
+
+def _merged_keys(source: dict[str, Any], target: dict[str, Any]) -> list[str]:
+    """Target keys in their own order, new source keys after their source predecessor."""
+    inserts: dict[str | None, list[str]] = {}
+    anchor: str | None = None
+    for key in source:
+        if key in target:
+            anchor = key
+        else:
+            inserts.setdefault(anchor, []).append(key)
+    keys = list(inserts.get(None, []))
+    for key in target:
+        keys.append(key)
+        keys.extend(inserts.get(key, []))
+    return keys
+
+
+def merge_dictionary(source: Any, target: Any, values: dict[tuple, str],
+                     skip: Callable[[tuple], bool], path: tuple = ()) -> Any:
+    """
+    Rebuild *target* with the shape of *source*: translated *values* are
+    set, existing entries and the target's key order are kept, and keys
+    only present in the target survive. Skipped sections stay as they are.
+    """
+    if isinstance(source, dict):
+        target = target if isinstance(target, dict) else {}
+        merged: dict[str, Any] = {}
+        for key in _merged_keys(source, target):
+            sub = path + (key,)
+            if key not in source or skip(sub):
+                if key in target:
+                    merged[key] = target[key]
+            else:
+                merged[key] = merge_dictionary(source[key], target.get(key), values, skip, sub)
+        return merged
+    if isinstance(source, list):
+        target = target if isinstance(target, list) else []
+        return [merge_dictionary(item, target[i] if i < len(target) else None, values, skip,
+                                 path + (i,))
+                for i, item in enumerate(source)]
+    if path in values:
+        return values[path]
+    if isinstance(source, str) and isinstance(target, str) and target.strip():
+        return target
+    return source if target is None else target
+
+
+def _dump_like(data: Any, raw: str) -> str:
+    """Serialize *data* in the layout of *raw* (indent, ASCII escapes, final newline)."""
+    indent = re.match(r"[{\[]\r?\n( +)", raw)
+    text = json.dumps(data, indent=len(indent.group(1)) if indent else 2,
+                      ensure_ascii=bool(raw) and raw.isascii())
+    return text + "\n" if not raw or raw.endswith("\n") else text
+
+
+def _read_json(path: str) -> tuple[Any, str] | None:
+    """(data, raw text) of *path*; ({}, "") when missing, None when unreadable."""
+    try:
+        raw = Path(path).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return {}, ""
+    except OSError as exc:
+        logger.error("Cannot read %s: %s", path, exc)
+        return None
+    try:
+        return json.loads(raw), raw
+    except ValueError as exc:
+        logger.error("Skipping %s – invalid JSON: %s", path, exc)
+        return None
+
+
+def _sync_dictionary_lang(lang: str, files: list[DictionaryFile], source_lang: str,
+                          skip: Callable[[tuple], bool], hashes: dict[str, dict[str, str]],
+                          cfg: dict[str, Any]) -> None:
+    """
+    Translate the missing and stale keys of every *files* target into
+    *lang* with one translate_texts call (packed, deduplicated batches),
+    then write each changed target atomically and update *hashes*.
+    """
+    jobs = []
+    texts: dict[str, int] = {}
+    for file in files:
+        loaded_source = _read_json(file.source)
+        loaded_target = _read_json(file.target)
+        if loaded_source is None or loaded_target is None:
+            STATS.add("dict_files_skipped")
+            continue
+        source, _ = loaded_source
+        target, raw = loaded_target
+        recorded = hashes.get(file.target, {})
+        current: dict[str, str] = {}
+        todo: list[tuple[tuple, str]] = []
+        for path, text in _flatten_strings(source):
+            if skip(path):
+                continue
+            key = _dictionary_key(path)
+            digest = text_hash(text).hex()
+            existing = _lookup(target, path)
+            if not isinstance(existing, str) or not existing.strip():
+                STATS.add("dict_keys_missing")
+            elif key in recorded:
+                if recorded[key] == digest:
+                    current[key] = digest
+                    continue
+                STATS.add("dict_keys_stale")
+            elif existing != text:
+                current[key] = digest  # translated before hashes were kept
+                continue
+            else:
+                STATS.add("dict_keys_missing")  # an untranslated copy of the source
+            todo.append((path, text))
+            texts.setdefault(text, len(texts))
+        jobs.append((file, source, target, raw, recorded, current, todo))
+
+    unique = list(texts)
+    failed: list[int] = []
+    if unique:
+        logger.info("Translating %d dictionary strings → %s", len(unique), lang)
+        # Providers take HTML (that is how masked terms survive), so plain UI
+        # strings are escaped on the way in and entities such as &amp; or
+        # &#39; in the replies are decoded before they reach the files.
+        sent = [html.escape(text, quote=False) for text in unique]
+        with STATS.timed("translate"):
+            translated = translate_texts(sent, lang, dict(cfg, source_lang=source_lang), failed)
+        translated = [html.unescape(text) for text in translated]
+    else:
+        translated = []
+    bad = set(failed)
+
+    for file, source, target, raw, recorded, current, todo in jobs:
+        values: dict[tuple, str] = {}
+        for path, text in todo:
+            key = _dictionary_key(path)
+            if texts[text] in bad:
+                if key in recorded:  # still stale – keep it marked as such
+                    current[key] = recorded[key]
+                continue
+            values[path] = translated[texts[text]]
+            current[key] = text_hash(text).hex()
+        STATS.add("dict_keys_translated", len(values))
+        text = _dump_like(merge_dictionary(source, target, values, skip), raw)
+        if text != raw:
+            with STATS.timed("write"):
+                write_atomic(file.target, text)
+            STATS.add("dict_files_written")
+        hashes[file.target] = current
+
+
+def run_dictionaries(cfg: dict[str, Any]) -> None:
+    """
+    Bring every target-language JSON dictionary in line with its source
+    file. Only keys that are missing, empty, untranslated copies of the
+    source, or whose source text changed since they were translated (per
+    the ``dictionary_state`` hash sidecar) are sent; languages run
+    concurrently (``translate_workers``).
+    """
+    state_path = str(cfg.get("dictionary_state") or ".translate_dictionaries.json")
+    loaded = _read_json(state_path)
+    hashes: dict[str, dict[str, str]] = loaded[0] if loaded else {}
+
+    units = []
+    for group in cfg.get("dictionaries", []):
+        prefixes = [tuple(p.split(".")) for p in group.get("skip_keys", [])]
+
+        def skip(path: tuple, prefixes: list[tuple] = prefixes) -> bool:
+            return any(path[:len(p)] == p for p in prefixes)
+
+        for lang, files in discover_dictionary_files(group).items():
+            units.append((lang, files, group["source_lang"], skip))
+    if not units:
+        logger.warning("No dictionary files found.")
+        return
+
+    workers = max(1, min(len(units), int(cfg.get("translate_workers", 4))))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="translate") as pool:
+        futures = [pool.submit(_sync_dictionary_lang, lang, files, source_lang, skip, hashes, cfg)
+                   for lang, files, source_lang, skip in units]
+        for future in futures:
+            future.result()
+
+    text = json.dumps(dict(sorted(hashes.items())), indent=2, sort_keys=True) + "\n"
+    if text != (loaded[1] if loaded else ""):
+        write_atomic(state_path, text)
@@ -0,0 +1,1802 @@
+"""
+scripts/translate_pipeline.py
+=============================
+The page side of translate_site.py: discovery (sitemap or local directory),
+fetching, extraction into page templates, hreflang links, output and
+sitemap writing, the resume journal and incremental state, and the
+concurrent fetch/translate/write pipeline or the site-wide dedup run.
+"""
+
+import contextlib
+import functools
+import gzip
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+from urllib.parse import urlparse
+from xml.sax.saxutils import escape as xml_escape
+from xml.sax.saxutils import quoteattr as xml_quoteattr
+
+import requests
+from bs4 import BeautifulSoup, Comment, NavigableString, Tag
+from bs4.formatter import HTMLFormatter
+from lxml import etree
+
+from translate_common import STATS, http_session, setup_logging, write_atomic
+from translate_providers import text_hash, translate_texts
+
+try:  # POSIX only – without it the journal is still safe for threads
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Sitemap parsing
+# ---------------------------------------------------------------------------
+
+_SITEMAP_DONE = object()
+# Entries are handed from the parser threads to the consumer in chunks.
+_SITEMAP_CHUNK = 256
+
+
+def _local_name(tag: Any) -> str:
+    """Tag name without its XML namespace."""
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _url_key(url: str) -> int:
+    """64-bit digest of a URL – what the dedup set stores instead of the URL."""
+    return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _parse_sitemap(url: str) -> Iterator[tuple[str, str, str | None]]:
+    """
+    Stream one sitemap and yield ("url" | "sitemap", loc, lastmod) entries.
+    Plain and gzip-compressed (.xml.gz) sitemaps are both accepted; parsed
+    elements are freed as soon as they have been read.
+    """
+    with http_session(url).get(url, timeout=30, stream=True) as resp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True  # undo Content-Encoding: gzip
+        resp.raw.auto_close = False     # EOF must not close it under the reader
+        stream: Any = io.BufferedReader(resp.raw)
+        if stream.peek(2)[:2] == b"\x1f\x8b":  # a .xml.gz file served as is
+            stream = gzip.GzipFile(fileobj=stream)
+        for _, elem in etree.iterparse(stream, events=("end",), tag=("{*}url", "{*}sitemap")):
+            loc = lastmod = None
+            for child in elem:
+                name = _local_name(child.tag)
+                if name == "loc":
+                    loc = (child.text or "").strip()
+                elif name == "lastmod":
+                    lastmod = (child.text or "").strip() or None
+            kind = _local_name(elem.tag)
+            elem.clear()
+            # Drop finished siblings in bulk so the tree never grows.
+            parent = elem.getparent()
+            if parent is not None and len(parent) > 64:
+                del parent[:-1]
+            if loc:
+                yield kind, loc, lastmod
+
+
+def iter_sitemap_entries(sitemap_url: str, workers: int = 4,
+                         buffer: int = 16) -> Iterator[tuple[str, str | None]]:
+    """
+    Yield (page URL, <lastmod> or None) from a sitemap or sitemap index.
+
+    Child sitemaps are fetched and parsed concurrently by *workers* threads;
+    URLs are yielded as soon as they are parsed (at most *buffer* chunks of
+    ``_SITEMAP_CHUNK`` entries are held ahead of the consumer). Duplicates are dropped using a set of 64-bit URL
+    digests rather than the URLs themselves.
+    """
+    out: queue.Queue = queue.Queue(maxsize=buffer)
+    stop = threading.Event()
+    lock = threading.Lock()
+    visited: set[int] = set()
+    submitted = 0
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="sitemap")
+
+    def _put(item: Any) -> None:
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _submit(url: str) -> None:
+        nonlocal submitted
+        key = _url_key(url)
+        with lock:
+            if key in visited:
+                return
+            visited.add(key)
+            submitted += 1
+        try:
+            executor.submit(_process, url)
+        except RuntimeError:  # consumer already stopped – executor shut down
+            pass
+
+    def _process(url: str) -> None:
+        chunk: list[tuple[str, str | None]] = []
+        try:
+            for kind, loc, lastmod in _parse_sitemap(url):
+                if kind == "sitemap":
+                    _submit(loc)
+                    continue
+                chunk.append((loc, lastmod))
+                if len(chunk) >= _SITEMAP_CHUNK:
+                    if stop.is_set():
+                        return
+                    _put(chunk)
+                    chunk = []
+            if chunk:
+                _put(chunk)
+        except (requests.RequestException, etree.LxmlError, OSError, EOFError, ValueError) as exc:
+            logger.error("Failed to fetch sitemap %s: %s", url, exc)
+        finally:
+            _put(_SITEMAP_DONE)
+
+    seen: set[int] = set()
+    finished = 0
+    _submit(sitemap_url)
+    try:
+        while True:
+            item = out.get()
+            if item is _SITEMAP_DONE:
+                finished += 1
+                with lock:
+                    if finished == submitted:
+                        return
+                continue
+            for entry in item:
+                key = _url_key(entry[0])
+                if key not in seen:
+                    seen.add(key)
+                    yield entry
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
+
+def fetch_sitemap_entries(sitemap_url: str, workers: int = 4) -> list[tuple[str, str | None]]:
+    """
+    Fetch all page URLs from a sitemap or sitemap index.
+    Returns a deduplicated list of (page URL, <lastmod> or None).
+    """
+    result = list(iter_sitemap_entries(sitemap_url, workers))
+    logger.info("Discovered %d URLs from sitemap.", len(result))
+    return result
+
+
+def fetch_urls_from_sitemap(sitemap_url: str) -> list[str]:
+    """Return the deduplicated page URLs of a sitemap or sitemap index."""
+    return [url for url, _ in fetch_sitemap_entries(sitemap_url)]
+
+
+def iter_local_html_files(directory: str) -> Iterator[tuple[str, str]]:
+    """
+    Yield (file_path, relative_url) for every .html / .htm file below
+    *directory*, depth first in name order: the files of a directory come
+    before its subdirectories. Only one directory listing is held at a
+    time, so the first page is ready before the walk finishes. Symlinked
+    directories are not followed (a link cycle would never end); symlinked
+    files are yielded.
+    """
+    base = os.path.realpath(directory)
+    stack = [(base, "/")]
+    found = 0
+    while stack:
+        path, url = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as exc:
+            logger.warning("Cannot list %s: %s", path, exc)
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append((entry.path, f"{url}{entry.name}/"))
+            elif entry.name.endswith((".html", ".htm")) and entry.is_file():
+                found += 1
+                yield entry.path, url + entry.name
+        # Reversed, so the stack pops them in name order.
+        stack.extend(reversed(subdirs))
+    logger.info("Found %d local HTML files in %s.", found, directory)
+
+
+def collect_local_html_files(directory: str) -> list[tuple[str, str]]:
+    """All (file_path, relative_url) pairs of iter_local_html_files() as a list."""
+    return list(iter_local_html_files(directory))
+
+# ---------------------------------------------------------------------------
+# HTML fetching / loading
+# ---------------------------------------------------------------------------
+
+def fetch_html(url: str) -> str | None:
+    """Fetch a URL and return its HTML text, or None on failure."""
+    try:
+        resp = http_session(url).get(url, timeout=30)
+        resp.raise_for_status()
+        STATS.add("bytes_fetched", len(resp.content))
+        return resp.text
+    except requests.RequestException as exc:
+        logger.error("Failed to fetch %s: %s", url, exc)
+        return None
+
+
+def load_html(path: str) -> str | None:
+    """Read a local HTML file and return its text, or None on failure."""
+    try:
+        STATS.add("bytes_fetched", os.path.getsize(path))
+        return Path(path).read_text(encoding="utf-8", errors="replace")
+    except OSError as exc:
+        logger.error("Failed to read %s: %s", path, exc)
+        return None
+
+# ---------------------------------------------------------------------------
+# Text extraction
+# ---------------------------------------------------------------------------
+
+# Tags whose visible text content should be translated
+_TRANSLATE_TAGS = frozenset({
+    "p", "h1", "h2", "h3", "h4", "h5", "h6",
+    "li", "td", "th", "caption", "blockquote",
+    "dt", "dd", "figcaption", "label", "button",
+    "span", "a", "strong", "em", "b", "i",
+    "div",  # only leaf div nodes (no nested block children)
+})
+
+# Tags whose content we skip entirely
+_SKIP_TAGS = frozenset({"script", "style", "noscript", "code", "pre", "svg"})
+
+# Parents whose direct text is collected – the check done per string.
+_TEXT_PARENT_TAGS = _TRANSLATE_TAGS - _SKIP_TAGS
+
+_BLOCK_TAGS = frozenset({"p", "div", "section", "article", "header", "footer",
+                         "aside", "ul", "ol", "table", "blockquote", "pre"})
+
+
+# Inline tags merged into their block's segment in merge_inline mode, and
+# the block elements such a segment belongs to.
+_INLINE_TAGS = frozenset({"span", "a", "strong", "em", "b", "i", "br"})
+_SEGMENT_TAGS = _TEXT_PARENT_TAGS - _INLINE_TAGS
+
+
+def _is_leaf_text_node(tag: Tag) -> bool:
+    """Return True if *tag* has no block-level children (treat it as a leaf)."""
+    for child in tag.children:
+        if isinstance(child, Tag) and child.name in _BLOCK_TAGS:
+            return False
+    return True
+
+
+class TextNode:
+    """Represents a single translatable piece of text found in the HTML."""
+    __slots__ = ("original", "node_ref", "attr", "markup")
+
+    def __init__(self, original: str, node_ref: Any, attr: str | None = None,
+                 markup: list[str] | None = None):
+        self.original = original  # stripped text, or an inline HTML segment
+        self.node_ref = node_ref  # NavigableString or Tag
+        self.attr = attr          # attribute name if this is an attribute value
+        self.markup = markup      # original inline tags of a segment (see inline_segment)
+
+
+def inline_segment(soup: BeautifulSoup, block: Tag) -> TextNode | None:
+    """
+    Merge *block*'s inline content into one HTML segment, or return None
+    when the block holds anything but text and inline tags, or fewer than
+    two pieces of text (nothing to gain).
+
+    Inline tags are sent in a compact form – ``<a i="0">…</a>`` – and their
+    original opening tags (attributes and all) are kept in ``markup`` for
+    restore_inline_markup; the provider never sees or alters an href.
+    """
+    pieces = 0
+    for element in block.descendants:
+        if isinstance(element, Tag):
+            if element.name not in _INLINE_TAGS:
+                return None
+        elif type(element) is not NavigableString:  # comments, CDATA, …
+            return None
+        elif element.strip():
+            pieces += 1
+    if pieces < 2:
+        return None
+
+    parts: list[str] = []
+    markup: list[str] = []
+
+    def _walk(tag: Tag) -> None:
+        for child in tag.children:
+            if not isinstance(child, Tag):
+                parts.append(_FORMATTER.substitute(str(child)))
+                continue
+            opening = str(soup.new_tag(child.name, attrs=dict(child.attrs)))
+            index = len(markup)
+            if child.is_empty_element:
+                markup.append(opening)
+                parts.append(f'<{child.name} i="{index}"/>')
+                continue
+            markup.append(opening[:-len(f"</{child.name}>")])
+            parts.append(f'<{child.name} i="{index}">')
+            _walk(child)
+            parts.append(f"</{child.name}>")
+
+    _walk(block)
+    return TextNode("".join(parts).strip(), block, markup=markup)
+
+
+_INLINE_TAG_RE = re.compile(r'<(/?)([A-Za-z][\w-]*)(?:\s+i="(\d+)")?\s*(/?)>|<')
+
+
+def restore_inline_markup(segment: str, markup: list[str]) -> str | None:
+    """
+    Put the original opening tags back into a translated inline *segment*.
+    Returns None unless every tag comes back exactly once and properly
+    nested – a mangled segment must not break the page.
+    """
+    out: list[str] = []
+    stack: list[str] = []
+    used = [False] * len(markup)
+    pos = 0
+    for match in _INLINE_TAG_RE.finditer(segment):
+        closing, name, index, void = match.groups()
+        if name is None:
+            return None  # a stray "<" – providers escape text, so markup is broken
+        out.append(segment[pos:match.start()])
+        pos = match.end()
+        if closing:
+            if not stack or stack.pop() != name.lower():
+                return None
+            out.append(f"</{name.lower()}>")
+            continue
+        if index is None or int(index) >= len(markup) or used[int(index)]:
+            return None
+        original = markup[int(index)]
+        is_void = original.endswith("/>")
+        if not original.startswith(f"<{name.lower()}") or (void and not is_void):
+            return None
+        used[int(index)] = True
+        if not is_void:
+            stack.append(name.lower())
+        out.append(original)
+    out.append(segment[pos:])
+    return "".join(out) if not stack and all(used) else None
+
+
+def _end_of_subtree(tag: Tag) -> Any:
+    """The first element after *tag*'s subtree in document order (or None)."""
+    node: Any = tag
+    while node is not None:
+        if node.next_sibling is not None:
+            return node.next_sibling
+        node = node.parent
+    return None
+
+
+def extract_text_nodes(soup: BeautifulSoup, merge_inline: bool = False) -> list[TextNode]:
+    """
+    Walk the parsed HTML tree once and collect all translatable text nodes.
+    With *merge_inline*, a block whose content is only text and inline tags
+    becomes one segment (see inline_segment) instead of a node per string.
+
+    Covers, in this order:
+    - <title> text
+    - <meta name="description"> content attribute
+    - <meta property="og:*"> content attribute
+    - <meta name="twitter:*"> content attribute
+    - alt attributes on <img> tags
+    - visible text inside standard HTML elements
+    """
+    title_tag: Tag | None = None
+    metas: list[TextNode] = []
+    alts: list[TextNode] = []
+    texts: list[TextNode] = []
+    in_body = False
+    body_seen = False
+    body_end: Any = None
+    segment_end: Any = None
+
+    for element in soup.descendants:
+        if in_body and element is body_end:
+            in_body = False
+        if segment_end is not None:
+            if element is not segment_end:
+                continue  # inside a merged segment
+            segment_end = None
+        if isinstance(element, Tag):
+            name = element.name
+            if merge_inline and in_body and name in _SEGMENT_TAGS:
+                segment = inline_segment(soup, element)
+                if segment is not None:
+                    texts.append(segment)
+                    segment_end = _end_of_subtree(element)
+                    if segment_end is None:
+                        break
+                    continue
+            if name == "meta":
+                attrs = element.attrs
+                content = attrs.get("content", "").strip()
+                if not content:
+                    continue
+                meta_name = attrs.get("name", "").lower()
+                # "keywords" is intentionally excluded – it contains comma-separated
+                # terms that are best left in the source language for SEO consistency.
+                if (meta_name == "description" or meta_name.startswith("twitter:")
+                        or attrs.get("property", "").lower().startswith("og:")):
+                    metas.append(TextNode(content, element, "content"))
+            elif name == "img":
+                alt = element.attrs.get("alt", "").strip()
+                if alt:
+                    alts.append(TextNode(alt, element, "alt"))
+            elif name == "title":
+                if title_tag is None:
+                    title_tag = element
+            elif name == "body" and not body_seen:
+                body_seen = in_body = True
+                body_end = _end_of_subtree(element)
+        elif in_body and element.parent.name in _TEXT_PARENT_TAGS:
+            if isinstance(element, Comment):
+                continue
+            clean = element.strip()
+            if clean:
+                texts.append(TextNode(clean, element))
+
+    nodes: list[TextNode] = []
+    if title_tag is not None:
+        string = title_tag.string
+        if string:
+            clean = string.strip()
+            if clean:
+                nodes.append(TextNode(clean, string))
+    nodes += metas
+    nodes += alts
+    nodes += texts
+    return nodes
+
+# ---------------------------------------------------------------------------
+# Applying translations back to the HTML tree
+# ---------------------------------------------------------------------------
+
+def apply_translations(nodes: list[TextNode], translated: list[str]) -> None:
+    """Write translated strings back into the BeautifulSoup tree."""
+    assert len(nodes) == len(translated), (
+        f"Node/translation count mismatch: expected {len(nodes)}, got {len(translated)}"
+    )
+    for node, trans in zip(nodes, translated):
+        if not trans:
+            continue
+        if node.attr is not None:
+            # Attribute-based node (meta content, img alt, etc.)
+            node.node_ref[node.attr] = trans
+        elif node.markup is not None:
+            # Inline segment – replace the block's content with the fragment
+            restored = restore_inline_markup(trans, node.markup)
+            if restored is None:
+                STATS.add("inline_segments_rejected")
+                continue
+            inner = node.node_ref.decode_contents()
+            stripped = inner.strip()
+            start = len(inner) - len(inner.lstrip())
+            fragment = BeautifulSoup(inner[:start] + restored + inner[start + len(stripped):],
+                                     "html.parser")
+            node.node_ref.clear()
+            node.node_ref.extend(list(fragment.contents))
+        else:
+            # NavigableString – replace in place
+            node.node_ref.replace_with(trans)
+
+# ---------------------------------------------------------------------------
+# hreflang injection
+# ---------------------------------------------------------------------------
+
+class HreflangMap:
+    """
+    The alternate URLs of every page – one per language plus x-default –
+    for the run's languages, output_dir and domain_mapping. Each page's set
+    is computed once, then shared by its hreflang tags and its sitemap
+    entries in every language. domain_mapping applies to each full URL, so
+    a mapping may span the language prefix and the page path.
+    """
+
+    def __init__(self, source_lang: str, target_langs: list[str], x_default: str,
+                 output_dir: str, domain_mapping: dict[str, str]):
+        self.source_lang = source_lang
+        self.langs = [source_lang] + list(target_langs)
+        self.x_default = x_default
+        self.domain_mapping = domain_mapping
+        # Translated pages live at /{output_dir}/{lang}/{path}
+        self._prefixes = {lang: f"/{output_dir}/{lang}"
+                          for lang in self.langs + [x_default] if lang != source_lang}
+        self.links = functools.lru_cache(maxsize=1024)(self._links)
+
+    def map_domains(self, href: str) -> str:
+        for orig_domain, new_domain in self.domain_mapping.items():
+            href = href.replace(orig_domain, new_domain)
+        return href
+
+    def _links(self, page_url: str) -> tuple[tuple[str, str], ...]:
+        """(hreflang, href) of *page_url* in every language, then x-default."""
+        path = urlparse(page_url).path
+        links = [(lang, self.map_domains(page_url if lang == self.source_lang
+                                         else self._prefixes[lang] + path))
+                 for lang in self.langs]
+        # x-default: the page itself (unmapped) when it is the source language.
+        links.append(("x-default", page_url if self.x_default == self.source_lang
+                      else self.map_domains(self._prefixes[self.x_default] + path)))
+        return tuple(links)
+
+
+_hreflang_maps: dict[tuple, HreflangMap] = {}
+_hreflang_maps_lock = threading.Lock()
+
+
+def get_hreflang_map(cfg: dict[str, Any]) -> HreflangMap:
+    """The shared HreflangMap for the languages and paths of *cfg*."""
+    x_default = cfg.get("hreflang_options", {}).get("x_default_lang", cfg["source_lang"])
+    mapping = cfg.get("domain_mapping", {})
+    key = (cfg["source_lang"], tuple(cfg["target_langs"]), x_default, cfg["output_dir"],
+           tuple(mapping.items()))
+    with _hreflang_maps_lock:
+        hreflang_map = _hreflang_maps.get(key)
+        if hreflang_map is None:
+            hreflang_map = _hreflang_maps[key] = HreflangMap(
+                cfg["source_lang"], cfg["target_langs"], x_default, cfg["output_dir"], mapping)
+        return hreflang_map
+
+
+def append_hreflang_links(soup: BeautifulSoup, links: Iterable[tuple[str, str]]) -> None:
+    """Append <link rel="alternate" hreflang="…"> tags for *links* to the <head>."""
+    head = soup.find("head")
+    if head is None:
+        return
+    for lang, href in links:
+        head.append(soup.new_tag("link", rel="alternate", hreflang=lang, href=href))
+
+
+def inject_hreflang_tags(soup: BeautifulSoup, page_url: str,
+                         source_lang: str, target_langs: list[str],
+                         x_default: str, output_dir: str,
+                         domain_mapping: dict[str, str]) -> None:
+    """
+    Inject <link rel="alternate" hreflang="…"> tags into the <head>.
+    All alternate URLs are constructed from the output_dir path convention.
+    """
+    hreflang_map = HreflangMap(source_lang, target_langs, x_default, output_dir, domain_mapping)
+    append_hreflang_links(soup, hreflang_map.links(page_url))
+
+# ---------------------------------------------------------------------------
+# Page templates (parse once, render every language)
+# ---------------------------------------------------------------------------
+
+# Slot markers are Unicode noncharacters, which never occur in real content
+# (unlike private-use code points, which icon fonts use).
+_TEXT_MARK = "\ufdd0{}\ufdd1"
+_ATTR_MARK = "\ufdd2{}\ufdd3"
+_LANG_MARK = "\ufdd4"
+_SEGMENT_MARK = "\ufdd5{}\ufdd6"
+# Attribute markers are matched together with the quotes bs4 puts around them.
+_SLOT_RE = re.compile('"\ufdd2(\\d+)\ufdd3"|\ufdd0(\\d+)\ufdd1|"\ufdd4"|\ufdd5(\\d+)\ufdd6')
+
+_SLOT_TEXT = 0
+_SLOT_ATTR = 1
+_SLOT_LANG = 2
+_SLOT_SEGMENT = 3
+
+# The formatter str(soup) uses – rendering must escape exactly like it.
+_FORMATTER = HTMLFormatter.REGISTRY["minimal"]
+
+
+class PageTemplate:
+    """
+    A page reduced to literal HTML segments around translatable slots.
+
+    Built once per page from the parsed soup; rendering a language is a
+    string join, so no language ever re-fetches or re-parses the page.
+    ``render`` produces exactly what applying the translations to the soup
+    and calling ``str(soup)`` would.
+    """
+    __slots__ = ("originals", "raw", "literals", "slots", "markup")
+
+    def __init__(self, originals: list[str], raw: list[str],
+                 literals: list[str], slots: list[tuple[int, int]],
+                 markup: dict[int, list[str]] | None = None):
+        self.originals = originals  # stripped strings (or inline segments) to translate
+        self.raw = raw              # untouched values, used when a translation is empty
+        self.literals = literals    # len(slots) + 1 HTML fragments
+        self.slots = slots          # (kind, node index) between consecutive literals
+        self.markup = markup or {}  # node index → original inline tags of a segment
+
+    @classmethod
+    def from_soup(cls, soup: BeautifulSoup, nodes: list[TextNode]) -> "PageTemplate":
+        """Replace *nodes* (and <html lang>) with markers and serialize once."""
+        if not nodes:
+            return cls([], [], [str(soup)], [])
+
+        raw: list[str] = []
+        markup: dict[int, list[str]] = {}
+        for i, node in enumerate(nodes):
+            if node.attr is not None:
+                raw.append(node.node_ref[node.attr])
+                node.node_ref[node.attr] = _ATTR_MARK.format(i)
+            elif node.markup is not None:
+                # The segment's surrounding whitespace stays in the literals.
+                inner = node.node_ref.decode_contents()
+                stripped = inner.strip()
+                start = len(inner) - len(inner.lstrip())
+                raw.append(stripped)
+                markup[i] = node.markup
+                node.node_ref.clear()
+                node.node_ref.append(inner[:start] + _SEGMENT_MARK.format(i)
+                                     + inner[start + len(stripped):])
+            else:
+                raw.append(str(node.node_ref))
+                node.node_ref.replace_with(_TEXT_MARK.format(i))
+
+        html_tag = soup.find("html")
+        if html_tag and isinstance(html_tag, Tag):
+            html_tag["lang"] = _LANG_MARK
+
+        serialized = str(soup)
+        literals: list[str] = []
+        slots: list[tuple[int, int]] = []
+        pos = 0
+        for match in _SLOT_RE.finditer(serialized):
+            literals.append(serialized[pos:match.start()])
+            if match.group(1) is not None:
+                slots.append((_SLOT_ATTR, int(match.group(1))))
+            elif match.group(2) is not None:
+                slots.append((_SLOT_TEXT, int(match.group(2))))
+            elif match.group(3) is not None:
+                slots.append((_SLOT_SEGMENT, int(match.group(3))))
+            else:
+                slots.append((_SLOT_LANG, -1))
+            pos = match.end()
+        literals.append(serialized[pos:])
+
+        if sum(1 for kind, _ in slots if kind != _SLOT_LANG) != len(nodes):
+            raise ValueError("Page contains Unicode noncharacters used as slot markers")
+        return cls([n.original for n in nodes], raw, literals, slots, markup)
+
+    def render(self, translated: list[str] | None, lang: str) -> str:
+        """Return the page HTML with *translated* strings and <html lang="{lang}">."""
+        out = [self.literals[0]]
+        for (kind, idx), literal in zip(self.slots, self.literals[1:]):
+            if kind == _SLOT_LANG:
+                value = lang
+            elif kind == _SLOT_SEGMENT:
+                value = translated[idx] if translated else None
+                if value:
+                    value = restore_inline_markup(value, self.markup[idx])
+                    if value is None:
+                        STATS.add("inline_segments_rejected")
+                out.append(value or self.raw[idx])
+                out.append(literal)
+                continue
+            else:
+                value = (translated[idx] if translated else None) or self.raw[idx]
+            if kind == _SLOT_TEXT:
+                out.append(_FORMATTER.substitute(value))
+            else:
+                out.append(_FORMATTER.quoted_attribute_value(_FORMATTER.attribute_value(value)))
+            out.append(literal)
+        return "".join(out)
+
+# ---------------------------------------------------------------------------
+# Output path computation
+# ---------------------------------------------------------------------------
+
+def output_path_for(page_url: str, lang: str, output_dir: str) -> Path:
+    """
+    Given a page URL and a language code, return the local file path where
+    the translated HTML should be written.
+
+    Examples:
+      https://example.com/       -> i18n/en/index.html
+      https://example.com/about  -> i18n/en/about/index.html
+      https://example.com/a/b/   -> i18n/en/a/b/index.html
+    """
+    parsed = urlparse(page_url)
+    path = parsed.path.rstrip("/") or "/"
+
+    if path == "/":
+        rel = "index.html"
+    elif path.endswith(".html") or path.endswith(".htm"):
+        rel = path.lstrip("/")
+    else:
+        rel = path.lstrip("/") + "/index.html"
+
+    return Path(output_dir) / lang / rel
+
+
+def output_path_for_local(rel_url: str, lang: str, output_dir: str) -> Path:
+    """Same as output_path_for but for a local relative URL."""
+    return output_path_for(f"http://localhost{rel_url}", lang, output_dir)
+
+# ---------------------------------------------------------------------------
+# Output writing
+# ---------------------------------------------------------------------------
+
+class OutputWriter:
+    """
+    Writes translated pages, leaving files whose content is unchanged alone
+    so their mtime – and the deploy and CDN purge keyed on it – stays put.
+
+    Changed files are written to a temporary file next to the target and
+    renamed over it, so a crash never leaves a truncated page behind. Each
+    output directory is created once per run. With *manifest_path* every
+    output file is recorded as one JSON line {"path", "sha256", "written"}
+    (path relative to *output_dir*); the manifest is renamed into place by
+    close(), so downstream deploys can upload just the written files.
+    """
+
+    def __init__(self, output_dir: str, manifest_path: str = ""):
+        self.output_dir = output_dir
+        self.manifest_path = manifest_path
+        self._lock = threading.Lock()
+        self._dirs: set[Path] = set()
+        self._manifest = None
+        if manifest_path:
+            Path(manifest_path).parent.mkdir(parents=True, exist_ok=True)
+            self._manifest = open(f"{manifest_path}.tmp", "w", encoding="utf-8")
+
+    def write(self, out_file: Path, html: str) -> bool:
+        """Write *out_file* unless it already holds *html*; False on failure."""
+        data = html.encode("utf-8")
+        try:
+            written = not _same_content(out_file, data)
+            if written:
+                self._make_dir(out_file.parent)
+                tmp = out_file.with_name(f".{out_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                try:
+                    tmp.write_bytes(data)
+                    os.replace(tmp, out_file)
+                except OSError:
+                    with contextlib.suppress(OSError):
+                        tmp.unlink()
+                    raise
+        except OSError as exc:
+            logger.error("Failed to write %s: %s", out_file, exc)
+            return False
+        if written:
+            logger.info("Written: %s", out_file)
+            STATS.add("files_written")
+        else:
+            logger.debug("Unchanged: %s", out_file)
+            STATS.add("files_unchanged")
+        if self._manifest is not None:
+            rel = os.path.relpath(out_file, self.output_dir).replace(os.sep, "/")
+            line = json.dumps({"path": rel, "sha256": hashlib.sha256(data).hexdigest(),
+                               "written": written}, ensure_ascii=False)
+            with self._lock:
+                self._manifest.write(line + "\n")
+        return True
+
+    def _make_dir(self, directory: Path) -> None:
+        if directory in self._dirs:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._dirs.add(directory)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._manifest is None:
+                return
+            self._manifest.close()
+            self._manifest = None
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+        logger.info("Output manifest written to %s", self.manifest_path)
+
+
+def _same_content(path: Path, data: bytes) -> bool:
+    """Whether *path* exists and holds exactly *data* (size checked first)."""
+    try:
+        if os.stat(path).st_size != len(data):
+            return False
+        with open(path, "rb") as fh:
+            return fh.read() == data
+    except FileNotFoundError:
+        return False
+
+
+_output_writer: OutputWriter | None = None
+
+
+def open_output_writer(cfg: dict[str, Any]) -> OutputWriter:
+    """Start this run's output writer (and manifest)."""
+    global _output_writer  # noqa: PLW0603
+    close_output_writer()
+    _output_writer = OutputWriter(cfg["output_dir"], str(cfg.get("output_manifest") or ""))
+    return _output_writer
+
+
+def close_output_writer() -> None:
+    global _output_writer  # noqa: PLW0603
+    if _output_writer is not None:
+        _output_writer.close()
+        _output_writer = None
+
+# ---------------------------------------------------------------------------
+# Multilingual sitemap
+# ---------------------------------------------------------------------------
+
+_SITEMAP_NS = ('xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+               'xmlns:xhtml="http://www.w3.org/1999/xhtml"')
+# Protocol limits per sitemap file: 50,000 URLs and 50 MB uncompressed.
+SITEMAP_MAX_URLS = 50_000
+SITEMAP_MAX_BYTES = 50 * 1024 * 1024
+
+
+class SitemapWriter:
+    """
+    Streams a sitemap per target language for the generated pages, every
+    <url> carrying the page's alternates as <xhtml:link> entries, plus a
+    sitemap index over all of them.
+
+    Entries are written as pages finish, into sitemap-{lang}-{n}.xml in
+    *directory*; a file is finished (and renamed into place) when it
+    reaches *max_urls* URLs or the 50 MB limit, and the next one is
+    started. close() finishes the open files, removes chunks of the
+    target languages that the previous sitemap-index.xml listed but this
+    run did not write (the directory may hold other files, even other
+    sitemaps), and writes sitemap-index.xml. Relative
+    alternate URLs are made absolute with *base_url* (default: the page's
+    own scheme and host after domain_mapping); the files are served from
+    /{directory}/. Without a base_url, the index is only written once a
+    page supplied an absolute host; otherwise close() warns and leaves the
+    previous index and its chunks in place.
+    """
+
+    def __init__(self, directory: str, base_url: str, hreflang_map: HreflangMap,
+                 max_urls: int = SITEMAP_MAX_URLS):
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+        self.hreflang_map = hreflang_map
+        self.max_urls = max(1, min(int(max_urls), SITEMAP_MAX_URLS))
+        self._lock = threading.Lock()
+        # lang → [file handle, chunk number, URLs, bytes]
+        self._open: dict[str, list[Any]] = {}
+        self._chunks: dict[str, int] = {}
+        self._finished: list[str] = []
+        self._site = self.base_url
+        # Pre-built per page and reused for each of its languages.
+        self._alternates = functools.lru_cache(maxsize=1024)(self._build_alternates)
+        os.makedirs(directory, exist_ok=True)
+
+    def _build_alternates(self, page_url: str) -> tuple[dict[str, str], str]:
+        """({hreflang: absolute URL}, the <xhtml:link> elements) of *page_url*."""
+        site = self.base_url
+        if not site:
+            parsed = urlparse(self.hreflang_map.map_domains(page_url))
+            site = self._site = f"{parsed.scheme}://{parsed.netloc}"
+        urls = {hreflang: site + href if href.startswith("/") else href
+                for hreflang, href in self.hreflang_map.links(page_url)}
+        links = "".join(f'<xhtml:link rel="alternate" hreflang="{hreflang}" href={xml_quoteattr(url)}/>'
+                        for hreflang, url in urls.items())
+        return urls, links
+
+    def add(self, page_url: str, lang: str) -> None:
+        """Record the *lang* version of *page_url* (its file is written)."""
+        urls, links = self._alternates(page_url)
+        data = f"<url><loc>{xml_escape(urls[lang])}</loc>{links}</url>\n".encode("utf-8")
+        with self._lock:
+            chunk = self._open.get(lang)
+            if chunk is not None and chunk[3] + len(data) > SITEMAP_MAX_BYTES - 64:
+                self._finish(lang)
+                chunk = None
+            if chunk is None:
+                chunk = self._start(lang)
+            chunk[0].write(data)
+            chunk[2] += 1
+            chunk[3] += len(data)
+            STATS.add("sitemap_urls")
+            if chunk[2] >= self.max_urls:
+                self._finish(lang)
+
+    def _path(self, lang: str, number: int) -> str:
+        return os.path.join(self.directory, f"sitemap-{lang}-{number}.xml")
+
+    def _start(self, lang: str) -> list[Any]:
+        number = self._chunks[lang] = self._chunks.get(lang, 0) + 1
+        fh = open(self._path(lang, number) + ".tmp", "wb")
+        header = f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset {_SITEMAP_NS}>\n'.encode("utf-8")
+        fh.write(header)
+        chunk = self._open[lang] = [fh, number, 0, len(header)]
+        return chunk
+
+    def _finish(self, lang: str) -> None:
+        fh, number, _, _ = self._open.pop(lang)
+        fh.write(b"</urlset>\n")
+        fh.close()
+        path = self._path(lang, number)
+        os.replace(path + ".tmp", path)
+        self._finished.append(path)
+        STATS.add("sitemap_files")
+
+    def close(self) -> None:
+        with self._lock:
+            for lang in list(self._open):
+                self._finish(lang)
+            if not urlparse(self._site).scheme:
+                # Index <loc>s must be absolute; without base_url the host
+                # comes from the pages, and no page gave one.
+                logger.warning("Not writing %s: no base_url and no page URL to take the "
+                               "host from.", os.path.join(self.directory, "sitemap-index.xml"))
+                return
+            finished = {os.path.basename(path) for path in self._finished}
+            for name in self._previous_chunks() - finished:
+                os.remove(os.path.join(self.directory, name))
+            url_dir = "/" + self.directory.replace(os.sep, "/").strip("/")
+            entries = "".join(
+                f"<sitemap><loc>{xml_escape(self._site + url_dir)}/"
+                f"{os.path.basename(path)}</loc></sitemap>\n"
+                for path in sorted(self._finished)
+            )
+            write_atomic(os.path.join(self.directory, "sitemap-index.xml"),
+                          '<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex '
+                          f'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n{entries}'
+                          "</sitemapindex>\n")
+        logger.info("Sitemaps written to %s: %d URLs in %d files.", self.directory,
+                    STATS.get("sitemap_urls"), len(self._finished))
+
+    def _previous_chunks(self) -> set[str]:
+        """Chunk files of the target languages that the existing index lists."""
+        langs = "|".join(re.escape(lang) for lang in self.hreflang_map.langs
+                         if lang != self.hreflang_map.source_lang)
+        chunk_re = re.compile(rf"sitemap-(?:{langs})-\d+\.xml")
+        try:
+            index = etree.parse(os.path.join(self.directory, "sitemap-index.xml"))
+        except (OSError, etree.LxmlError):
+            return set()
+        names = {urlparse(loc.text or "").path.rsplit("/", 1)[-1]
+                 for loc in index.iter("{*}loc")}
+        return {name for name in names if chunk_re.fullmatch(name)
+                and os.path.isfile(os.path.join(self.directory, name))}
+
+
+_sitemap_writer: SitemapWriter | None = None
+
+
+def open_sitemap_writer(cfg: dict[str, Any]) -> SitemapWriter | None:
+    """Start this run's sitemap writer; None unless ``sitemap_output.dir`` is set."""
+    global _sitemap_writer  # noqa: PLW0603
+    opts = cfg.get("sitemap_output", {})
+    _sitemap_writer = None
+    if opts.get("dir"):
+        _sitemap_writer = SitemapWriter(opts["dir"], str(opts.get("base_url") or ""),
+                                        get_hreflang_map(cfg),
+                                        int(opts.get("max_urls", SITEMAP_MAX_URLS)))
+    return _sitemap_writer
+
+
+def close_sitemap_writer() -> None:
+    global _sitemap_writer  # noqa: PLW0603
+    if _sitemap_writer is not None:
+        _sitemap_writer.close()
+        _sitemap_writer = None
+
+
+def add_to_sitemap(page_url: str, langs: Iterable[str]) -> None:
+    """Record the *langs* versions of *page_url* in the sitemap, if one is written."""
+    writer = _sitemap_writer
+    if writer is not None:
+        for lang in langs:
+            writer.add(page_url, lang)
+
+# ---------------------------------------------------------------------------
+# Resume support
+# ---------------------------------------------------------------------------
+
+RESUME_JOURNAL = ".translate_resume.jsonl"
+# Written by earlier versions at the end of a run; imported once, then removed.
+LEGACY_RESUME_LOG = ".translate_resume.json"
+
+
+@contextlib.contextmanager
+def _file_lock(path: str, exclusive: bool) -> Iterator[bool]:
+    """flock *path* (shared or exclusive); yields False if an exclusive lock is busy."""
+    if fcntl is None:
+        yield True
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_EX | fcntl.LOCK_NB) if exclusive else fcntl.LOCK_SH)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+class ResumeJournal:
+    """
+    Append-only journal of finished page keys (``url:lang``), one JSON string
+    per line, appended as soon as each output file is written.
+
+    Each append is a single ``O_APPEND`` write, so a crash loses at most the
+    line being written (a torn last line is ignored on load), and threads
+    or processes sharing the journal never interleave lines. The journal is
+    compacted – rewritten as its unique keys and atomically renamed – when
+    duplicates make up more than half of it; appends hold a shared lock on
+    ``<path>.lock`` and compaction an exclusive one, so no append is lost
+    to a concurrent compaction.
+    """
+
+    _FSYNC_EVERY = 100
+    _COMPACT_CHECK_EVERY = 10_000
+
+    def __init__(self, path: str = RESUME_JOURNAL, legacy_path: str | None = LEGACY_RESUME_LOG):
+        self.path = path
+        self._lock_path = path + ".lock"
+        self._lock = threading.Lock()
+        self._done: set[str] = set()
+        self._lines = 0
+        self._unsynced = 0
+        self._fd = -1
+        self._ino = -1
+
+        self._load()
+        if legacy_path and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+        self._open()
+        self._maybe_compact()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._done
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "rb") as fh:
+                for line in fh:
+                    self._lines += 1
+                    try:
+                        key = json.loads(line)
+                    except ValueError:
+                        continue  # torn write from a crash
+                    if isinstance(key, str):
+                        self._done.add(key)
+        except FileNotFoundError:
+            pass
+
+    def _import_legacy(self, legacy_path: str) -> None:
+        try:
+            data = json.loads(Path(legacy_path).read_text(encoding="utf-8"))
+            self._done.update(data.get("done", []))
+        except (json.JSONDecodeError, OSError) as exc:
+            logger.warning("Could not import legacy resume log %s: %s", legacy_path, exc)
+            return
+        self._lines = -1  # force a compaction that writes the imported keys
+        self._compact()
+        os.remove(legacy_path)
+
+    def _open(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._ino = os.fstat(self._fd).st_ino
+
+    def add(self, key: str) -> None:
+        """Record *key* as done; durable once the line is written."""
+        line = (json.dumps(key, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock, _file_lock(self._lock_path, exclusive=False):
+            try:
+                replaced = os.stat(self.path).st_ino != self._ino  # compacted elsewhere
+            except FileNotFoundError:
+                replaced = True
+            if replaced:
+                self._open()
+            os.write(self._fd, line)
+            self._done.add(key)
+            self._lines += 1
+            self._unsynced += 1
+            if self._unsynced >= self._FSYNC_EVERY:
+                os.fsync(self._fd)
+                self._unsynced = 0
+        if self._lines % self._COMPACT_CHECK_EVERY == 0:
+            self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        if self._lines > 2 * len(self._done) or self._lines < 0:
+            with self._lock:
+                self._compact()
+
+    def _compact(self) -> None:
+        with _file_lock(self._lock_path, exclusive=True) as locked:
+            if not locked:
+                return  # another process is compacting
+            self._load()  # pick up keys appended by other writers
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                for key in sorted(self._done):
+                    fh.write(json.dumps(key, ensure_ascii=False) + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp, self.path)
+            self._lines = len(self._done)
+        if self._fd >= 0:
+            self._open()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd >= 0:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = -1
+
+# ---------------------------------------------------------------------------
+# Incremental state
+# ---------------------------------------------------------------------------
+
+def content_hash(html: str) -> bytes:
+    """16-byte digest of a page's source HTML."""
+    return hashlib.sha256(html.encode("utf-8")).digest()[:16]
+
+
+class PageState:
+    """
+    Per-page state of previous runs in a SQLite file: the sitemap
+    ``<lastmod>`` and source hash of every page, and the translation of each
+    of its strings per language. Unchanged pages are skipped; for changed
+    pages only new or modified strings need translating.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT PRIMARY KEY, lastmod TEXT, content_hash BLOB NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS page_strings ("
+            " url TEXT NOT NULL, lang TEXT NOT NULL, text_hash BLOB NOT NULL,"
+            " translation TEXT NOT NULL, PRIMARY KEY (url, lang, text_hash))"
+        )
+        self._db.commit()
+
+    def page(self, url: str) -> tuple[str | None, bytes] | None:
+        """Return (lastmod, content hash) recorded for *url*, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT lastmod, content_hash FROM pages WHERE url = ?", (url,),
+            ).fetchone()
+        return (row[0], bytes(row[1])) if row else None
+
+    def translations(self, url: str, lang: str) -> dict[bytes, str]:
+        """Return {text hash: translation} stored for *url* in *lang*."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT text_hash, translation FROM page_strings WHERE url = ? AND lang = ?",
+                (url, lang),
+            ).fetchall()
+        return {bytes(h): t for h, t in rows}
+
+    def record_strings(self, url: str, lang: str, pairs: list[tuple[str, str]]) -> None:
+        """Replace the stored strings of *url* in *lang* with *pairs*."""
+        rows = {text_hash(src): dst for src, dst in pairs}
+        with self._lock:
+            self._db.execute("DELETE FROM page_strings WHERE url = ? AND lang = ?", (url, lang))
+            self._db.executemany(
+                "INSERT INTO page_strings VALUES (?, ?, ?, ?)",
+                [(url, lang, h, t) for h, t in rows.items()],
+            )
+            self._db.commit()
+
+    def record_page(self, url: str, lastmod: str | None, digest: bytes) -> None:
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                             (url, lastmod, digest))
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def open_page_state(cfg: dict[str, Any]) -> PageState | None:
+    """Open the incremental state file when incremental mode is on."""
+    if not cfg.get("incremental", False):
+        return None
+    return PageState(str(cfg.get("incremental_state") or ".translate_state.sqlite"))
+
+# ---------------------------------------------------------------------------
+# Page pipeline
+# ---------------------------------------------------------------------------
+
+def build_page_template(html: str, page_url: str, cfg: dict[str, Any]) -> PageTemplate:
+    """
+    Parse *html* once, extract its text nodes, optionally inject hreflang
+    tags (identical for every language) and return the page template.
+    """
+    with STATS.timed("parse"):
+        soup = BeautifulSoup(html, "lxml")
+    with STATS.timed("extract"):
+        nodes = extract_text_nodes(soup, bool(cfg.get("merge_inline_segments", False)))
+
+    if not nodes:
+        logger.debug("No translatable nodes found in %s", page_url)
+        with STATS.timed("serialize"):
+            return PageTemplate.from_soup(soup, nodes)
+
+    # Inject hreflang if requested
+    hreflang_opts = cfg.get("hreflang_options", {})
+    if hreflang_opts.get("inject_hreflang_tags", False):
+        with STATS.timed("hreflang"):
+            append_hreflang_links(soup, get_hreflang_map(cfg).links(page_url))
+
+    with STATS.timed("serialize"):
+        template = PageTemplate.from_soup(soup, nodes)
+        soup.decompose()
+    return template
+
+
+def _translate_incremental(state: PageState, page_url: str, template: PageTemplate,
+                           lang: str, cfg: dict[str, Any]) -> tuple[str, bool]:
+    """
+    Translate *template* into *lang*, reusing the translations stored for
+    this page by the previous run: only new or modified strings are sent.
+    Returns (html, whether every string was translated).
+    """
+    if not template.originals:
+        return template.render(None, lang), True
+    previous = state.translations(page_url, lang)
+    values: list[str | None] = [previous.get(text_hash(t)) for t in template.originals]
+    todo = [i for i, value in enumerate(values) if value is None]
+    STATS.add("incremental_strings_reused", len(values) - len(todo))
+    STATS.add("incremental_strings_sent", len(todo))
+
+    failed: list[int] = []
+    if todo:
+        fresh = translate_texts([template.originals[i] for i in todo], lang, cfg, failed)
+        for i, trans in zip(todo, fresh):
+            values[i] = trans
+    skip = {todo[j] for j in failed}
+    state.record_strings(page_url, lang, [
+        (src, dst) for i, (src, dst) in enumerate(zip(template.originals, values))
+        if i not in skip
+    ])
+    with STATS.timed("render"):
+        return template.render(values, lang), not failed
+
+
+def translate_template(template: PageTemplate, target_lang: str, cfg: dict[str, Any],
+                       failed: list[int] | None = None) -> str:
+    """
+    Translate a page template into *target_lang* and return the HTML; the
+    indices of strings left in the source language are appended to *failed*.
+    """
+    if not template.originals:
+        return template.render(None, target_lang)
+    translated = translate_texts(template.originals, target_lang, cfg, failed)
+    assert len(translated) == len(template.originals), (
+        f"Node/translation count mismatch: expected {len(template.originals)}, got {len(translated)}"
+    )
+    with STATS.timed("render"):
+        return template.render(translated, target_lang)
+
+
+def translate_page(
+    html: str,
+    page_url: str,
+    target_lang: str,
+    cfg: dict[str, Any],
+) -> str:
+    """
+    Parse *html*, extract text nodes, translate them, optionally inject
+    hreflang tags, and return the modified HTML as a string.
+    """
+    return translate_template(build_page_template(html, page_url, cfg), target_lang, cfg)
+
+
+def discover_pages(cfg: dict[str, Any]) -> Iterator[tuple[str | None, str, str | None]]:
+    """
+    Yield (local_path or None, page_url, sitemap lastmod) for every page to
+    translate. Sitemap URLs are streamed while child sitemaps are still
+    being fetched.
+    """
+    local_dir = cfg.get("local_html_dir", "").strip()
+    if local_dir:
+        local_pairs = iter_local_html_files(local_dir)
+        return ((path, f"http://localhost{rel}", None) for path, rel in local_pairs)
+    sitemap_url = cfg.get("sitemap_url", "").strip()
+    if not sitemap_url:
+        logger.error("Neither local_html_dir nor sitemap_url is configured.")
+        sys.exit(1)
+    workers = int(cfg.get("sitemap_workers", 4))
+    return ((None, url, lastmod) for url, lastmod in iter_sitemap_entries(sitemap_url, workers))
+
+
+def load_page_source(local_path: str | None, page_url: str) -> str | None:
+    """Load (or fetch) the HTML of one page; None if it could not be loaded."""
+    html = load_html(local_path) if local_path else fetch_html(page_url)
+    if not html:
+        logger.warning("Skipping %s (could not load HTML).", page_url)
+        return None
+    return html
+
+
+def parse_page_template(html: str, page_url: str, cfg: dict[str, Any]) -> PageTemplate | None:
+    """
+    Parse one page into its template; None if it could not be parsed.
+    Runs in a parse worker process when the parse pool is up (parse_workers).
+    """
+    pool = _parse_pool
+    if pool is not None:
+        try:
+            template, counters = pool.submit(_parse_in_worker, html, page_url).result()
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.error("Error parsing %s in a worker process: %s", page_url, exc)
+            return None
+        for name, value in counters.items():
+            STATS.add(name, value)
+        return template
+    try:
+        return build_page_template(html, page_url, cfg)
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.error("Error parsing %s: %s", page_url, exc)
+        return None
+
+
+# Parsing, extraction and serialization are pure-Python CPU work under the
+# GIL. With parse_workers > 0 they run in worker processes instead; only
+# the HTML goes in and only the compact PageTemplate (literal strings,
+# originals and slot offsets) comes back – never a soup.
+_parse_pool: ProcessPoolExecutor | None = None
+_worker_cfg: dict[str, Any] = {}
+
+# The config keys build_page_template reads, sent to each worker once.
+_PARSE_CFG_KEYS = ("source_lang", "target_langs", "output_dir", "domain_mapping",
+                   "hreflang_options", "merge_inline_segments", "log_level")
+
+
+def _init_parse_worker(cfg: dict[str, Any]) -> None:
+    global _worker_cfg  # noqa: PLW0603
+    _worker_cfg = cfg
+    setup_logging(cfg.get("log_level", "INFO"))
+
+
+def _parse_in_worker(html: str, page_url: str) -> tuple[PageTemplate | None, dict[str, int]]:
+    """Build one template in a worker process; returns it with the stage counters."""
+    STATS.reset()
+    try:
+        template = build_page_template(html, page_url, _worker_cfg)
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.error("Error parsing %s: %s", page_url, exc)
+        template = None
+    return template, dict(STATS.counters)
+
+
+def start_parse_pool(cfg: dict[str, Any]) -> int:
+    """Start ``parse_workers`` parse processes (0 keeps parsing in threads)."""
+    global _parse_pool  # noqa: PLW0603
+    workers = int(cfg.get("parse_workers", 0))
+    if workers > 0 and _parse_pool is None:
+        # spawn, not fork: the parent already runs threads holding locks.
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_parse_worker,
+            initargs=({key: cfg[key] for key in _PARSE_CFG_KEYS if key in cfg},),
+        )
+    return workers
+
+
+def shutdown_parse_pool() -> None:
+    global _parse_pool  # noqa: PLW0603
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=True)
+        _parse_pool = None
+
+
+def write_output(out_file: Path, html: str) -> bool:
+    """Write one translated page (skipped if unchanged); returns False on failure."""
+    writer = _output_writer or OutputWriter("")
+    return writer.write(out_file, html)
+
+
+_STOP = object()
+# How often a pipeline worker blocked on a queue checks whether another died.
+_POLL_SECONDS = 0.1
+
+
+def _timed_iter(items: Iterable[Any], stage: str) -> Iterator[Any]:
+    """Yield from *items*, timing each step (e.g. streamed sitemap discovery)."""
+    iterator = iter(items)
+    while True:
+        with STATS.timed(stage):
+            item = next(iterator, _STOP)
+        if item is _STOP:
+            return
+        yield item
+
+
+def load_page_template(local_path: str | None, page_url: str,
+                       cfg: dict[str, Any]) -> PageTemplate | None:
+    """Load (or fetch) and parse one page; None if it could not be loaded."""
+    html = load_page_source(local_path, page_url)
+    return parse_page_template(html, page_url, cfg) if html else None
+
+
+def _report_untranslated(page_url: str, lang: str) -> None:
+    """
+    The page is written with some strings in the source language so the run
+    keeps going, but it is counted and not marked done, so the next resumed
+    run translates it again.
+    """
+    logger.warning("%s → %s written with untranslated strings; it will be retried.",
+                   page_url, lang)
+    STATS.add("pages_untranslated")
+
+
+def _unchanged_pending(state: PageState, page_url: str, lastmod: str | None,
+                       digest: bytes | None, pending: list[str],
+                       cfg: dict[str, Any]) -> list[str] | None:
+    """
+    If the page is unchanged since the last run (same sitemap lastmod or,
+    when *digest* is given, same source hash), return the languages of
+    *pending* whose output file is missing. None if the page changed.
+    """
+    previous = state.page(page_url)
+    if previous is None:
+        return None
+    prev_lastmod, prev_digest = previous
+    if not ((digest is None and lastmod and lastmod == prev_lastmod)
+            or (digest is not None and digest == prev_digest)):
+        return None
+    return [lang for lang in pending
+            if not output_path_for(page_url, lang, cfg["output_dir"]).exists()]
+
+
+def run_pipeline(pages: Iterable[tuple[str | None, str, str | None]], pending_langs: Any,
+                  cfg: dict[str, Any], mark_done: Callable[[str], None],
+                  state: PageState | None = None) -> None:
+    """
+    Staged, concurrent page pipeline:
+
+      fetch/parse workers → [bounded queue] → translate workers
+                          → [bounded queue] → writer workers
+
+    Each page is parsed once and translated into every pending language.
+    Batches of one page are sent concurrently (``max_inflight_batches``),
+    and the bounded queues keep at most ``pipeline_queue_size`` parsed pages
+    and rendered files in memory. At most ``max_inflight_pages`` pages are
+    between fetch and their last write at any time, so memory stays flat
+    however many pages discovery streams in.
+
+    With *state* (incremental mode) unchanged pages are skipped – by sitemap
+    lastmod before fetching, else by source hash before parsing – and only
+    strings that are new since the previous run are translated.
+
+    A worker that dies (an unexpected exception, not a failed page) stops
+    the whole pipeline: every other worker gives up at its next queue
+    operation instead of blocking forever, and the error is re-raised.
+    """
+    # Each fetcher waits on its page's parse, so keep every parse process busy.
+    fetch_workers = max(1, int(cfg.get("fetch_workers", 4)), int(cfg.get("parse_workers", 0)))
+    translate_workers = max(1, int(cfg.get("translate_workers", 4)))
+    write_workers = max(1, int(cfg.get("write_workers", 2)))
+    queue_size = max(1, int(cfg.get("pipeline_queue_size", 16)))
+    max_inflight = int(cfg.get("max_inflight_pages", 64))
+    inflight = threading.Semaphore(max_inflight) if max_inflight > 0 else None
+    remaining_lock = threading.Lock()
+
+    parsed_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    write_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    page_iter = _timed_iter(pages, "discover")
+    iter_lock = threading.Lock()
+    failed = threading.Event()
+    errors: list[BaseException] = []
+
+    # Blocking steps poll *failed*, so a dead stage cannot hang the others.
+    def _put(q: queue.Queue, item: Any) -> bool:
+        while not failed.is_set():
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(q: queue.Queue) -> Any:
+        while not failed.is_set():
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                pass
+        return _STOP
+
+    def _acquire_page() -> bool:
+        while not failed.is_set():
+            if inflight is None or inflight.acquire(timeout=_POLL_SECONDS):
+                return True
+        return False
+
+    def release_page() -> None:
+        if inflight is not None:
+            inflight.release()
+
+    def fetcher() -> None:
+        while not failed.is_set():
+            with iter_lock:
+                item = next(page_iter, None)
+            if item is None:
+                return
+            STATS.add("pages_discovered")
+            if not _acquire_page():
+                return
+            if not fetch_one(*item):
+                release_page()
+
+    def fetch_one(local_path: str | None, page_url: str, lastmod: str | None) -> bool:
+        """Fetch and parse one page; True once it is handed to the translators."""
+        pending = pending_langs(page_url)
+        try:
+            if state and pending:
+                unchanged = _unchanged_pending(state, page_url, lastmod, None, pending, cfg)
+                if unchanged is not None and not unchanged:
+                    STATS.add("incremental_pages_unchanged")
+                    pending = []
+                    return False
+            if not pending:
+                logger.debug("Skipping (already done): %s", page_url)
+                return False
+            with STATS.timed("fetch"):
+                html = load_page_source(local_path, page_url)
+            if html is None:
+                return False
+            digest = None
+            if state:
+                digest = content_hash(html)
+                unchanged = _unchanged_pending(state, page_url, lastmod, digest, pending, cfg)
+                if unchanged is not None:
+                    pending = unchanged
+                    if not pending:
+                        STATS.add("incremental_pages_unchanged")
+                        return False
+                else:
+                    STATS.add("incremental_pages_changed")
+            template = parse_page_template(html, page_url, cfg)
+            if template is None:
+                return False
+            return _put(parsed_q, (page_url, template, pending, lastmod, digest))
+        finally:
+            # Languages not pending kept their file from an earlier run.
+            add_to_sitemap(page_url, [lang for lang in cfg["target_langs"] if lang not in pending])
+
+    def translator() -> None:
+        while True:
+            item = _get(parsed_q)
+            if item is _STOP:
+                return
+            page_url, template, pending, lastmod, digest = item
+            complete = True
+            rendered = []
+            for lang in pending:
+                logger.info("Translating %s → %s", page_url, lang)
+                try:
+                    with STATS.timed("translate"):
+                        if state:
+                            translated_html, ok = _translate_incremental(
+                                state, page_url, template, lang, cfg)
+                        else:
+                            failed_idx: list[int] = []
+                            translated_html = translate_template(template, lang, cfg, failed_idx)
+                            ok = not failed_idx
+                except Exception as exc:  # pylint: disable=broad-except
+                    logger.error("Error translating %s → %s: %s", page_url, lang, exc)
+                    complete = False
+                    continue
+                if not ok:
+                    _report_untranslated(page_url, lang)
+                complete = complete and ok
+                rendered.append((lang, translated_html, ok))
+            if state and complete:
+                state.record_page(page_url, lastmod, digest)
+            STATS.add("pages")
+            del template
+            if not rendered:
+                release_page()
+                continue
+            # The page stays in flight until its last file is written.
+            remaining = [len(rendered)]
+            for lang, translated_html, ok in rendered:
+                if not _put(write_q, (page_url, lang, translated_html, ok, remaining)):
+                    return
+            del rendered, translated_html
+
+    def writer() -> None:
+        while True:
+            item = _get(write_q)
+            if item is _STOP:
+                return
+            page_url, lang, html, ok, remaining = item
+            del item
+            with STATS.timed("write"):
+                written = write_output(output_path_for(page_url, lang, cfg["output_dir"]), html)
+            del html
+            if written:
+                add_to_sitemap(page_url, [lang])
+            if written and ok:
+                mark_done(f"{page_url}:{lang}")
+            with remaining_lock:
+                remaining[0] -= 1
+                last = not remaining[0]
+            if last:
+                release_page()
+
+    def _guarded(target: Callable[[], None]) -> Callable[[], None]:
+        def _run() -> None:
+            try:
+                target()
+            except BaseException as exc:  # pylint: disable=broad-except
+                logger.error("Pipeline worker %s died, stopping the run: %s",
+                             threading.current_thread().name, exc, exc_info=True)
+                errors.append(exc)
+                failed.set()
+        return _run
+
+    def _start(target: Any, count: int, name: str) -> list[threading.Thread]:
+        threads = [threading.Thread(target=_guarded(target), name=f"{name}-{i}", daemon=True)
+                   for i in range(count)]
+        for t in threads:
+            t.start()
+        return threads
+
+    writers = _start(writer, write_workers, "write")
+    translators = _start(translator, translate_workers, "translate")
+    fetchers = _start(fetcher, fetch_workers, "fetch")
+
+    for t in fetchers:
+        t.join()
+    for _ in translators:
+        _put(parsed_q, _STOP)
+    for t in translators:
+        t.join()
+    for _ in writers:
+        _put(write_q, _STOP)
+    for t in writers:
+        t.join()
+    if errors:
+        raise errors[0]
+
+
+class StringTable:
+    """
+    Site-wide table of unique source strings.
+
+    Every page keeps a compact array of string ids (its back-references into
+    the table), so each unique string is translated once per language and
+    the result is fanned out to every page that uses it.
+    """
+
+    def __init__(self) -> None:
+        self.ids: dict[str, int] = {}
+        self.strings: list[str] = []
+
+    def add(self, texts: list[str]) -> array:
+        """Intern *texts* and return their ids."""
+        ids = array("I")
+        for text in texts:
+            sid = self.ids.get(text)
+            if sid is None:
+                sid = self.ids[text] = len(self.strings)
+                self.strings.append(text)
+            ids.append(sid)
+        return ids
+
+
+def run_site_dedup(pages: Iterable[tuple[str | None, str, str | None]], pending_langs: Any,
+                    cfg: dict[str, Any], mark_done: Callable[[str], None]) -> None:
+    """
+    Three-phase run: (1) extract every page into templates and one global
+    string table, (2) translate only the unique strings per language, up to
+    ``translate_workers`` languages at a time, (3) render and write every page from the translated table.
+    Holds all page templates in memory until the end of the run; very large
+    sites should use the streaming pipeline (site_dedup off) instead.
+    """
+    batch_size = int(cfg["batch_size"])
+    table = StringTable()
+    extracted: list[tuple[str, PageTemplate, array, list[str]]] = []
+
+    # --- Phase 1: extract ---
+    for local_path, page_url, _ in _timed_iter(pages, "discover"):
+        STATS.add("pages_discovered")
+        pending = pending_langs(page_url)
+        add_to_sitemap(page_url, [lang for lang in cfg["target_langs"] if lang not in pending])
+        if not pending:
+            logger.debug("Skipping (already done): %s", page_url)
+            continue
+        with STATS.timed("fetch"):
+            html = load_page_source(local_path, page_url)
+        if html is None:
+            continue
+        template = parse_page_template(html, page_url, cfg)
+        if template is not None:
+            extracted.append((page_url, template, table.add(template.originals), pending))
+
+    # --- Phase 2: translate the unique strings, languages concurrently ---
+    def _translate_lang(lang: str) -> list[str | None] | None:
+        needed: set[int] = set()
+        total = total_chars = naive_calls = 0
+        for _, template, ids, pending in extracted:
+            if lang in pending:
+                needed.update(ids)
+                total += len(ids)
+                total_chars += sum(len(t) for t in template.originals)
+                naive_calls += -(-len(ids) // batch_size)
+        if not needed:
+            return None
+        order = sorted(needed)
+        unique_texts = [table.strings[sid] for sid in order]
+        unique_chars = sum(len(t) for t in unique_texts)
+        logger.info("Translating %d unique strings (%d total) → %s", len(order), total, lang)
+        failed: list[int] = []
+        with STATS.timed("translate"):
+            translated = translate_texts(unique_texts, lang, cfg, failed)
+        lang_table: list[str | None] = [None] * len(table.strings)
+        for sid, trans in zip(order, translated):
+            lang_table[sid] = trans
+        untranslated[lang] = {order[i] for i in failed}
+
+        STATS.add("dedup_strings_total", total)
+        STATS.add("dedup_strings_unique", len(order))
+        STATS.add("dedup_chars_avoided", total_chars - unique_chars)
+        STATS.add("dedup_calls_avoided", max(0, naive_calls - STATS.get(f"lang_{lang}_api_calls")))
+        return lang_table
+
+    untranslated: dict[str, set[int]] = {}
+    langs = list(cfg["target_langs"])
+    workers = max(1, min(len(langs), int(cfg.get("translate_workers", 4))))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="translate") as pool:
+        translations: dict[str, list[str | None]] = {
+            lang: lang_table for lang, lang_table in zip(langs, pool.map(_translate_lang, langs))
+            if lang_table is not None
+        }
+
+    # --- Phase 3: render and write ---
+    for page_url, template, ids, pending in extracted:
+        for lang in pending:
+            lang_table = translations.get(lang)
+            values = [lang_table[sid] for sid in ids] if lang_table else None
+            with STATS.timed("render"):
+                html = template.render(values, lang)
+            ok = untranslated.get(lang, set()).isdisjoint(ids)
+            if not ok:
+                _report_untranslated(page_url, lang)
+            with STATS.timed("write"):
+                written = write_output(output_path_for(page_url, lang, cfg["output_dir"]), html)
+            if written:
+                add_to_sitemap(page_url, [lang])
+            if written and ok:
+                mark_done(f"{page_url}:{lang}")
+    STATS.add("pages", len(extracted))
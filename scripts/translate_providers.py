@@ -0,0 +1,1454 @@
+"""
+scripts/translate_providers.py
+==============================
+String translation for translate_site.py. translate_texts() looks strings up
+in the translation memory, masks protected terms, packs the rest into
+batches within the provider's request limits and sends them through the
+adaptive rate limiter to DeepL, Google, a local LLM or the offline mock
+provider – routed over several providers when ``routing`` is configured.
+"""
+
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Iterable, Iterator, NamedTuple
+
+import requests
+from requests.adapters import BaseAdapter
+
+from translate_common import STATS, http_session
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Translation memory
+# ---------------------------------------------------------------------------
+
+def normalize_text(text: str) -> str:
+    """Canonical form used for memory keys: NFC with collapsed whitespace."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_hash(text: str) -> bytes:
+    """16-byte digest of the normalized text."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).digest()[:16]
+
+
+class TranslationMemory:
+    """
+    Persistent translation cache in a SQLite file, keyed by
+    (provider, source_lang, target_lang, normalized text hash).
+
+    Lookups and stores are bulk operations over a whole batch. The table is
+    bounded to *max_entries*; the least recently used rows are evicted.
+    """
+
+    # SQLite's default bound-parameter limit is 999 – stay well below it.
+    _CHUNK = 500
+    _EVICT_EVERY = 10_000
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inserts_since_evict = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tm ("
+            " provider TEXT NOT NULL, source_lang TEXT NOT NULL,"
+            " target_lang TEXT NOT NULL, text_hash BLOB NOT NULL,"
+            " translation TEXT NOT NULL, last_used INTEGER NOT NULL,"
+            " PRIMARY KEY (provider, source_lang, target_lang, text_hash))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS tm_last_used ON tm (last_used)")
+        self._db.commit()
+
+    def lookup(self, provider: str, source_lang: str, target_lang: str,
+               texts: list[str]) -> list[str | None]:
+        """Return the cached translation for each of *texts*, or None."""
+        hashes = [text_hash(t) for t in texts]
+        found: dict[bytes, str] = {}
+        now = int(time.time())
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            for i in range(0, len(unique), self._CHUNK):
+                chunk = unique[i : i + self._CHUNK]
+                marks = ",".join("?" * len(chunk))
+                params = [provider, source_lang, target_lang, *chunk]
+                found.update(self._db.execute(
+                    "SELECT text_hash, translation FROM tm WHERE provider = ?"
+                    f" AND source_lang = ? AND target_lang = ? AND text_hash IN ({marks})",
+                    params,
+                ).fetchall())
+                self._db.execute(
+                    "UPDATE tm SET last_used = ? WHERE provider = ?"
+                    f" AND source_lang = ? AND target_lang = ? AND text_hash IN ({marks})",
+                    [now, *params],
+                )
+            self._db.commit()
+        return [found.get(h) for h in hashes]
+
+    def store(self, provider: str, source_lang: str, target_lang: str,
+              pairs: list[tuple[str, str]]) -> None:
+        """Persist (source text, translation) pairs."""
+        if not pairs:
+            return
+        now = int(time.time())
+        rows = [(provider, source_lang, target_lang, text_hash(src), dst, now)
+                for src, dst in pairs]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO tm VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+            self._inserts_since_evict += len(rows)
+            if self._inserts_since_evict >= self._EVICT_EVERY:
+                self._evict()
+
+    def _evict(self) -> None:
+        self._inserts_since_evict = 0
+        (count,) = self._db.execute("SELECT COUNT(*) FROM tm").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM tm WHERE rowid IN "
+                "(SELECT rowid FROM tm ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self._db.commit()
+            logger.info("Translation memory: evicted %d least recently used entries.", excess)
+
+    def close(self) -> None:
+        with self._lock:
+            self._evict()
+            self._db.close()
+
+
+_memory: TranslationMemory | None = None
+
+
+def get_translation_memory(cfg: dict[str, Any]) -> TranslationMemory | None:
+    """Return the shared translation memory, opening it on first call."""
+    global _memory  # noqa: PLW0603
+    path = str(cfg.get("translation_memory") or "")
+    if not path:
+        return None
+    if _memory is None or _memory.path != path:
+        _memory = TranslationMemory(path, int(cfg.get("translation_memory_max_entries", 500_000)))
+    return _memory
+
+
+def close_translation_memory() -> None:
+    global _memory  # noqa: PLW0603
+    if _memory is not None:
+        _memory.close()
+        _memory = None
+
+# ---------------------------------------------------------------------------
+# Batch packing
+# ---------------------------------------------------------------------------
+
+class BatchLimits(NamedTuple):
+    """Per-request limits of a translation provider."""
+    max_items: int
+    max_chars: int
+    max_bytes: int
+
+
+# DeepL: 50 texts and 128 KiB request body; Google v2: 128 q segments and
+# ~30k characters per request. Byte budgets leave room for the rest of the
+# JSON payload. Override per provider with the "batch_limits" config key.
+PROVIDER_BATCH_LIMITS: dict[str, BatchLimits] = {
+    "deepl": BatchLimits(max_items=50, max_chars=1_000_000, max_bytes=120_000),
+    "google": BatchLimits(max_items=128, max_chars=30_000, max_bytes=120_000),
+    # Local LLMs: short batches keep the numbered output reliable and let
+    # several requests share the model's parallel slots.
+    "llm": BatchLimits(max_items=20, max_chars=4_000, max_bytes=16_000),
+}
+_DEFAULT_BATCH_LIMITS = BatchLimits(max_items=50, max_chars=30_000, max_bytes=120_000)
+
+
+def batch_limits_for(provider: str, cfg: dict[str, Any]) -> BatchLimits:
+    """Provider limits, merged with config overrides and capped by batch_size."""
+    limits = PROVIDER_BATCH_LIMITS.get(provider, _DEFAULT_BATCH_LIMITS)
+    override = cfg.get("batch_limits", {}).get(provider, {})
+    if override:
+        limits = limits._replace(**{k: int(v) for k, v in override.items() if k in limits._fields})
+    return limits._replace(max_items=min(limits.max_items, int(cfg["batch_size"])))
+
+
+def _payload_bytes(text: str) -> int:
+    """Bytes *text* adds to a JSON request body (quoted, escaped, plus a comma)."""
+    return len(json.dumps(text, ensure_ascii=False).encode("utf-8")) + 1
+
+
+def pack_batches(texts: list[str], limits: BatchLimits) -> list[list[int]]:
+    """
+    Pack *texts* into as few requests as the limits allow (first-fit
+    decreasing by size). Returns lists of indices into *texts*, each in
+    source order. A single string larger than a budget is sent on its own.
+    """
+    sizes = [(len(t), _payload_bytes(t)) for t in texts]
+    order = sorted(range(len(texts)), key=lambda i: sizes[i][1], reverse=True)
+    batches: list[list[int]] = []
+    room: list[list[int]] = []  # [items, chars, bytes] left per batch
+    open_batches: list[int] = []  # batches that still take items
+    for i in order:
+        chars, nbytes = sizes[i]
+        for pos, b in enumerate(open_batches):
+            left = room[b]
+            if chars <= left[1] and nbytes <= left[2]:
+                break
+        else:
+            b = len(batches)
+            batches.append([])
+            room.append([limits.max_items, limits.max_chars, limits.max_bytes])
+            open_batches.append(b)
+            pos = len(open_batches) - 1
+        batches[b].append(i)
+        left = room[b]
+        left[0] -= 1
+        left[1] -= chars
+        left[2] -= nbytes
+        if left[0] <= 0 or left[1] <= 0 or left[2] <= 0:
+            open_batches.pop(pos)
+    # Keep source order inside and across batches (readable logs, stable output).
+    for batch in batches:
+        batch.sort()
+    batches.sort(key=lambda batch: batch[0])
+    return batches
+
+# ---------------------------------------------------------------------------
+# Provider errors
+# ---------------------------------------------------------------------------
+
+class TranslationError(RuntimeError):
+    """Raised when a provider could not translate a batch."""
+
+
+class ProviderUnavailable(TranslationError):
+    """The provider cannot serve this run (quota used up, access denied, no API key)."""
+
+# ---------------------------------------------------------------------------
+# Adaptive rate limiting
+# ---------------------------------------------------------------------------
+
+# Starting point per provider; override with the "rate_limits" config key.
+DEFAULT_RATE_LIMITS: dict[str, dict[str, float]] = {
+    "deepl": {"requests_per_second": 5.0, "max_concurrency": 4},
+    "google": {"requests_per_second": 10.0, "max_concurrency": 8},
+    "mock": {"requests_per_second": 50.0, "max_concurrency": 8},
+    # Local model server: requests are cheap to start, slots are the limit
+    # (match OLLAMA_NUM_PARALLEL).
+    "llm": {"requests_per_second": 50.0, "max_concurrency": 4},
+}
+_FALLBACK_RATE_LIMIT = {"requests_per_second": 5.0, "max_concurrency": 4}
+
+
+class AdaptiveLimiter:
+    """
+    Per-provider token bucket with an AIMD concurrency window, shared by
+    every worker that talks to the provider.
+
+    Success grows the window additively and restores the request rate.
+    A 429/5xx or network error halves both and puts the whole provider
+    into a cool-down that lasts for ``Retry-After`` or a jittered
+    exponential backoff capped at *backoff_cap*. An error that says nothing
+    about load (a malformed reply) only frees the slot. Time spent waiting
+    in acquire() is recorded as ``throttle_ms``.
+    """
+
+    OK = "ok"
+    THROTTLED = "throttled"
+    ERROR = "error"
+
+    def __init__(self, name: str, requests_per_second: float, max_concurrency: int,
+                 backoff_cap: float, min_rate: float = 0.2):
+        self.name = name
+        self.max_rate = float(requests_per_second)
+        self.min_rate = min(min_rate, self.max_rate)
+        self.rate = self.max_rate
+        self.capacity = max(1.0, self.max_rate)
+        self.tokens = self.capacity
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.window = max(1.0, self.max_concurrency / 2)
+        self.backoff_cap = float(backoff_cap)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.consecutive_failures = 0
+        self._last_refill = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self) -> None:
+        """Block until the provider may receive another request."""
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.cooldown_until:
+                    wait: float | None = self.cooldown_until - now
+                elif self.in_flight >= int(self.window):
+                    wait = None  # woken by release()
+                elif self.tokens < 1.0:
+                    wait = (1.0 - self.tokens) / self.rate
+                else:
+                    self.tokens -= 1.0
+                    self.in_flight += 1
+                    break
+                self._cond.wait(wait)
+        waited = time.monotonic() - start
+        if waited >= 0.001:
+            STATS.add("throttle_ms", int(waited * 1000))
+
+    def release(self, outcome: str, retry_after: float | None = None) -> float:
+        """Report a finished request; returns the cool-down imposed (seconds)."""
+        with self._cond:
+            self.in_flight -= 1
+            delay = 0.0
+            if outcome == self.OK:
+                self.consecutive_failures = 0
+                self.window = min(self.max_concurrency, self.window + 1.0 / self.window)
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+            elif outcome == self.ERROR:
+                STATS.add("provider_errors")
+            else:
+                self.consecutive_failures += 1
+                self.window = max(1.0, self.window / 2)
+                self.rate = max(self.min_rate, self.rate / 2)
+                delay = retry_after if retry_after is not None else self.backoff_delay()
+                self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+                STATS.add("throttled_responses")
+            self._cond.notify_all()
+            return delay
+
+    def backoff_delay(self) -> float:
+        """Exponential backoff with equal jitter, capped at backoff_cap."""
+        ceiling = min(self.backoff_cap, 2.0 ** (self.consecutive_failures - 1))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+_limiters: dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str, cfg: dict[str, Any]) -> AdaptiveLimiter:
+    """Return the shared limiter for *provider*, creating it on first call."""
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            settings = dict(DEFAULT_RATE_LIMITS.get(provider, _FALLBACK_RATE_LIMIT))
+            settings.update(cfg.get("rate_limits", {}).get(provider, {}))
+            limiter = _limiters[provider] = AdaptiveLimiter(
+                provider,
+                requests_per_second=float(settings["requests_per_second"]),
+                max_concurrency=int(settings["max_concurrency"]),
+                backoff_cap=float(cfg.get("rate_limit_backoff_seconds", 60)),
+            )
+        return limiter
+
+
+def reset_limiters() -> None:
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def _retry_after(resp: requests.Response) -> float | None:
+    """Seconds to wait according to Retry-After or rate-limit reset headers."""
+    value = resp.headers.get("Retry-After")
+    if value:
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+            return max(0.0, when.timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    if resp.headers.get("X-RateLimit-Remaining") == "0":
+        reset = resp.headers.get("X-RateLimit-Reset", "")
+        try:
+            reset_at = float(reset)
+        except ValueError:
+            return None
+        # Either an epoch timestamp or a delta in seconds.
+        return max(0.0, reset_at - time.time()) if reset_at > 1e9 else reset_at
+    return None
+
+
+def _post_translations(provider: str, url: str, payload: dict[str, Any],
+                       parse: Any, max_retries: int, limiter: AdaptiveLimiter) -> list[str]:
+    """
+    POST *payload* through *limiter*, retrying 429/5xx/network errors, and
+    return parse(response JSON). Never sleeps itself – the limiter's shared
+    cool-down holds back every worker until the provider is ready again.
+    """
+    for attempt in range(max_retries):
+        if attempt:
+            STATS.add("retries")
+        limiter.acquire()
+        try:
+            resp = http_session(url).post(url, json=payload, timeout=60)
+        except requests.RequestException as exc:
+            delay = limiter.release(limiter.THROTTLED)
+            logger.warning("%s request error (attempt %d/%d), backing off %.1fs: %s",
+                           provider, attempt + 1, max_retries, delay, exc)
+            continue
+        if resp.status_code == 429 or resp.status_code >= 500:
+            delay = limiter.release(limiter.THROTTLED, _retry_after(resp))
+            logger.warning("%s returned HTTP %d (attempt %d/%d), backing off %.1fs.",
+                           provider, resp.status_code, attempt + 1, max_retries, delay)
+            continue
+        if resp.status_code in (456, 403):
+            # Not retried, but other workers must not keep hitting it either.
+            limiter.release(limiter.THROTTLED, _retry_after(resp))
+            if resp.status_code == 456:
+                raise ProviderUnavailable(f"{provider} quota exceeded (HTTP 456).")
+            raise ProviderUnavailable(f"{provider} denied access (HTTP 403, key or daily limit).")
+        limiter.release(limiter.OK)
+        try:
+            resp.raise_for_status()
+            return parse(resp.json())
+        except requests.HTTPError as exc:
+            raise TranslationError(f"{provider} rejected the request: {exc}") from exc
+        except (ValueError, KeyError, TypeError) as exc:
+            logger.warning("%s returned an unexpected response (attempt %d/%d): %s",
+                           provider, attempt + 1, max_retries, exc)
+
+    raise TranslationError(f"{provider} translation failed after {max_retries} retries.")
+
+# ---------------------------------------------------------------------------
+# Translation API clients
+# ---------------------------------------------------------------------------
+
+# List prices per million billed characters, for the cost estimate of a run.
+PROVIDER_PRICE_PER_MILLION_CHARS: dict[str, float] = {
+    "deepl": 20.0, "google": 20.0, "mock": 20.0, "llm": 0.0,
+}
+
+
+def price_per_million_chars(provider: str, cfg: dict[str, Any]) -> float:
+    """The configured price (``price_per_million_chars``) or the list price."""
+    override = cfg.get("price_per_million_chars", {}).get(provider)
+    return float(override if override is not None
+                 else PROVIDER_PRICE_PER_MILLION_CHARS.get(provider, 0.0))
+
+
+def estimated_cost(cfg: dict[str, Any]) -> float:
+    """Estimated spend of the run: per routed provider, else at the api_provider price."""
+    providers = route_providers(cfg)
+    if len(providers) > 1:
+        return sum(STATS.get(f"provider_{p}_chars_billed") * price_per_million_chars(p, cfg)
+                   for p in providers) / 1e6
+    return STATS.get("chars_sent") * price_per_million_chars(providers[0], cfg) / 1e6
+
+
+def _deepl_endpoint(api_key: str) -> str:
+    """DEEPL_API_URL if set (e.g. a local stand-in), else the endpoint for the key."""
+    override = os.environ.get("DEEPL_API_URL", "")
+    if override:
+        return override
+    # Choose endpoint based on key suffix
+    host = "api-free.deepl.com" if api_key.endswith(":fx") else "api.deepl.com"
+    return f"https://{host}/v2/translate"
+
+
+def _deepl_translate(texts: list[str], target_lang: str, source_lang: str,
+                     api_key: str, backoff: int, max_retries: int,
+                     limiter: AdaptiveLimiter | None = None) -> list[str]:
+    """
+    Translate a list of strings using the DeepL REST API.
+    Supports both the free (api-free.deepl.com) and pro (api.deepl.com) endpoints.
+    """
+    # DeepL language codes are uppercase; only the primary subtag is sent
+    # (e.g. "en-US" → "EN", "fr-BE" → "FR"). Regional variants are therefore
+    # treated as the base language when calling the API.
+    tl = target_lang.upper().split("-")[0]  # e.g. EN, FR, ES, ZH
+    sl = source_lang.upper()
+
+    url = _deepl_endpoint(api_key)
+
+    payload: dict[str, Any] = {
+        "auth_key": api_key,
+        "target_lang": tl,
+        "source_lang": sl,
+        "text": texts,
+        "tag_handling": "html",
+        "non_splitting_tags": ["em", "strong", "b", "i", "a", "span"],
+        "ignore_tags": ["x"],  # masked terms (see TermProtector)
+    }
+
+    return _post_translations(
+        "DeepL", url, payload,
+        lambda data: [item["text"] for item in data["translations"]],
+        max_retries,
+        limiter or get_limiter("deepl", {"rate_limit_backoff_seconds": backoff}),
+    )
+
+
+def _google_translate(texts: list[str], target_lang: str, source_lang: str,
+                      api_key: str, backoff: int, max_retries: int,
+                      limiter: AdaptiveLimiter | None = None) -> list[str]:
+    """
+    Translate a list of strings using the Google Cloud Translation REST API (v2).
+    """
+    url = "https://translation.googleapis.com/language/translate/v2"
+    payload = {
+        "q": texts,
+        "source": source_lang,
+        "target": target_lang,
+        "format": "html",
+        "key": api_key,
+    }
+
+    return _post_translations(
+        "Google Translate", url, payload,
+        lambda data: [item["translatedText"] for item in data["data"]["translations"]],
+        max_retries,
+        limiter or get_limiter("google", {"rate_limit_backoff_seconds": backoff}),
+    )
+
+
+# The provider whose answer this thread's last translate_batch returned.
+_answered = threading.local()
+
+
+def answered_by(cfg: dict[str, Any]) -> str:
+    """The provider that translated this thread's last batch (routed or not)."""
+    return getattr(_answered, "provider", None) or route_providers(cfg)[0]
+
+
+def translate_batch(texts: list[str], target_lang: str, source_lang: str,
+                    cfg: dict[str, Any]) -> list[str]:
+    """
+    Dispatch a batch to the configured translation provider, or through the
+    provider router when ``routing.providers`` lists several.
+    Raises TranslationError when the batch could not be translated; the
+    "llm" provider may instead return None for single strings. The
+    provider that answered is then given by answered_by().
+    """
+    providers = route_providers(cfg)
+    if len(providers) > 1:
+        result, _answered.provider = get_router(cfg).translate(texts, target_lang,
+                                                               source_lang, cfg)
+        return result
+    _answered.provider = providers[0]
+    return provider_translate(providers[0], texts, target_lang, source_lang, cfg)
+
+
+# Providers that cannot serve this run (quota used up, access denied, no
+# key), with the reason; their later batches fail without a request.
+_unavailable: dict[str, str] = {}
+_unavailable_lock = threading.Lock()
+
+
+def provider_translate(provider: str, texts: list[str], target_lang: str, source_lang: str,
+                       cfg: dict[str, Any]) -> list[str]:
+    """
+    Send a batch to *provider*; raises TranslationError on failure. Once a
+    provider raised ProviderUnavailable, every later batch for it raises
+    the same error at once, until reset_router().
+    """
+    with _unavailable_lock:
+        reason = _unavailable.get(provider)
+    if reason is not None:
+        raise ProviderUnavailable(reason)
+    try:
+        return _provider_translate(provider, texts, target_lang, source_lang, cfg)
+    except ProviderUnavailable as exc:
+        with _unavailable_lock:
+            if provider not in _unavailable:
+                _unavailable[provider] = str(exc)
+                logger.warning("%s is unavailable for the rest of the run: %s", provider, exc)
+        raise
+
+
+def _provider_translate(provider: str, texts: list[str], target_lang: str, source_lang: str,
+                        cfg: dict[str, Any]) -> list[str]:
+    backoff = int(cfg["rate_limit_backoff_seconds"])
+    retries = int(cfg["max_retries"])
+
+    if provider == "deepl":
+        api_key = os.environ.get("DEEPL_API_KEY", "")
+        if not api_key:
+            raise ProviderUnavailable("DEEPL_API_KEY environment variable is not set.")
+        return _deepl_translate(texts, target_lang, source_lang, api_key, backoff, retries,
+                                get_limiter("deepl", cfg))
+
+    if provider == "google":
+        api_key = os.environ.get("GOOGLE_TRANSLATE_API_KEY", "")
+        if not api_key:
+            raise ProviderUnavailable("GOOGLE_TRANSLATE_API_KEY environment variable is not set.")
+        return _google_translate(texts, target_lang, source_lang, api_key, backoff, retries,
+                                 get_limiter("google", cfg))
+
+    if provider == "mock":
+        return _mock_translate(texts, target_lang, source_lang, cfg, retries,
+                               get_limiter("mock", cfg))
+
+    if provider == "llm":
+        return _llm_translate(texts, target_lang, source_lang, cfg, retries,
+                              get_limiter("llm", cfg))
+
+    raise ProviderUnavailable(f"Unknown api_provider '{provider}'. No translation performed.")
+
+# ---------------------------------------------------------------------------
+# Provider routing
+# ---------------------------------------------------------------------------
+
+def route_providers(cfg: dict[str, Any]) -> list[str]:
+    """``routing.providers`` in order of preference, else just ``api_provider``."""
+    providers = [p.lower() for p in cfg.get("routing", {}).get("providers", [])]
+    return providers or [cfg["api_provider"].lower()]
+
+
+def route_batch_limits(cfg: dict[str, Any]) -> BatchLimits:
+    """Request limits every routed provider accepts (a batch may go to any of them)."""
+    limits = [batch_limits_for(provider, cfg) for provider in route_providers(cfg)]
+    return BatchLimits(*(min(values) for values in zip(*limits)))
+
+
+class ProviderHealth:
+    """What the router knows about one provider during a run."""
+
+    __slots__ = ("name", "quota_chars", "chars_used", "chars_reserved", "latency_ms",
+                 "failures", "disabled")
+
+    def __init__(self, name: str, quota_chars: int | None):
+        self.name = name
+        self.quota_chars = quota_chars
+        self.chars_used = 0  # of successful requests only
+        self.chars_reserved = 0  # of requests in flight
+        self.latency_ms = 0.0  # moving average of successful requests
+        self.failures = 0  # consecutive
+        self.disabled = ""  # reason, once the provider cannot serve this run
+
+    def headroom(self, chars: int) -> bool:
+        return (self.quota_chars is None
+                or self.chars_used + self.chars_reserved + chars <= self.quota_chars)
+
+
+class ProviderRouter:
+    """
+    Spreads batches over several providers (``routing.providers``).
+
+    Each batch goes to the healthiest provider that can take it: not
+    disabled (quota used up, access denied, no key), within its
+    ``quota_chars``, not cooling down after throttling, with a free slot in
+    its rate limiter's window and with the fewest consecutive failures;
+    ties go to the provider listed first. A request still running after
+    ``hedge_after_ms`` – or three times the provider's average latency, if
+    that is longer – is hedged: sent to the next best provider as well, and
+    the first good answer wins; a losing hedge is cancelled if it has not
+    started, else its answer is dropped and counted. A failed request fails
+    over to the next provider, so one throttled or exhausted provider no
+    longer stalls the run; only when every provider failed is
+    TranslationError raised. Quota is reserved while a request is in flight
+    and charged only when it succeeds.
+    """
+
+    _LATENCY_WEIGHT = 0.2
+
+    def __init__(self, providers: list[str], cfg: dict[str, Any]):
+        routing = cfg.get("routing", {})
+        quotas = routing.get("quota_chars", {})
+        self.providers = [ProviderHealth(name, int(quotas[name]) if name in quotas else None)
+                          for name in providers]
+        self.hedge_after = float(routing.get("hedge_after_ms", 10_000)) / 1000
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=2 * len(providers) * max(1, int(cfg.get("max_inflight_batches", 4))),
+            thread_name_prefix="route",
+        )
+
+    def choose(self, chars: int, exclude: set[str], cfg: dict[str, Any]) -> ProviderHealth | None:
+        """The best provider for a batch of *chars* characters, None if none is left."""
+        now = time.monotonic()
+        candidates = []
+        with self._lock:
+            for order, health in enumerate(self.providers):
+                if health.name in exclude or health.disabled or not health.headroom(chars):
+                    continue
+                limiter = get_limiter(health.name, cfg)
+                candidates.append((
+                    limiter.cooldown_until > now,
+                    limiter.in_flight >= int(limiter.window),
+                    health.failures,
+                    order,
+                    health,
+                ))
+        return min(candidates, key=lambda c: c[:4])[4] if candidates else None
+
+    def _call(self, health: ProviderHealth, texts: list[str], target_lang: str,
+              source_lang: str, cfg: dict[str, Any]) -> list[str]:
+        chars = sum(len(t) for t in texts)
+        with self._lock:
+            health.chars_reserved += chars
+        name = health.name
+        STATS.add(f"provider_{name}_calls")
+        STATS.add(f"provider_{name}_chars", chars)
+        started = time.monotonic()
+        try:
+            result = provider_translate(name, texts, target_lang, source_lang, cfg)
+        except TranslationError as exc:
+            STATS.add(f"provider_{name}_errors")
+            with self._lock:
+                health.chars_reserved -= chars
+                health.failures += 1
+                if isinstance(exc, ProviderUnavailable) and not health.disabled:
+                    health.disabled = str(exc)
+                    logger.warning("Routing around %s for the rest of the run: %s", name, exc)
+            raise
+        latency_ms = (time.monotonic() - started) * 1000
+        STATS.add(f"provider_{name}_latency_ms", int(latency_ms))
+        STATS.add(f"provider_{name}_chars_billed", chars)
+        with self._lock:
+            health.chars_reserved -= chars
+            health.chars_used += chars
+            health.failures = 0
+            health.latency_ms = (latency_ms if not health.latency_ms else
+                                 health.latency_ms + self._LATENCY_WEIGHT * (latency_ms - health.latency_ms))
+        return result
+
+    def translate(self, texts: list[str], target_lang: str, source_lang: str,
+                  cfg: dict[str, Any]) -> tuple[list[str], str]:
+        """The translated *texts* and the name of the provider that answered."""
+        chars = sum(len(t) for t in texts)
+        tried: set[str] = set()
+        running: dict[Any, str] = {}
+        error: TranslationError | None = None
+        hedged = self.hedge_after <= 0
+
+        def _launch() -> bool:
+            health = self.choose(chars, tried, cfg)
+            if health is None:
+                return False
+            tried.add(health.name)
+            future = self._executor.submit(self._call, health, texts, target_lang, source_lang, cfg)
+            running[future] = health.name
+            return True
+
+        if not _launch():
+            raise TranslationError("No translation provider is available for this batch.")
+        first = next(iter(running.values()))
+        hedge_after = max(self.hedge_after, 3 * self._health(first).latency_ms / 1000)
+        while running:
+            done, _ = wait(running, timeout=None if hedged else hedge_after,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                if _launch():
+                    STATS.add("route_hedged")
+                    logger.info("Hedging a slow %s request to %s.", first, list(running.values())[-1])
+                continue
+            for future in done:
+                name = running.pop(future)
+                try:
+                    result = future.result()
+                except TranslationError as exc:
+                    error = exc
+                    logger.warning("%s failed, failing over: %s", name, exc)
+                    if not running and _launch():
+                        STATS.add("route_failovers")
+                    continue
+                if name != first:
+                    STATS.add("route_won_by_fallback")
+                for loser in running:
+                    # A started request cannot be aborted; its answer is dropped.
+                    STATS.add("route_hedges_cancelled" if loser.cancel() else "route_hedges_lost")
+                return result, name
+        raise error or TranslationError("Every translation provider failed for this batch.")
+
+    def _health(self, name: str) -> ProviderHealth:
+        return next(health for health in self.providers if health.name == name)
+
+    def shutdown(self) -> None:
+        # Lost hedges may still be running; they are not waited for.
+        self._executor.shutdown(wait=False)
+
+
+_router: ProviderRouter | None = None
+_router_lock = threading.Lock()
+
+
+def get_router(cfg: dict[str, Any]) -> ProviderRouter:
+    """Return the shared provider router, creating it on first call."""
+    global _router  # noqa: PLW0603
+    with _router_lock:
+        if _router is None:
+            _router = ProviderRouter(route_providers(cfg), cfg)
+        return _router
+
+
+def reset_router() -> None:
+    """Drop the shared router and forget which providers were unavailable."""
+    global _router  # noqa: PLW0603
+    with _router_lock:
+        if _router is not None:
+            _router.shutdown()
+            _router = None
+    with _unavailable_lock:
+        _unavailable.clear()
+
+# ---------------------------------------------------------------------------
+# Mock provider (offline benchmarking)
+# ---------------------------------------------------------------------------
+
+class MockTranslationAdapter(BaseAdapter):
+    """
+    In-process stand-in for the DeepL API, mounted on ``mock://`` URLs.
+
+    Speaks DeepL's request/response shapes, sleeps *latency_ms* (± *jitter_ms*)
+    per request, answers a *throttle_rate* fraction of requests with HTTP 429
+    and bills every character of successful requests (``mock_billed_chars``).
+    ``respond`` is shared with the HTTP stand-in in translate_bench.py.
+    """
+
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: float = 0.0, seed: int = 0):
+        super().__init__()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def respond(self, payload: dict[str, Any]) -> tuple[int, dict[str, str], dict[str, Any] | None]:
+        """Return (status, headers, JSON body) for a DeepL-shaped *payload*."""
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms))
+            throttled = self._rng.random() < self.throttle_rate
+        time.sleep(delay / 1000)
+        if throttled:
+            return 429, {"Retry-After": f"{self.retry_after:g}"}, None
+        texts = payload.get("text") or []
+        STATS.add("mock_requests")
+        STATS.add("mock_billed_chars", sum(len(t) for t in texts))
+        target = str(payload.get("target_lang", "")).upper()
+        return 200, {}, {"translations": [
+            {"detected_source_language": str(payload.get("source_lang", "")).upper(),
+             "text": f"[{target}] {t}"} for t in texts
+        ]}
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+        status, headers, body = self.respond(json.loads(request.body or b"{}"))
+        resp = requests.Response()
+        resp.status_code = status
+        resp.headers.update(headers)
+        resp._content = json.dumps(body).encode("utf-8") if body is not None else b""
+        resp.url = request.url or ""
+        resp.request = request
+        return resp
+
+    def close(self) -> None:
+        pass
+
+
+_mock_adapter: MockTranslationAdapter | None = None
+
+
+def get_mock_adapter(cfg: dict[str, Any]) -> MockTranslationAdapter:
+    """Return the shared mock provider, configured from ``mock_provider``."""
+    global _mock_adapter  # noqa: PLW0603
+    if _mock_adapter is None:
+        opts = cfg.get("mock_provider", {})
+        _mock_adapter = MockTranslationAdapter(
+            latency_ms=float(opts.get("latency_ms", 50)),
+            jitter_ms=float(opts.get("jitter_ms", 0)),
+            throttle_rate=float(opts.get("throttle_rate", 0)),
+            retry_after=float(opts.get("retry_after", 0)),
+            seed=int(opts.get("seed", 0)),
+        )
+    return _mock_adapter
+
+
+def reset_mock_adapter() -> None:
+    global _mock_adapter  # noqa: PLW0603
+    _mock_adapter = None
+
+
+def _mock_translate(texts: list[str], target_lang: str, source_lang: str,
+                    cfg: dict[str, Any], max_retries: int,
+                    limiter: AdaptiveLimiter) -> list[str]:
+    """
+    Translate through the mock provider with the DeepL request shape.
+    ``mock_provider.url`` points at an HTTP stand-in; otherwise the request
+    is answered in-process by the ``mock://`` adapter.
+    """
+    url = cfg.get("mock_provider", {}).get("url") or "mock://translate/v2/translate"
+    if url.startswith("mock://"):
+        http_session(url).mount("mock://", get_mock_adapter(cfg))
+    payload: dict[str, Any] = {
+        "target_lang": target_lang.upper().split("-")[0],
+        "source_lang": source_lang.upper(),
+        "text": texts,
+        "tag_handling": "html",
+    }
+    return _post_translations(
+        "Mock", url, payload,
+        lambda data: [item["text"] for item in data["translations"]],
+        max_retries, limiter,
+    )
+
+# ---------------------------------------------------------------------------
+# Local LLM provider (OpenAI/Ollama-compatible chat endpoint)
+# ---------------------------------------------------------------------------
+
+_LANGUAGE_NAMES = {
+    "af": "Afrikaans", "ar": "Arabic", "bg": "Bulgarian", "bn": "Bengali", "cs": "Czech",
+    "da": "Danish", "de": "German", "el": "Greek", "en": "English", "es": "Spanish",
+    "fi": "Finnish", "fr": "French", "he": "Hebrew", "hi": "Hindi", "hu": "Hungarian",
+    "id": "Indonesian", "it": "Italian", "ja": "Japanese", "ko": "Korean", "ms": "Malay",
+    "nl": "Dutch", "no": "Norwegian (Bokmål)", "pl": "Polish", "pt": "Portuguese",
+    "ro": "Romanian", "ru": "Russian", "sv": "Swedish", "th": "Thai", "tr": "Turkish",
+    "uk": "Ukrainian", "vi": "Vietnamese", "zh": "Chinese (Simplified)",
+}
+
+# Markup a translation must carry over unchanged: HTML tags and placeholders.
+_PLACEHOLDER_RE = re.compile(r"\{\{[^{}]*\}\}|\{[^{}\s]*\}|%[sd]|\$\d")
+_MARKUP_RE = re.compile(r"</?[A-Za-z][\w-]*|" + _PLACEHOLDER_RE.pattern)
+_NUMBERED_LINE_RE = re.compile(r"^\s*\[?(\d+)\s*[\]:.)]\s*(.*?)\s*$")
+
+
+def llm_settings(cfg: dict[str, Any]) -> dict[str, Any]:
+    """``llm_provider`` merged over OLLAMA_URL/OLLAMA_MODEL and the defaults."""
+    opts = cfg.get("llm_provider", {})
+    return {
+        "url": (opts.get("url") or os.environ.get("OLLAMA_URL")
+                or "http://127.0.0.1:11434").rstrip("/"),
+        "model": opts.get("model") or os.environ.get("OLLAMA_MODEL") or "aya-expanse:8b",
+        "api": str(opts.get("api", "openai")).lower(),
+        "temperature": float(opts.get("temperature", 0.2)),
+        "timeout_seconds": float(opts.get("timeout_seconds", 300)),
+    }
+
+
+def _markup_signature(text: str) -> list[str]:
+    return sorted(_MARKUP_RE.findall(text))
+
+
+def _placeholder_signature(text: str) -> list[str]:
+    return sorted(_PLACEHOLDER_RE.findall(text))
+
+
+def llm_prompt(texts: list[str], target_lang: str, source_lang: str) -> list[dict[str, str]]:
+    """Chat messages asking for one numbered JSON string per input line."""
+    target = _LANGUAGE_NAMES.get(target_lang.split("-")[0].lower(), target_lang)
+    source = _LANGUAGE_NAMES.get(source_lang.split("-")[0].lower(), source_lang)
+    system = (
+        f"You are a professional translator for a cybersecurity SaaS website. "
+        f"Translate each numbered {source} string into {target}.\n"
+        "Answer with exactly one line per input, in the input format: the number, "
+        "a colon and the translation as a JSON string, e.g. 1: \"…\". "
+        "Write nothing else.\n"
+        "Keep HTML tags, placeholders ({name}, {{…}}, %s), URLs, code and product "
+        "names exactly as they are. Return brand names and pure code unchanged."
+    )
+    lines = [f"{n}: {json.dumps(text, ensure_ascii=False)}" for n, text in enumerate(texts, 1)]
+    return [{"role": "system", "content": system}, {"role": "user", "content": "\n".join(lines)}]
+
+
+class NumberedOutputParser:
+    """
+    Incremental parser for ``N: "translation"`` lines of a streamed reply.
+
+    ``feed`` takes text deltas as they arrive and validates every completed
+    line against its source string: the number must be in range and not seen
+    before, the value non-empty, and its HTML tags and placeholders must
+    match the source. Valid items land in ``results``; ``done`` turns true
+    as soon as every item is in, so the stream can be cut off early.
+    """
+
+    def __init__(self, sources: list[str]):
+        self.sources = sources
+        self.results: dict[int, str] = {}
+        self.invalid = 0
+        self._buffer = ""
+
+    @property
+    def done(self) -> bool:
+        return len(self.results) == len(self.sources)
+
+    def feed(self, delta: str) -> None:
+        self._buffer += delta
+        *lines, self._buffer = self._buffer.split("\n")
+        for line in lines:
+            self._line(line)
+
+    def close(self) -> None:
+        line, self._buffer = self._buffer, ""
+        self._line(line)
+
+    def _line(self, line: str) -> None:
+        match = _NUMBERED_LINE_RE.match(line)
+        if not match:
+            return  # blank line or chatter around the list
+        index = int(match.group(1)) - 1
+        value = match.group(2)
+        if value.startswith('"'):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                value = value.strip('"')
+        if (not 0 <= index < len(self.sources) or index in self.results
+                or not isinstance(value, str) or not value.strip()
+                or _markup_signature(value) != _markup_signature(self.sources[index])):
+            self.invalid += 1
+            return
+        self.results[index] = value
+
+
+def _llm_deltas(resp: requests.Response, api: str) -> Iterator[str]:
+    """Content deltas of a streamed chat completion (SSE or Ollama NDJSON)."""
+    for raw in resp.iter_lines(decode_unicode=True):
+        if not raw:
+            continue
+        if api == "ollama":
+            chunk = json.loads(raw)
+            yield chunk.get("message", {}).get("content", "")
+            if chunk.get("done"):
+                return
+        elif raw.startswith("data:"):
+            data = raw[5:].strip()
+            if data == "[DONE]":
+                return
+            for choice in json.loads(data).get("choices", []):
+                yield (choice.get("delta") or {}).get("content") or ""
+
+
+def _llm_translate(texts: list[str], target_lang: str, source_lang: str,
+                   cfg: dict[str, Any], max_retries: int,
+                   limiter: AdaptiveLimiter) -> list[str | None]:
+    """
+    Translate through a local chat model, streaming the reply and parsing it
+    line by line. Each attempt re-sends only the strings still missing or
+    malformed – items validated before a dropped connection are kept.
+    Strings still missing after *max_retries* attempts are returned as None.
+    """
+    opts = llm_settings(cfg)
+    if opts["api"] == "ollama":
+        url = f"{opts['url']}/api/chat"
+    else:
+        url = f"{opts['url']}/v1/chat/completions"
+    result: list[str | None] = [None] * len(texts)
+    todo = list(range(len(texts)))
+
+    for attempt in range(max_retries):
+        if not todo:
+            break
+        if attempt:
+            STATS.add("retries")
+            STATS.add("llm_items_retried", len(todo))
+        sources = [texts[i] for i in todo]
+        payload: dict[str, Any] = {
+            "model": opts["model"],
+            "messages": llm_prompt(sources, target_lang, source_lang),
+            "stream": True,
+        }
+        if opts["api"] == "ollama":
+            payload["options"] = {"temperature": opts["temperature"]}
+        else:
+            payload["temperature"] = opts["temperature"]
+        parser = NumberedOutputParser(sources)
+
+        limiter.acquire()
+        outcome, retry_after = limiter.OK, None
+        try:
+            with http_session(url).post(url, json=payload, stream=True,
+                                        timeout=(10, opts["timeout_seconds"])) as resp:
+                # Only 429, 503 or a Retry-After mean the server is overloaded;
+                # any other failure is retried without shrinking the window.
+                retry_after = _retry_after(resp) if resp.status_code >= 400 else None
+                if resp.status_code in (429, 503) or retry_after is not None:
+                    outcome = limiter.THROTTLED
+                elif resp.status_code >= 500:
+                    outcome = limiter.ERROR
+                if outcome != limiter.OK:
+                    logger.warning("LLM returned HTTP %d (attempt %d/%d).",
+                                   resp.status_code, attempt + 1, max_retries)
+                    continue
+                try:
+                    resp.raise_for_status()
+                except requests.HTTPError as exc:
+                    raise TranslationError(f"LLM rejected the request: {exc}") from exc
+                for delta in _llm_deltas(resp, opts["api"]):
+                    parser.feed(delta)
+                    if parser.done:
+                        break  # closing the stream stops generation
+                else:
+                    parser.close()
+        except (requests.RequestException, ValueError) as exc:
+            outcome = limiter.ERROR
+            logger.warning("LLM stream failed (attempt %d/%d): %s", attempt + 1, max_retries, exc)
+        finally:
+            limiter.release(outcome, retry_after)
+
+        for local, translation in parser.results.items():
+            result[todo[local]] = translation
+        STATS.add("llm_items_invalid", parser.invalid)
+        todo = [i for i in todo if result[i] is None]
+        if todo and outcome == limiter.OK:
+            logger.warning("LLM returned %d of %d strings malformed or missing (attempt %d/%d).",
+                           len(todo), len(sources), attempt + 1, max_retries)
+
+    if len(todo) == len(texts):
+        raise TranslationError(f"LLM translation failed after {max_retries} attempts.")
+    return result
+
+# ---------------------------------------------------------------------------
+# Protected terms
+# ---------------------------------------------------------------------------
+
+# Spans no provider should see: they are masked before sending and restored
+# afterwards. Plain numbers are not masked (nothing to save) but, like
+# punctuation and emoji, do not make a string worth translating.
+_PROTECTED_TOKEN_RE = re.compile(r"""
+      (?:https?://|www\.)[^\s<>"']*[^\s<>"'.,;:!?)]           # URLs
+    | [\w.+-]+@[\w-]+(?:\.[\w-]+)+                            # e-mail addresses
+    | \bCVE-\d{4}-\d{4,}\b                                    # CVE ids
+    | (?:\bv|(?<=[Vv]ersion\s))                               # version numbers with a
+      (?!\d{1,2}\.\d{1,2}\.\d{2,4}\b|\d{1,3}(?:\.\d{3})+\b)   # v or "Version" before,
+      \d+(?:\.\d+){1,3}(?:-[\w.]+)?\b                         # never dates or 10.000
+    | \b(?=[0-9a-f]*\d)(?=[0-9a-f]*[a-f])[0-9a-f]{7,}\b       # hashes
+    | \{\{[^{}\s]+\}\}|\{[^{}\s]+\}                           # ICU/i18next placeholders
+    | `[^`\n]+`                                               # inline code
+    | (?<![\w-])--[a-z][\w-]*                                 # CLI flags
+    | (?<![^\s"'])/(?=[\w./-]*[A-Za-z_])                      # paths after a space, a
+      (?:(?:[\w.-]+/)+[\w.-]*[\w-]                            # quote or the start: two
+      |  [\w-]+(?:\.[\w-]+)*\.[A-Za-z][A-Za-z0-9]{0,4}\b)     # segments or an extension
+    | \b[\w-]+\.(?:json|ya?ml|conf|toml|ini|sh|py|js|ts|md|txt|log|env)\b  # file names
+    | \b[a-z][a-z0-9]*(?:_[a-z0-9]+)+\b                       # snake_case
+    | \b[a-z]+[A-Z][A-Za-z0-9]*\b                             # camelCase
+""", re.VERBOSE)
+# Masks are explicitly empty <x> elements, which DeepL leaves alone
+# (ignore_tags) and Google keeps in place. Restoring also accepts the forms
+# HTML handling may turn them into: self-closing, unclosed, or wrapped around
+# the text that follows (the text is kept).
+_MASK = '<x id="{}"></x>'
+_MASK_RE = re.compile(r'<x\s+id="(\d+)"\s*(?:/>|>((?:(?!<x\b).)*?)</x>|>)', re.S)
+# Tags of an inline segment (see inline_segment); plain strings may contain
+# a literal "<b>" that is text, not markup.
+_SEGMENT_TAG_RE = re.compile(r'<[A-Za-z][\w-]* i="\d+"/?>|</[A-Za-z][\w-]*>')
+
+
+class TermMatcher:
+    """
+    Aho–Corasick automaton over a fixed set of terms: finds every whole-word
+    occurrence of any term in one pass over the text, leftmost-longest and
+    non-overlapping.
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail = [0]
+        self._out = [0]  # length of the longest term ending in this state
+        for term in terms:
+            if not term:
+                continue
+            state = 0
+            for ch in term:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = self._goto[state][ch] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(0)
+                state = nxt
+            self._out[state] = max(self._out[state], len(term))
+        pending = list(self._goto[0].values())
+        for state in pending:  # breadth first: failure states are always done first
+            for ch, nxt in self._goto[state].items():
+                pending.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = max(self._out[nxt], self._out[self._fail[nxt]])
+
+    def __bool__(self) -> bool:
+        return len(self._goto) > 1
+
+    def spans(self, text: str) -> list[tuple[int, int]]:
+        goto, fail, out = self._goto, self._fail, self._out
+        found: list[tuple[int, int]] = []
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                start, end = i + 1 - out[state], i + 1
+                if ((start == 0 or not text[start - 1].isalnum() or not text[start].isalnum())
+                        and (end == len(text) or not text[end].isalnum()
+                             or not text[end - 1].isalnum())):
+                    found.append((start, end))
+        return found
+
+
+def _non_overlapping(spans: Iterable[tuple[int, int]]) -> list[tuple[int, int]]:
+    chosen: list[tuple[int, int]] = []
+    for start, end in sorted(spans, key=lambda span: (span[0], -span[1])):
+        if not chosen or start >= chosen[-1][1]:
+            chosen.append((start, end))
+    return chosen
+
+
+class TermProtector:
+    """Masks glossary terms and code-like tokens of one target language."""
+
+    def __init__(self, terms: Iterable[str]):
+        self.matcher = TermMatcher(terms)
+
+    def spans(self, text: str) -> list[tuple[int, int]]:
+        spans = [m.span() for m in _PROTECTED_TOKEN_RE.finditer(text)]
+        if self.matcher:
+            spans.extend(self.matcher.spans(text))
+        if ' i="' in text:  # inline segment: its tags are never masked
+            tags = [m.span() for m in _SEGMENT_TAG_RE.finditer(text)]
+            spans = [(a, b) for a, b in spans if not any(a < y and x < b for x, y in tags)]
+        return _non_overlapping(spans)
+
+    @staticmethod
+    def is_non_linguistic(text: str, spans: list[tuple[int, int]]) -> bool:
+        """True when nothing but protected spans, tags, digits, punctuation or emoji is left."""
+        last = 0
+        for start, end in spans + [(len(text), len(text))]:
+            rest = text[last:start]
+            if ' i="' in text:
+                rest = _SEGMENT_TAG_RE.sub("", rest)
+            if any(ch.isalpha() for ch in rest):
+                return False
+            last = end
+        return True
+
+    @staticmethod
+    def mask(text: str, spans: list[tuple[int, int]]) -> tuple[str, list[str]]:
+        parts: list[str] = []
+        values: list[str] = []
+        last = 0
+        for start, end in spans:
+            parts.append(text[last:start])
+            parts.append(_MASK.format(len(values)))
+            values.append(text[start:end])
+            last = end
+        parts.append(text[last:])
+        return "".join(parts), values
+
+    @staticmethod
+    def unmask(text: str, values: list[str]) -> str | None:
+        """Restore *values*; None if the provider dropped or duplicated a placeholder."""
+        seen: list[int] = []
+
+        def _restore(match: re.Match[str]) -> str:
+            index = int(match.group(1))
+            seen.append(index)
+            if index >= len(values):
+                return match.group(0)
+            return values[index] + (match.group(2) or "")
+
+        restored = _MASK_RE.sub(_restore, text)
+        return restored if sorted(seen) == list(range(len(values))) else None
+
+
+def glossary_terms(path: str, source_lang: str, target_lang: str) -> list[str]:
+    """Glossary terms whose *target_lang* rendering is the *source_lang* term itself."""
+    try:
+        with open(path, encoding="utf-8") as fh:
+            glossary = json.load(fh)
+    except FileNotFoundError:
+        logger.debug("No glossary at %s – protecting code-like tokens only.", path)
+        return []
+    except (OSError, ValueError) as exc:
+        logger.warning("Ignoring glossary %s: %s", path, exc)
+        return []
+    source = source_lang.split("-")[0].lower()
+    target = target_lang.split("-")[0].lower()
+    terms = []
+    for section in glossary.values():
+        for entry in section.values() if isinstance(section, dict) else []:
+            if not isinstance(entry, dict) or not isinstance(entry.get(source), str):
+                continue
+            term = entry[source]
+            # Languages the glossary does not list get only terms that are
+            # the same in every language it does list.
+            if entry.get(target, term if len(set(entry.values())) == 1 else None) == term:
+                terms.append(term)
+    return terms
+
+
+_protectors: dict[tuple[str, str, str], TermProtector] = {}
+_protectors_lock = threading.Lock()
+
+
+def get_protector(target_lang: str, cfg: dict[str, Any]) -> TermProtector | None:
+    """The shared protector for *target_lang*, or None with ``protected_terms`` off."""
+    if not cfg.get("protected_terms", True):
+        return None
+    key = (str(cfg.get("glossary") or ""), cfg["source_lang"], target_lang)
+    with _protectors_lock:
+        protector = _protectors.get(key)
+        if protector is None:
+            terms = glossary_terms(key[0], key[1], key[2]) if key[0] else []
+            protector = _protectors[key] = TermProtector(terms)
+        return protector
+
+
+def reset_protectors() -> None:
+    with _protectors_lock:
+        _protectors.clear()
+
+# ---------------------------------------------------------------------------
+# Translating strings
+# ---------------------------------------------------------------------------
+
+def translate_texts(texts: list[str], target_lang: str, cfg: dict[str, Any],
+                    failed: list[int] | None = None) -> list[str]:
+    """
+    Translate *texts* into *target_lang*.
+
+    Strings found in the translation memory are not sent, nor are strings
+    with no words outside protected terms (see get_protector); protected
+    spans of the rest are masked. The remaining unique strings are packed
+    into as few provider requests as the provider's item/size limits allow
+    (with routing, the limits of every routed provider). A batch the
+    providers give up on – or a single string returned as None – falls back
+    to the original text and is not cached; it is counted per language and
+    the indices of such strings are appended to *failed* when given.
+    """
+    source_lang = cfg["source_lang"]
+    provider = cfg["api_provider"].lower()
+    memory = get_translation_memory(cfg)
+
+    # Entries are kept per provider; with routing, any routed provider's
+    # earlier answer will do, the preferred provider's first.
+    translated: list[str | None] = [None] * len(texts)
+    if memory:
+        for name in route_providers(cfg):
+            todo = [i for i, hit in enumerate(translated) if hit is None]
+            if not todo:
+                break
+            hits = memory.lookup(name, source_lang, target_lang, [texts[i] for i in todo])
+            for i, hit in zip(todo, hits):
+                translated[i] = hit
+    misses: dict[str, list[int]] = {}
+    for i, (text, hit) in enumerate(zip(texts, translated)):
+        if hit is None:
+            misses.setdefault(text, []).append(i)
+        else:
+            STATS.add("tm_chars_saved", len(text))
+    if memory:
+        hit_count = len(texts) - sum(len(idx) for idx in misses.values())
+        STATS.add("tm_hits", hit_count)
+        STATS.add("tm_misses", len(texts) - hit_count)
+
+    # Protected terms and tokens are masked; strings without any words left
+    # are kept as they are and never sent.
+    protector = get_protector(target_lang, cfg)
+    masked: dict[str, tuple[str, list[str]]] = {}
+    if protector:
+        for text in list(misses):
+            spans = protector.spans(text)
+            if protector.is_non_linguistic(text, spans):
+                for idx in misses.pop(text):
+                    translated[idx] = text
+                STATS.add("protected_strings_skipped")
+                STATS.add("protected_chars_saved", len(text))
+            elif spans and not _MASK_RE.search(text):
+                masked[text] = protector.mask(text, spans)
+                STATS.add("protected_chars_saved", len(text) - len(masked[text][0]))
+
+    def _send(batch: list[str]) -> list[str | None] | None:
+        outgoing = [masked[t][0] if t in masked else t for t in batch]
+        chars = sum(len(t) for t in outgoing)
+        STATS.add("api_calls")
+        STATS.add("chars_sent", chars)
+        STATS.add(f"lang_{target_lang}_api_calls")
+        STATS.add(f"lang_{target_lang}_strings", len(batch))
+        STATS.add(f"lang_{target_lang}_chars", chars)
+        _answered.provider = None
+        try:
+            with STATS.timed("api_call"):
+                result = translate_batch(outgoing, target_lang, source_lang, cfg)
+        except TranslationError as exc:
+            logger.error("%s Keeping %d strings untranslated.", exc, len(batch))
+            STATS.add("untranslated", len(batch))
+            STATS.add(f"lang_{target_lang}_untranslated", len(batch))
+            return None
+        if masked:
+            result = [protector.unmask(dst, masked[src][1])  # type: ignore[union-attr]
+                      if src in masked and dst is not None else dst
+                      for src, dst in zip(batch, result)]
+        # As in the LLM parser, placeholders must survive unchanged.
+        rejected = {i for i, (src, dst) in enumerate(zip(batch, result))
+                    if dst is not None
+                    and _placeholder_signature(dst) != _placeholder_signature(src)}
+        if rejected:
+            STATS.add("translations_rejected", len(rejected))
+            result = [None if i in rejected else dst for i, dst in enumerate(result)]
+        if memory:
+            memory.store(answered_by(cfg), source_lang, target_lang,
+                         [(src, dst) for src, dst in zip(batch, result) if dst])
+        return result
+
+    pending = list(misses)
+    outgoing = [masked[t][0] if t in masked else t for t in pending]
+    batches = [[pending[i] for i in indices]
+               for indices in pack_batches(outgoing, route_batch_limits(cfg))]
+    if len(batches) > 1:
+        executor = get_batch_executor(provider, cfg)
+        results = [f.result() for f in [executor.submit(_send, b) for b in batches]]
+    else:
+        results = [_send(b) for b in batches]
+
+    for batch, result in zip(batches, results):
+        if result is None:
+            result = batch
+            if failed is not None:
+                failed.extend(idx for text in batch for idx in misses[text])
+        for text, trans in zip(batch, result):
+            if trans is None:  # a single string the provider could not translate
+                trans = text
+                STATS.add("untranslated")
+                STATS.add(f"lang_{target_lang}_untranslated")
+                if failed is not None:
+                    failed.extend(misses[text])
+            for idx in misses[text]:
+                translated[idx] = trans
+    return translated  # type: ignore[return-value]
+
+
+_batch_executors: dict[str, ThreadPoolExecutor] = {}
+_batch_executors_lock = threading.Lock()
+
+
+def get_batch_executor(provider: str, cfg: dict[str, Any]) -> ThreadPoolExecutor:
+    """Shared pool bounding the in-flight batches per provider."""
+    with _batch_executors_lock:
+        executor = _batch_executors.get(provider)
+        if executor is None:
+            executor = _batch_executors[provider] = ThreadPoolExecutor(
+                max_workers=max(1, int(cfg.get("max_inflight_batches", 4))),
+                thread_name_prefix=f"batch-{provider}",
+            )
+        return executor
+
+
+def shutdown_batch_executors() -> None:
+    with _batch_executors_lock:
+        for executor in _batch_executors.values():
+            executor.shutdown(wait=True)
+        _batch_executors.clear()
@@ -7,8 +7,20 @@ Automated website translation script.
 Reads config/translate_config.json (or a path supplied via --config), fetches
 every URL listed in the sitemap (or scans a local HTML directory), extracts all
 translatable text nodes (visible text, <title>, <meta description>, alt
-attributes, OpenGraph tags), translates them via DeepL or Google Translate, and
-writes the translated HTML files into language sub-folders (e.g. i18n/en/…).
+attributes, OpenGraph tags), translates them via DeepL, Google Translate or a
+local LLM, and writes the translated HTML files into language sub-folders
+(e.g. i18n/en/…).
+
+Each page is fetched and parsed once: the parsed page is reduced to a
+template of literal HTML around translatable slots, and every target language
+is rendered from that template without touching the parser again.
+
+This file holds the configuration, run(), the run report and the CLI. The
+subsystems live next to it: translate_providers.py (translation memory,
+batching, rate limiting, provider clients and routing), translate_pipeline.py
+(discovery, templates, output, sitemaps, resume and the page pipeline) and
+translate_dictionaries.py (dictionary mode), on top of translate_common.py
+(logging, HTTP sessions, run statistics).
 
 Usage
 -----
@@ -18,50 +30,148 @@ Environment variables
 ---------------------
     DEEPL_API_KEY              – required when api_provider == "deepl"
     GOOGLE_TRANSLATE_API_KEY   – required when api_provider == "google"
+    DEEPL_API_URL              – optional DeepL endpoint override (e.g. a local stand-in)
+    OLLAMA_URL, OLLAMA_MODEL   – defaults for llm_provider.url / .model
 
 Configuration keys (config/translate_config.json)
 --------------------------------------------------
     sitemap_url          – URL of the live sitemap (used when local_html_dir is empty)
     local_html_dir       – path to a local directory of HTML files (overrides sitemap_url)
+    sitemap_workers      – child sitemaps fetched and parsed concurrently
+                           (plain or gzip-compressed sitemaps)
     source_lang          – BCP-47 language code of the source content (e.g. "de")
     target_langs         – list of BCP-47 codes to translate into (e.g. ["en", "fr", "es"])
-    api_provider         – "deepl" | "google"
+    api_provider         – "deepl" | "google" | "llm" (local OpenAI/Ollama-compatible
+                           chat endpoint) | "mock" (offline, for benchmarks)
+    llm_provider         – llm settings: url (server root, default OLLAMA_URL or
+                           http://127.0.0.1:11434), model (default OLLAMA_MODEL or
+                           aya-expanse:8b), api ("openai" → /v1/chat/completions, or
+                           "ollama" → /api/chat), temperature, timeout_seconds.
+                           Replies are streamed and validated line by line; only
+                           malformed strings are re-sent.
+    mock_provider        – mock settings: latency_ms, jitter_ms, throttle_rate (share of
+                           requests answered with 429), retry_after, seed, url
+                           (an HTTP stand-in instead of the in-process adapter)
+    routing              – spread batches over several providers: providers (in order
+                           of preference, e.g. ["deepl", "google", "llm"]; empty: only
+                           api_provider), quota_chars (per-provider character budget
+                           for this run), hedge_after_ms (send a slow request to the
+                           next provider too after this long; 0 disables). Each batch
+                           goes to the healthiest provider with headroom and fails
+                           over to the next; the translation memory keeps routed
+                           results under api_provider
+    price_per_million_chars – per-provider prices used for the cost estimate
+    report_file          – JSON run report with per-stage wall/CPU time, bytes fetched,
+                           per-language strings/characters, retries, throttling and
+                           cache/dedup savings ("" disables)
+    progress_interval_seconds – log a progress line this often (0 disables)
     output_dir           – root output directory (default "i18n")
     domain_mapping       – dict mapping original domain to translated domain (optional)
     preserve_urls        – if true, keep original URLs in href/src attributes
+    merge_inline_segments – send each block whose content is only text and inline
+                           tags (a, span, strong, em, b, i, br) as one HTML segment
+                           instead of one item per string: fewer, larger items with
+                           full sentence context; tags travel as <a i="0">…</a>
     hreflang_options     – inject_hreflang_tags (bool), x_default_lang (str)
+    protected_terms      – mask glossary terms that stay the same in the target language
+                           and code-like tokens (URLs, e-mail addresses, versions,
+                           hashes, paths, identifiers, CLI flags, {name} placeholders)
+                           before sending, and keep strings with no words outside
+                           them (numbers, punctuation, emoji) without an API call;
+                           translations that change a placeholder are rejected
+    glossary             – glossary JSON ({section: {term: {lang: text}}}, "" for none)
     batch_size           – max text strings per API call
-    rate_limit_backoff_seconds – sleep time on HTTP 429
+    batch_limits         – per-provider overrides of the request limits used to
+                           pack batches, e.g. {"deepl": {"max_bytes": 60000}}
+                           (keys: max_items, max_chars, max_bytes)
+    rate_limit_backoff_seconds – cap on the exponential backoff after HTTP 429/5xx
+                           (a Retry-After header from the provider is honoured as is)
+    rate_limits          – per-provider {"requests_per_second", "max_concurrency"}
+                           starting points for the adaptive limiter
     max_retries          – number of retries per batch on transient errors
     log_level            – Python logging level name (e.g. "INFO")
-    resume               – if true, skip pages whose output file already exists
+    resume               – if true, skip page/language pairs recorded as done in the
+                           append-only journal .translate_resume.jsonl
+    incremental          – skip pages unchanged since the last run (sitemap
+                           <lastmod>, else source hash) and translate only new or
+                           modified strings of changed pages (ignores the resume log)
+    incremental_state    – SQLite file holding the per-page state for incremental
+    translation_memory   – SQLite file caching translations across runs ("" disables)
+    translation_memory_max_entries – evict least-recently-used entries beyond this
+    site_dedup           – extract the whole site first and translate each unique
+                           string once per language (holds all pages in memory)
+    sitemap_output       – sitemaps for the translated pages: dir (e.g. "i18n", served
+                           at /i18n/; "" disables), base_url (e.g.
+                           "https://www.clawguru.com"; default: each page's host, and
+                           no index is written before a page gave one),
+                           max_urls per file (at most 50,000). Writes
+                           sitemap-{lang}-{n}.xml with <xhtml:link> alternates as
+                           pages finish, and sitemap-index.xml
+    output_manifest      – JSON Lines file listing every output file with its
+                           sha256 and whether this run wrote it ("" disables);
+                           files whose content is unchanged are never rewritten
+    fetch_workers        – concurrent page fetch/parse workers
+    parse_workers        – worker processes for parsing, extraction and serialization
+                           (0: parse in the fetch threads); use up to one per core
+                           for large local_html_dir trees
+    translate_workers    – pages being translated concurrently
+    max_inflight_batches – concurrent API batches per provider (the adaptive
+                           limiter may hold back further)
+    write_workers        – output writer threads
+    pipeline_queue_size  – bound of the queues between pipeline stages
+    max_inflight_pages   – pages between fetch and their last write at any time
+                           (0: bounded by the queues only)
+    dictionary_mode      – translate JSON locale dictionaries instead of pages (also
+                           --dictionaries): missing, empty or stale keys of every
+                           target file are sent, languages concurrently, and files
+                           are rewritten atomically in their own key order and layout
+    dictionaries         – list of {"path", "source_lang", "skip_keys", "target_langs"};
+                           path contains {lang} and may use * (e.g.
+                           "locales/{lang}/*.json"); target_langs defaults to the
+                           languages that already have files; skip_keys are dotted
+                           key prefixes left alone
+    dictionary_state     – JSON sidecar with the source hash each dictionary key was
+                           translated from (commit it with the dictionaries)
+    http_pool_size       – keep-alive connections per host (default: the larger
+                           of fetch_workers and max_inflight_batches)
 """
 
 import argparse
 import json
 import logging
-import os
-import re
 import sys
+import threading
 import time
 from pathlib import Path
 from typing import Any
-from urllib.parse import urljoin, urlparse
 
-import requests
-from bs4 import BeautifulSoup, Comment, NavigableString, Tag
-
-# ---------------------------------------------------------------------------
-# Logging
-# ---------------------------------------------------------------------------
-
-def setup_logging(level_name: str) -> None:
-    level = getattr(logging, level_name.upper(), logging.INFO)
-    logging.basicConfig(
-        format="%(asctime)s [%(levelname)s] %(message)s",
-        datefmt="%Y-%m-%dT%H:%M:%S",
-        level=level,
-    )
+from translate_common import (
+    STATS, close_http_sessions, configure_http, setup_logging, write_atomic,
+)
+from translate_providers import (
+    close_translation_memory, estimated_cost, get_translation_memory, price_per_million_chars,
+    reset_limiters, reset_mock_adapter, reset_protectors, reset_router, route_providers,
+    shutdown_batch_executors,
+)
+from translate_pipeline import (
+    ResumeJournal, close_output_writer, close_sitemap_writer, discover_pages,
+    open_output_writer, open_page_state, open_sitemap_writer, run_pipeline, run_site_dedup,
+    shutdown_parse_pool, start_parse_pool,
+)
+from translate_dictionaries import run_dictionaries
+
+# The script's original public functions stay importable from here.
+from translate_pipeline import (  # noqa: F401
+    TextNode, apply_translations, collect_local_html_files, extract_text_nodes, fetch_html,
+    fetch_urls_from_sitemap, inject_hreflang_tags, load_html, output_path_for,
+    output_path_for_local, translate_page,
+)
+from translate_providers import translate_batch  # noqa: F401
+
+try:  # POSIX only – peak RSS is left out of the report without it
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None  # type: ignore[assignment]
 
 logger = logging.getLogger(__name__)
 
@@ -72,6 +182,7 @@ logger = logging.getLogger(__name__)
 DEFAULT_CONFIG: dict[str, Any] = {
     "sitemap_url": "",
     "local_html_dir": "",
+    "sitemap_workers": 4,
     "source_lang": "de",
     "target_langs": ["en", "fr", "es"],
     "api_provider": "deepl",
@@ -82,11 +193,45 @@ DEFAULT_CONFIG: dict[str, Any] = {
         "inject_hreflang_tags": True,
         "x_default_lang": "de",
     },
+    "routing": {
+        "providers": [],
+        "quota_chars": {},
+        "hedge_after_ms": 10_000,
+    },
     "batch_size": 50,
     "rate_limit_backoff_seconds": 60,
     "max_retries": 3,
     "log_level": "INFO",
     "resume": True,
+    "translation_memory": ".translate_memory.sqlite",
+    "translation_memory_max_entries": 500_000,
+    "output_manifest": ".translate_output_manifest.jsonl",
+    "sitemap_output": {
+        "dir": "",
+        "base_url": "",
+        "max_urls": 50_000,
+    },
+    "site_dedup": False,
+    "incremental": False,
+    "incremental_state": ".translate_state.sqlite",
+    "fetch_workers": 4,
+    "parse_workers": 0,
+    "translate_workers": 4,
+    "max_inflight_batches": 4,
+    "write_workers": 2,
+    "pipeline_queue_size": 16,
+    "max_inflight_pages": 64,
+    "report_file": ".translate_report.json",
+    "progress_interval_seconds": 30,
+    "merge_inline_segments": False,
+    "protected_terms": True,
+    "glossary": "locales/glossary.json",
+    "dictionary_mode": False,
+    "dictionaries": [
+        {"path": "dictionaries/{lang}.json", "source_lang": "en", "skip_keys": ["roast"]},
+        {"path": "locales/{lang}/*.json", "source_lang": "de"},
+    ],
+    "dictionary_state": ".translate_dictionaries.json",
 }
 
 
@@ -105,567 +250,336 @@ def load_config(config_path: str) -> dict[str, Any]:
     return cfg
 
 # ---------------------------------------------------------------------------
-# Sitemap parsing
+# Run
 # ---------------------------------------------------------------------------
 
-def fetch_urls_from_sitemap(sitemap_url: str) -> list[str]:
-    """
-    Recursively fetch all page URLs from a sitemap or sitemap index.
-    Returns a deduplicated list of page URLs.
-    """
-    urls: list[str] = []
-    visited_sitemaps: set[str] = set()
-
-    def _process(url: str) -> None:
-        if url in visited_sitemaps:
-            return
-        visited_sitemaps.add(url)
-        try:
-            resp = requests.get(url, timeout=30)
-            resp.raise_for_status()
-        except requests.RequestException as exc:
-            logger.error("Failed to fetch sitemap %s: %s", url, exc)
-            return
-
-        soup = BeautifulSoup(resp.content, "xml")
-
-        # Sitemap index – recurse into child sitemaps
-        for loc in soup.find_all("sitemap"):
-            child_loc = loc.find("loc")
-            if child_loc and child_loc.text.strip():
-                _process(child_loc.text.strip())
-
-        # URL set – collect page URLs
-        for loc in soup.find_all("url"):
-            page_loc = loc.find("loc")
-            if page_loc and page_loc.text.strip():
-                urls.append(page_loc.text.strip())
-
-    _process(sitemap_url)
-    # Deduplicate while preserving order
-    seen: set[str] = set()
-    result: list[str] = []
-    for u in urls:
-        if u not in seen:
-            seen.add(u)
-            result.append(u)
-    logger.info("Discovered %d URLs from sitemap.", len(result))
-    return result
-
-
-def collect_local_html_files(directory: str) -> list[tuple[str, str]]:
-    """
-    Walk *directory* and return a list of (file_path, relative_url) tuples
-    for every .html / .htm file found.
-    """
-    base = Path(directory).resolve()
-    pairs: list[tuple[str, str]] = []
-    for html_file in sorted(base.rglob("*.html")):
-        rel = html_file.relative_to(base)
-        # Convert path separators to URL slashes
-        pairs.append((str(html_file), "/" + rel.as_posix()))
-    for html_file in sorted(base.rglob("*.htm")):
-        rel = html_file.relative_to(base)
-        pairs.append((str(html_file), "/" + rel.as_posix()))
-    logger.info("Found %d local HTML files in %s.", len(pairs), directory)
-    return pairs
+def run(cfg: dict[str, Any]) -> None:
+    """Main entry point – orchestrates discovery, translation, and file writing."""
+    setup_logging(cfg.get("log_level", "INFO"))
 
-# ---------------------------------------------------------------------------
-# HTML fetching / loading
-# ---------------------------------------------------------------------------
+    target_langs: list[str] = cfg["target_langs"]
+    dictionary_mode = bool(cfg.get("dictionary_mode", False))
+    incremental = bool(cfg.get("incremental", False))
+    # Incremental and dictionary mode decide from their own state, not the resume log.
+    resume = bool(cfg.get("resume", True)) and not incremental and not dictionary_mode
 
-def fetch_html(url: str) -> str | None:
-    """Fetch a URL and return its HTML text, or None on failure."""
-    try:
-        resp = requests.get(url, timeout=30)
-        resp.raise_for_status()
-        return resp.text
-    except requests.RequestException as exc:
-        logger.error("Failed to fetch %s: %s", url, exc)
-        return None
+    if not target_langs and not dictionary_mode:
+        logger.error("No target_langs configured. Nothing to do.")
+        sys.exit(1)
 
+    STATS.reset()
+    reset_limiters()
+    reset_router()
+    reset_protectors()
+    reset_mock_adapter()
+
+    # --- Discover pages (streamed into the pipeline) ---
+    # First, so a configuration error exits before anything is started or opened.
+    pages = discover_pages(cfg) if not dictionary_mode else iter(())
+
+    get_translation_memory(cfg)  # open once, before worker threads start
+    configure_http(cfg)
+    started = time.monotonic()
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    progress = ProgressReporter(float(cfg.get("progress_interval_seconds", 30)))
+    progress.start()
+
+    journal = ResumeJournal() if resume else None
+    done_count = 0
+    done_lock = threading.Lock()
+
+    def pending_langs(page_url: str) -> list[str]:
+        return [lang for lang in target_langs
+                if not (journal is not None and f"{page_url}:{lang}" in journal)]
+
+    def mark_done(key: str) -> None:
+        nonlocal done_count
+        with done_lock:
+            done_count += 1
+        if journal is not None:
+            journal.add(key)
 
-def load_html(path: str) -> str | None:
-    """Read a local HTML file and return its text, or None on failure."""
     try:
-        return Path(path).read_text(encoding="utf-8", errors="replace")
-    except OSError as exc:
-        logger.error("Failed to read %s: %s", path, exc)
-        return None
-
-# ---------------------------------------------------------------------------
-# Text extraction
-# ---------------------------------------------------------------------------
-
-# Tags whose visible text content should be translated
-_TRANSLATE_TAGS = {
-    "p", "h1", "h2", "h3", "h4", "h5", "h6",
-    "li", "td", "th", "caption", "blockquote",
-    "dt", "dd", "figcaption", "label", "button",
-    "span", "a", "strong", "em", "b", "i",
-    "div",  # only leaf div nodes (no nested block children)
-}
-
-# Tags whose content we skip entirely
-_SKIP_TAGS = {"script", "style", "noscript", "code", "pre", "svg"}
-
-
-def _is_leaf_text_node(tag: Tag) -> bool:
-    """Return True if *tag* has no block-level children (treat it as a leaf)."""
-    block_tags = {"p", "div", "section", "article", "header", "footer",
-                  "aside", "ul", "ol", "table", "blockquote", "pre"}
-    for child in tag.children:
-        if isinstance(child, Tag) and child.name in block_tags:
-            return False
-    return True
-
-
-class TextNode:
-    """Represents a single translatable piece of text found in the HTML."""
-    __slots__ = ("key", "original", "translated", "node_ref", "attr")
-
-    def __init__(self, key: str, original: str, node_ref: Any, attr: str | None = None):
-        self.key = key
-        self.original = original.strip()
-        self.translated: str | None = None
-        self.node_ref = node_ref  # NavigableString or Tag
-        self.attr = attr          # attribute name if this is an attribute value
-
-
-def extract_text_nodes(soup: BeautifulSoup) -> list[TextNode]:
-    """
-    Walk the parsed HTML tree and collect all translatable text nodes.
-
-    Covers:
-    - <title> text
-    - <meta name="description"> content attribute
-    - <meta property="og:*"> content attribute
-    - <meta name="twitter:*"> content attribute
-    - alt attributes on <img> tags
-    - visible text inside standard HTML elements
-    """
-    nodes: list[TextNode] = []
-    idx = 0
-
-    def _add(text: str, node_ref: Any, attr: str | None = None) -> None:
-        nonlocal idx
-        clean = text.strip()
-        if clean and not clean.isspace():
-            nodes.append(TextNode(f"node_{idx}", clean, node_ref, attr))
-            idx += 1
-
-    # --- <title> ---
-    title_tag = soup.find("title")
-    if title_tag and title_tag.string:
-        _add(title_tag.string, title_tag.string, attr=None)
-
-    # --- <meta description / og / twitter> ---
-    for meta in soup.find_all("meta"):
-        name = meta.get("name", "").lower()
-        prop = meta.get("property", "").lower()
-        content = meta.get("content", "").strip()
-        if not content:
-            continue
-        # "keywords" is intentionally excluded – it contains comma-separated
-        # terms that are best left in the source language for SEO consistency.
-        if name == "description" or prop.startswith("og:") or name.startswith("twitter:"):
-            _add(content, meta, attr="content")
-
-    # --- alt attributes on images ---
-    for img in soup.find_all("img"):
-        alt = img.get("alt", "").strip()
-        if alt:
-            _add(alt, img, attr="alt")
-
-    # --- visible body text ---
-    body = soup.find("body")
-    if body:
-        for element in body.descendants:
-            if isinstance(element, Comment):
-                continue
-            if isinstance(element, NavigableString):
-                text = str(element)
-                if not text.strip():
-                    continue
-                parent = element.parent
-                if parent is None:
-                    continue
-                # Skip undesirable parent tags
-                if parent.name in _SKIP_TAGS:
-                    continue
-                # Only collect from known translatable tags
-                if parent.name in _TRANSLATE_TAGS:
-                    # Avoid duplicating text already covered by a parent node
-                    _add(text, element, attr=None)
-
-    return nodes
-
-# ---------------------------------------------------------------------------
-# Translation API clients
-# ---------------------------------------------------------------------------
-
-def _deepl_translate(texts: list[str], target_lang: str, source_lang: str,
-                     api_key: str, backoff: int, max_retries: int) -> list[str]:
-    """
-    Translate a list of strings using the DeepL REST API.
-    Supports both the free (api-free.deepl.com) and pro (api.deepl.com) endpoints.
-    """
-    # DeepL language codes are uppercase; only the primary subtag is sent
-    # (e.g. "en-US" → "EN", "fr-BE" → "FR"). Regional variants are therefore
-    # treated as the base language when calling the API.
-    tl = target_lang.upper().split("-")[0]  # e.g. EN, FR, ES, ZH
-    sl = source_lang.upper()
-
-    # Choose endpoint based on key suffix
-    host = "api-free.deepl.com" if api_key.endswith(":fx") else "api.deepl.com"
-    url = f"https://{host}/v2/translate"
-
-    payload: dict[str, Any] = {
-        "auth_key": api_key,
-        "target_lang": tl,
-        "source_lang": sl,
-        "text": texts,
-        "tag_handling": "html",
-        "non_splitting_tags": ["em", "strong", "b", "i", "a", "span"],
-    }
-
-    for attempt in range(max_retries):
-        try:
-            resp = requests.post(url, json=payload, timeout=60)
-            if resp.status_code == 429:
-                logger.warning("DeepL rate limit hit. Sleeping %ds (attempt %d/%d).",
-                               backoff, attempt + 1, max_retries)
-                time.sleep(backoff)
-                continue
-            resp.raise_for_status()
-            data = resp.json()
-            return [item["text"] for item in data["translations"]]
-        except requests.RequestException as exc:
-            logger.warning("DeepL request error (attempt %d/%d): %s", attempt + 1, max_retries, exc)
-            if attempt < max_retries - 1:
-                time.sleep(backoff)
-
-    logger.error("DeepL translation failed after %d retries.", max_retries)
-    return texts  # fall back to original text
-
-
-def _google_translate(texts: list[str], target_lang: str, source_lang: str,
-                      api_key: str, backoff: int, max_retries: int) -> list[str]:
-    """
-    Translate a list of strings using the Google Cloud Translation REST API (v2).
-    """
-    url = "https://translation.googleapis.com/language/translate/v2"
-    payload = {
-        "q": texts,
-        "source": source_lang,
-        "target": target_lang,
-        "format": "html",
-        "key": api_key,
-    }
-
-    for attempt in range(max_retries):
-        try:
-            resp = requests.post(url, json=payload, timeout=60)
-            if resp.status_code == 429:
-                logger.warning("Google Translate rate limit hit. Sleeping %ds (attempt %d/%d).",
-                               backoff, attempt + 1, max_retries)
-                time.sleep(backoff)
-                continue
-            resp.raise_for_status()
-            data = resp.json()
-            return [item["translatedText"] for item in data["data"]["translations"]]
-        except (requests.RequestException, KeyError) as exc:
-            logger.warning("Google Translate error (attempt %d/%d): %s", attempt + 1, max_retries, exc)
-            if attempt < max_retries - 1:
-                time.sleep(backoff)
-
-    logger.error("Google Translate failed after %d retries.", max_retries)
-    return texts
-
-
-def translate_batch(texts: list[str], target_lang: str, source_lang: str,
-                    cfg: dict[str, Any]) -> list[str]:
-    """Dispatch a batch to the configured translation provider."""
-    provider = cfg["api_provider"].lower()
-    backoff = int(cfg["rate_limit_backoff_seconds"])
-    retries = int(cfg["max_retries"])
-
-    if provider == "deepl":
-        api_key = os.environ.get("DEEPL_API_KEY", "")
-        if not api_key:
-            logger.error("DEEPL_API_KEY environment variable is not set.")
-            return texts
-        return _deepl_translate(texts, target_lang, source_lang, api_key, backoff, retries)
-
-    if provider == "google":
-        api_key = os.environ.get("GOOGLE_TRANSLATE_API_KEY", "")
-        if not api_key:
-            logger.error("GOOGLE_TRANSLATE_API_KEY environment variable is not set.")
-            return texts
-        return _google_translate(texts, target_lang, source_lang, api_key, backoff, retries)
-
-    logger.error("Unknown api_provider '%s'. No translation performed.", provider)
-    return texts
-
-# ---------------------------------------------------------------------------
-# Applying translations back to the HTML tree
-# ---------------------------------------------------------------------------
-
-def apply_translations(nodes: list[TextNode], translated: list[str]) -> None:
-    """Write translated strings back into the BeautifulSoup tree."""
-    assert len(nodes) == len(translated), (
-        f"Node/translation count mismatch: expected {len(nodes)}, got {len(translated)}"
-    )
-    for node, trans in zip(nodes, translated):
-        if not trans:
-            continue
-        if node.attr is not None:
-            # Attribute-based node (meta content, img alt, etc.)
-            node.node_ref[node.attr] = trans
-        else:
-            # NavigableString – replace in place
-            node.node_ref.replace_with(trans)
-
-
-# ---------------------------------------------------------------------------
-# hreflang injection
-# ---------------------------------------------------------------------------
-
-def inject_hreflang_tags(soup: BeautifulSoup, page_url: str,
-                         source_lang: str, target_langs: list[str],
-                         x_default: str, output_dir: str,
-                         domain_mapping: dict[str, str]) -> None:
-    """
-    Inject <link rel="alternate" hreflang="…"> tags into the <head>.
-    All alternate URLs are constructed from the output_dir path convention.
-    """
-    head = soup.find("head")
-    if head is None:
-        return
-
-    parsed = urlparse(page_url)
-    # Build a list of (lang, url) pairs for the hreflang set
-    all_langs = [source_lang] + list(target_langs)
-    for lang in all_langs:
-        if lang == source_lang:
-            href = page_url
+        if not dictionary_mode:
+            start_parse_pool(cfg)
+            open_output_writer(cfg)
+            open_sitemap_writer(cfg)
+        if dictionary_mode:
+            run_dictionaries(cfg)
+        elif cfg.get("site_dedup", False):
+            if incremental:
+                logger.warning("incremental is not supported with site_dedup; translating every page.")
+            run_site_dedup(pages, pending_langs, cfg, mark_done)
         else:
-            # Translated pages live at /{output_dir}/{lang}/{path}
-            href = f"/{output_dir}/{lang}{parsed.path}"
-
-        # Apply optional domain mapping
-        for orig_domain, new_domain in domain_mapping.items():
-            href = href.replace(orig_domain, new_domain)
-
-        link = soup.new_tag("link", rel="alternate", hreflang=lang, href=href)
-        head.append(link)
-
-    # x-default – point to the language configured as the canonical default
-    if x_default == source_lang:
-        xdefault_href = page_url
-    else:
-        xdefault_href = f"/{output_dir}/{x_default}{parsed.path}"
-        for orig_domain, new_domain in domain_mapping.items():
-            xdefault_href = xdefault_href.replace(orig_domain, new_domain)
-    link_default = soup.new_tag("link", rel="alternate", hreflang="x-default", href=xdefault_href)
-    head.append(link_default)
-
-# ---------------------------------------------------------------------------
-# Output path computation
-# ---------------------------------------------------------------------------
-
-def output_path_for(page_url: str, lang: str, output_dir: str) -> Path:
-    """
-    Given a page URL and a language code, return the local file path where
-    the translated HTML should be written.
-
-    Examples:
-      https://example.com/       -> i18n/en/index.html
-      https://example.com/about  -> i18n/en/about/index.html
-      https://example.com/a/b/   -> i18n/en/a/b/index.html
-    """
-    parsed = urlparse(page_url)
-    path = parsed.path.rstrip("/") or "/"
-
-    if path == "/":
-        rel = "index.html"
-    elif path.endswith(".html") or path.endswith(".htm"):
-        rel = path.lstrip("/")
+            state = open_page_state(cfg)
+            try:
+                run_pipeline(pages, pending_langs, cfg, mark_done, state)
+            finally:
+                if state:
+                    state.close()
+    finally:
+        progress.stop()
+        shutdown_parse_pool()
+        close_output_writer()
+        close_sitemap_writer()
+        if journal is not None:
+            journal.close()
+
+    if not STATS.get("pages_discovered") and not dictionary_mode:
+        logger.warning("No pages discovered.")
+
+    shutdown_batch_executors()
+    reset_router()
+    close_http_sessions()
+    close_translation_memory()
+
+    if dictionary_mode:
+        logger.info("Dictionaries synced: %d keys translated, %d files written.",
+                    STATS.get("dict_keys_translated"), STATS.get("dict_files_written"))
     else:
-        rel = path.lstrip("/") + "/index.html"
-
-    return Path(output_dir) / lang / rel
-
-
-def output_path_for_local(rel_url: str, lang: str, output_dir: str) -> Path:
-    """Same as output_path_for but for a local relative URL."""
-    return output_path_for(f"http://localhost{rel_url}", lang, output_dir)
-
-# ---------------------------------------------------------------------------
-# Resume support
-# ---------------------------------------------------------------------------
-
-RESUME_LOG = ".translate_resume.json"
-
-
-def load_resume_log() -> set[str]:
-    """Return a set of already-translated page keys (url:lang)."""
-    p = Path(RESUME_LOG)
-    if p.exists():
-        try:
-            data = json.loads(p.read_text(encoding="utf-8"))
-            return set(data.get("done", []))
-        except (json.JSONDecodeError, OSError):
-            pass
-    return set()
-
-
-def save_resume_log(done: set[str]) -> None:
-    """Persist the set of completed page keys to disk."""
-    try:
-        Path(RESUME_LOG).write_text(
-            json.dumps({"done": sorted(done)}, indent=2),
-            encoding="utf-8",
+        logger.info("Translation complete. %d page/language combinations processed.",
+                    done_count)
+    elapsed = time.monotonic() - started
+    log_run_summary(elapsed, cfg)
+    report_file = str(cfg.get("report_file") or "")
+    if report_file:
+        write_run_report(report_file, build_run_report(elapsed, cfg, started_at))
+
+
+def _average_latency_ms(provider: str) -> float:
+    ok = STATS.get(f"provider_{provider}_calls") - STATS.get(f"provider_{provider}_errors")
+    return STATS.get(f"provider_{provider}_latency_ms") / ok if ok > 0 else 0.0
+
+
+def log_run_summary(elapsed: float, cfg: dict[str, Any]) -> None:
+    """Log throughput, API usage, estimated cost and cache savings of the run."""
+    pages = STATS.get("pages")
+    if pages and elapsed > 0:
+        logger.info("Throughput: %d pages in %.1fs (%.1f pages/min)",
+                    pages, elapsed, pages * 60 / elapsed)
+    if STATS.get("files_unchanged"):
+        logger.info("Output: %d files written, %d unchanged and left alone",
+                    STATS.get("files_written"), STATS.get("files_unchanged"))
+    logger.info(
+        "API calls: %d, characters sent: %d, strings left untranslated: %d",
+        STATS.get("api_calls"), STATS.get("chars_sent"), STATS.get("untranslated"),
+    )
+    providers = route_providers(cfg)
+    if STATS.get("chars_sent") and len(providers) > 1:
+        logger.info("Estimated cost: %.2f (%d characters over %d providers)",
+                    estimated_cost(cfg), STATS.get("chars_sent"), len(providers))
+        for name in providers:
+            calls = STATS.get(f"provider_{name}_calls")
+            if calls:
+                logger.info("  %s: %d requests, %d characters, %d failed, %.0f ms average latency",
+                            name, calls, STATS.get(f"provider_{name}_chars"),
+                            STATS.get(f"provider_{name}_errors"), _average_latency_ms(name))
+        logger.info("Routing: %d requests hedged (%d losers cancelled, %d answers dropped), "
+                    "%d failovers, %d batches answered by a fallback",
+                    STATS.get("route_hedged"), STATS.get("route_hedges_cancelled"),
+                    STATS.get("route_hedges_lost"), STATS.get("route_failovers"),
+                    STATS.get("route_won_by_fallback"))
+    elif STATS.get("chars_sent"):
+        price = price_per_million_chars(cfg["api_provider"].lower(), cfg)
+        logger.info("Estimated cost: %.2f (%d characters at %.2f per million)",
+                    STATS.get("chars_sent") * price / 1e6, STATS.get("chars_sent"), price)
+    if STATS.get("pages_untranslated"):
+        logger.warning(
+            "%d page/language files kept untranslated strings (by language: %s); "
+            "they are not marked done and will be translated again on the next run.",
+            STATS.get("pages_untranslated"),
+            ", ".join(f"{lang} {STATS.get(f'lang_{lang}_untranslated')}"
+                      for lang in cfg["target_langs"] if STATS.get(f"lang_{lang}_untranslated")),
+        )
+    if STATS.get("http_requests"):
+        logger.info(
+            "HTTP: %d requests over %d connections (%.1f requests per connection)",
+            STATS.get("http_requests"), STATS.get("http_connections"),
+            STATS.get("http_requests") / max(1, STATS.get("http_connections")),
+        )
+    if STATS.get("throttled_responses") or STATS.get("throttle_ms"):
+        logger.info(
+            "Rate limiting: %d throttled responses, %.1fs spent waiting for the provider",
+            STATS.get("throttled_responses"), STATS.get("throttle_ms") / 1000,
+        )
+    lookups = STATS.get("tm_hits") + STATS.get("tm_misses")
+    if lookups:
+        logger.info(
+            "Translation memory: %d hits / %d misses (%.1f%%), %d billed characters saved",
+            STATS.get("tm_hits"), STATS.get("tm_misses"),
+            100.0 * STATS.get("tm_hits") / lookups, STATS.get("tm_chars_saved"),
+        )
+    if STATS.get("protected_chars_saved"):
+        logger.info(
+            "Protected terms: %d characters not sent, %d strings needed no translation",
+            STATS.get("protected_chars_saved"), STATS.get("protected_strings_skipped"),
+        )
+    incremental_pages = STATS.get("incremental_pages_unchanged") + STATS.get("incremental_pages_changed")
+    if incremental_pages:
+        logger.info(
+            "Incremental: %d of %d pages unchanged, %d strings reused, %d strings sent",
+            STATS.get("incremental_pages_unchanged"), incremental_pages,
+            STATS.get("incremental_strings_reused"), STATS.get("incremental_strings_sent"),
+        )
+    if STATS.get("dict_keys_missing") or STATS.get("dict_keys_stale"):
+        logger.info(
+            "Dictionaries: %d missing and %d stale keys, %d translated, %d files written, "
+            "%d files skipped",
+            STATS.get("dict_keys_missing"), STATS.get("dict_keys_stale"),
+            STATS.get("dict_keys_translated"), STATS.get("dict_files_written"),
+            STATS.get("dict_files_skipped"),
+        )
+    if STATS.get("dedup_strings_unique"):
+        logger.info(
+            "Site dedup: %d strings → %d unique (ratio %.2f), %d API calls and %d characters avoided",
+            STATS.get("dedup_strings_total"), STATS.get("dedup_strings_unique"),
+            STATS.get("dedup_strings_total") / STATS.get("dedup_strings_unique"),
+            STATS.get("dedup_calls_avoided"), STATS.get("dedup_chars_avoided"),
         )
-    except OSError as exc:
-        logger.warning("Could not write resume log: %s", exc)
 
 # ---------------------------------------------------------------------------
-# Main translation loop
+# Progress and run report
 # ---------------------------------------------------------------------------
 
-def translate_page(
-    html: str,
-    page_url: str,
-    target_lang: str,
-    cfg: dict[str, Any],
-) -> str:
-    """
-    Parse *html*, extract text nodes, translate them, optionally inject
-    hreflang tags, and return the modified HTML as a string.
-    """
-    soup = BeautifulSoup(html, "lxml")
-    nodes = extract_text_nodes(soup)
-
-    if not nodes:
-        logger.debug("No translatable nodes found in %s", page_url)
-        return str(soup)
-
-    # Split into batches to respect API limits
-    batch_size = int(cfg["batch_size"])
-    source_lang = cfg["source_lang"]
-    translated_strings: list[str] = []
-
-    for i in range(0, len(nodes), batch_size):
-        batch_nodes = nodes[i : i + batch_size]
-        originals = [n.original for n in batch_nodes]
-        translated_strings.extend(
-            translate_batch(originals, target_lang, source_lang, cfg)
-        )
-
-    apply_translations(nodes, translated_strings)
-
-    # Inject hreflang if requested
-    hreflang_opts = cfg.get("hreflang_options", {})
-    if hreflang_opts.get("inject_hreflang_tags", False):
-        inject_hreflang_tags(
-            soup=soup,
-            page_url=page_url,
-            source_lang=source_lang,
-            target_langs=cfg["target_langs"],
-            x_default=hreflang_opts.get("x_default_lang", source_lang),
-            output_dir=cfg["output_dir"],
-            domain_mapping=cfg.get("domain_mapping", {}),
+def peak_rss_mb() -> float | None:
+    """Peak resident set size of this process so far (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class ProgressReporter:
+    """Logs a progress line every *interval* seconds while a run is going."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._started = time.monotonic()
+
+    def start(self) -> None:
+        self._started = time.monotonic()
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._loop, name="progress", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.log()
+
+    def log(self) -> None:
+        elapsed = time.monotonic() - self._started
+        pages = STATS.get("pages")
+        logger.info(
+            "Progress: %d pages discovered, %d translated (%.1f/min), %d files written, "
+            "%d API calls, %d characters sent, %.1fs throttled, peak RSS %s MB, %.0fs elapsed",
+            STATS.get("pages_discovered"), pages, pages * 60 / elapsed if elapsed else 0.0,
+            STATS.get("files_written"), STATS.get("api_calls"), STATS.get("chars_sent"),
+            STATS.get("throttle_ms") / 1000, peak_rss_mb(), elapsed,
         )
 
-    # Update <html lang="…"> attribute
-    html_tag = soup.find("html")
-    if html_tag and isinstance(html_tag, Tag):
-        html_tag["lang"] = target_lang
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
 
-    return str(soup)
 
+def build_run_report(elapsed: float, cfg: dict[str, Any], started_at: str = "") -> dict[str, Any]:
+    """Machine-readable summary of the run built from ``STATS``."""
+    provider = cfg["api_provider"].lower()
+    languages: dict[str, dict[str, int]] = {}
+    for lang in cfg["target_langs"]:
+        languages[lang] = {
+            "api_calls": STATS.get(f"lang_{lang}_api_calls"),
+            "strings_sent": STATS.get(f"lang_{lang}_strings"),
+            "chars_sent": STATS.get(f"lang_{lang}_chars"),
+            "untranslated": STATS.get(f"lang_{lang}_untranslated"),
+        }
+    quotas = cfg.get("routing", {}).get("quota_chars", {})
+    providers = route_providers(cfg)
+    routed: dict[str, dict[str, Any]] = {}
+    for name in providers if len(providers) > 1 else []:
+        routed[name] = {
+            "requests": STATS.get(f"provider_{name}_calls"),
+            "chars_sent": STATS.get(f"provider_{name}_chars"),
+            "chars_billed": STATS.get(f"provider_{name}_chars_billed"),
+            "errors": STATS.get(f"provider_{name}_errors"),
+            "average_latency_ms": round(_average_latency_ms(name), 1),
+            "quota_chars_left": (int(quotas[name]) - STATS.get(f"provider_{name}_chars_billed")
+                                 if name in quotas else None),
+        }
+    return {
+        "started_at": started_at,
+        "elapsed_s": round(elapsed, 3),
+        "provider": provider,
+        "target_langs": list(cfg["target_langs"]),
+        "pages": {
+            "discovered": STATS.get("pages_discovered"),
+            "translated": STATS.get("pages"),
+            "files_written": STATS.get("files_written"),
+            "files_unchanged": STATS.get("files_unchanged"),
+            "with_untranslated_strings": STATS.get("pages_untranslated"),
+            "per_minute": round(STATS.get("pages") * 60 / elapsed, 2) if elapsed else 0.0,
+            "bytes_fetched": STATS.get("bytes_fetched"),
+        },
+        # Nested stages overlap: translate (per page and language) contains
+        # api_call and render; api_call is counted per provider request.
+        "stages": STATS.stages(),
+        "api": {
+            "calls": STATS.get("api_calls"),
+            "chars_sent": STATS.get("chars_sent"),
+            "retries": STATS.get("retries"),
+            "throttled_responses": STATS.get("throttled_responses"),
+            "provider_errors": STATS.get("provider_errors"),
+            "throttle_s": round(STATS.get("throttle_ms") / 1000, 3),
+            "untranslated": STATS.get("untranslated"),
+            "estimated_cost": round(estimated_cost(cfg), 4),
+        },
+        "languages": languages,
+        "sitemaps": {
+            "urls": STATS.get("sitemap_urls"),
+            "files": STATS.get("sitemap_files"),
+        },
+        "routing": {
+            "providers": routed,
+            "hedged": STATS.get("route_hedged"),
+            "hedges_cancelled": STATS.get("route_hedges_cancelled"),
+            "hedges_lost": STATS.get("route_hedges_lost"),
+            "failovers": STATS.get("route_failovers"),
+            "won_by_fallback": STATS.get("route_won_by_fallback"),
+        },
+        "memory": {
+            # Process-wide, so parse worker processes are not included.
+            "peak_rss_mb": peak_rss_mb(),
+        },
+        "http": {
+            "requests": STATS.get("http_requests"),
+            "connections": STATS.get("http_connections"),
+        },
+        "savings": {
+            "tm_hits": STATS.get("tm_hits"),
+            "tm_misses": STATS.get("tm_misses"),
+            "tm_chars_saved": STATS.get("tm_chars_saved"),
+            "dedup_chars_avoided": STATS.get("dedup_chars_avoided"),
+            "dedup_calls_avoided": STATS.get("dedup_calls_avoided"),
+            "incremental_pages_unchanged": STATS.get("incremental_pages_unchanged"),
+            "incremental_strings_reused": STATS.get("incremental_strings_reused"),
+            "protected_chars_saved": STATS.get("protected_chars_saved"),
+            "protected_strings_skipped": STATS.get("protected_strings_skipped"),
+        },
+        "counters": dict(sorted(STATS.counters.items())),
+    }
 
-def run(cfg: dict[str, Any]) -> None:
-    """Main entry point – orchestrates discovery, translation, and file writing."""
-    setup_logging(cfg.get("log_level", "INFO"))
-
-    output_dir = cfg["output_dir"]
-    target_langs: list[str] = cfg["target_langs"]
-    resume = bool(cfg.get("resume", True))
-
-    if not target_langs:
-        logger.error("No target_langs configured. Nothing to do.")
-        sys.exit(1)
-
-    # --- Discover pages ---
-    local_dir = cfg.get("local_html_dir", "").strip()
-    if local_dir:
-        local_pairs = collect_local_html_files(local_dir)
-        pages: list[tuple[str | None, str]] = [
-            (path, f"http://localhost{rel}") for path, rel in local_pairs
-        ]
-    else:
-        sitemap_url = cfg.get("sitemap_url", "").strip()
-        if not sitemap_url:
-            logger.error("Neither local_html_dir nor sitemap_url is configured.")
-            sys.exit(1)
-        urls = fetch_urls_from_sitemap(sitemap_url)
-        pages = [(None, url) for url in urls]
-
-    if not pages:
-        logger.warning("No pages discovered. Exiting.")
-        return
-
-    done = load_resume_log() if resume else set()
-    newly_done: set[str] = set()
-
-    for local_path, page_url in pages:
-        for lang in target_langs:
-            resume_key = f"{page_url}:{lang}"
-            if resume and resume_key in done:
-                logger.debug("Skipping (already done): %s → %s", page_url, lang)
-                continue
-
-            logger.info("Translating %s → %s", page_url, lang)
-
-            # Determine output path early so we can skip if resume is active
-            out_file = output_path_for(page_url, lang, output_dir)
-
-            # Load HTML
-            if local_path:
-                html = load_html(local_path)
-            else:
-                html = fetch_html(page_url)
-
-            if not html:
-                logger.warning("Skipping %s (could not load HTML).", page_url)
-                continue
-
-            # Translate
-            try:
-                translated_html = translate_page(html, page_url, lang, cfg)
-            except Exception as exc:  # pylint: disable=broad-except
-                logger.error("Error translating %s → %s: %s", page_url, lang, exc)
-                continue
-
-            # Write output
-            out_file.parent.mkdir(parents=True, exist_ok=True)
-            try:
-                out_file.write_text(translated_html, encoding="utf-8")
-                logger.info("Written: %s", out_file)
-            except OSError as exc:
-                logger.error("Failed to write %s: %s", out_file, exc)
-                continue
-
-            newly_done.add(resume_key)
-
-    # Persist resume state
-    if resume:
-        done.update(newly_done)
-        save_resume_log(done)
 
-    logger.info("Translation complete. %d page/language combinations processed.", len(newly_done))
+def write_run_report(path: str, report: dict[str, Any]) -> None:
+    """Write *report* as JSON, replacing any previous report atomically."""
+    try:
+        write_atomic(path, json.dumps(report, indent=2))
+        logger.info("Run report written to %s", path)
+    except OSError as exc:
+        logger.warning("Could not write run report %s: %s", path, exc)
 
 # ---------------------------------------------------------------------------
 # CLI entry point
@@ -680,8 +594,15 @@ def main() -> None:
         default="config/translate_config.json",
         help="Path to the JSON configuration file (default: config/translate_config.json)",
     )
+    parser.add_argument(
+        "--dictionaries",
+        action="store_true",
+        help="Sync the JSON locale dictionaries (config key \"dictionaries\") instead of pages",
+    )
     args = parser.parse_args()
     cfg = load_config(args.config)
+    if args.dictionaries:
+        cfg["dictionary_mode"] = True
     run(cfg)
 
 
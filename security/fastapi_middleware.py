@@ -12,11 +12,18 @@ Usage
     app = FastAPI()
     app.add_middleware(RedisBlacklistMiddleware)
 
+    # Feed anomaly detection with the hash or IP each request queries:
+    app.add_middleware(RedisBlacklistMiddleware,
+                       query_item=lambda request: request.query_params.get("hash"))
+
 The middleware:
-  1. Extracts the client IP and the ``X-API-Key`` header (if present).
+  1. Extracts the client IP, the ``X-API-Key`` header (if present) and,
+     with a ``query_item`` callable, the item the request queries.
   2. Calls ``inspect_request()`` from the detection engine.
   3. Returns **403 Forbidden** with a JSON body on any block, or
      passes the request through unchanged.
+  4. On a **401** response, schedules ``check_auth_fail()`` as a background
+     task that runs after the response has been sent.
 
 Environment variables
 ---------------------
@@ -25,13 +32,15 @@ See ``self_defending_api.py`` for the full list of tuneable parameters.
 
 from __future__ import annotations
 
-from typing import Callable, Awaitable
+from typing import Callable, Awaitable, Optional
 
+from starlette.background import BackgroundTask, BackgroundTasks
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp
 
-from .self_defending_api import inspect_request
+from .self_defending_api import check_auth_fail, inspect_request
 
 BLOCK_RESPONSE_BODY = {
     "error": "Rate Limit Exceeded - Security Block",
@@ -40,7 +49,19 @@ BLOCK_RESPONSE_BODY = {
 
 
 class RedisBlacklistMiddleware(BaseHTTPMiddleware):
-    """Starlette/FastAPI middleware that enforces the Redis blacklist."""
+    """
+    Starlette/FastAPI middleware that enforces the Redis blacklist.
+    *query_item* maps a request to the hash or IP it queries (None for
+    none); without it the anomaly check never runs.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        query_item: Optional[Callable[[Request], Optional[str]]] = None,
+    ) -> None:
+        super().__init__(app)
+        self.query_item = query_item
 
     async def dispatch(
         self,
@@ -49,9 +70,10 @@ class RedisBlacklistMiddleware(BaseHTTPMiddleware):
     ) -> Response:
         ip = _extract_ip(request)
         api_key = request.headers.get("X-API-Key") or request.headers.get("x-api-key")
+        item = self.query_item(request) if self.query_item else None
 
         # A blocked reason means the request should be denied immediately.
-        block_reason = inspect_request(ip=ip, api_key=api_key)
+        block_reason = inspect_request(ip=ip, api_key=api_key, query_item=item)
         if block_reason:
             return JSONResponse(
                 status_code=403,
@@ -60,9 +82,10 @@ class RedisBlacklistMiddleware(BaseHTTPMiddleware):
 
         response = await call_next(request)
 
-        # Post-response: detect auth failures based on 401 status.
+        # Auth failures only touch the auth-fail counters, and only once the
+        # response is on the wire – the blacklist/burst checks already ran above.
         if response.status_code == 401:
-            inspect_request(ip=ip, api_key=api_key, auth_failed=True)
+            _defer(response, check_auth_fail, ip, api_key)
 
         return response
 
@@ -72,6 +95,15 @@ class RedisBlacklistMiddleware(BaseHTTPMiddleware):
 # ---------------------------------------------------------------------------
 
 
+def _defer(response: Response, func: Callable[..., object], *args: object) -> None:
+    """Run *func* after *response* has been sent, keeping any existing background task."""
+    task = BackgroundTask(func, *args)
+    if response.background is None:
+        response.background = task
+    else:
+        response.background = BackgroundTasks([response.background, task])
+
+
 def _extract_ip(request: Request) -> str:
     """
     Return the real client IP, respecting common reverse-proxy headers.
@@ -0,0 +1,459 @@
+"""
+Load-Test Harness – In-Process ASGI Traffic Replay
+==================================================
+Drives a small Starlette app wrapped in ``RedisBlacklistMiddleware`` entirely
+in process (no sockets, no uvicorn) with scripted, attack-shaped traffic and
+reports what the middleware costs and how well it blocks.
+
+Profiles
+--------
+  legit        – many well-behaved clients, occasional mistyped key (401)
+  burst        – one IP hammering the API on top of legit traffic
+  botnet       – rotating IPs sharing one stolen key to enumerate hashes,
+                 each IP staying well below every per-IP limit
+  credstuff    – a handful of IPs cycling through bad API keys (401 storm)
+  scraper      – one valid key enumerating thousands of unique hashes
+
+The app reports the queried hash to the middleware, so the anomaly check
+runs per IP and per key; legit clients never share a key with an attacker
+and query a catalog smaller than the anomaly limit with their own typos,
+so legit false positives do not grow with ``--requests``.
+
+Requests are replayed one at a time by a single client: throughput and
+latency are the middleware's cost per request, not server capacity under
+concurrent load.
+
+For every profile and backend the harness reports throughput, latency
+percentiles, the HTTP status counts, block precision/recall against the
+scripted ground truth and Redis commands / round trips per request.
+
+Usage
+-----
+    python -m security.loadtest                                 # fakeredis, all profiles
+    python -m security.loadtest --backend redis --redis-url redis://localhost:6379/15
+    python -m security.loadtest --backend sharded                # 3-shard in-memory ring
+    python -m security.loadtest --profile burst --requests 5000 --json
+
+The ``redis`` and ``cluster`` backends run ``FLUSHDB`` on the selected database before each
+profile – point it at a scratch database, never at production.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter
+from typing import Any, Callable, Iterable, NamedTuple, Optional
+
+import redis
+
+from . import self_defending_api as sda
+from .redis_shards import ShardedRedis
+
+# ---------------------------------------------------------------------------
+# Scripted traffic
+# ---------------------------------------------------------------------------
+
+VALID_KEYS = tuple(f"key_live_{i:03d}" for i in range(50))
+# Keys used by the scraper and the botnet; legit clients draw from the rest.
+SCRAPER_KEY, BOTNET_KEY = VALID_KEYS[:2]
+LEGIT_KEYS = VALID_KEYS[2:]
+CHECK_PATH = "/api/v1/check/"
+
+
+class ScriptedRequest(NamedTuple):
+    """One request of a traffic profile plus its ground-truth label."""
+
+    ip: str
+    api_key: Optional[str]
+    item: str
+    malicious: bool
+
+
+def _legit(rng: random.Random, n: int) -> list[ScriptedRequest]:
+    """
+    Background traffic: 1–20 requests per client, ~2 % mistyped keys.
+    Clients look hashes up in a shared catalog of half the anomaly limit and
+    each mistypes its key its own way, so no legit key crosses the anomaly
+    or auth-fail limit however long the run.
+    """
+    catalog_size = max(1, sda.ANOMALY_LIMIT // 2)
+    catalog = [f"sha256:{rng.getrandbits(64):016x}" for _ in range(catalog_size)]
+    out: list[ScriptedRequest] = []
+    client = 0
+    while len(out) < n:
+        client += 1
+        ip = f"10.{(client >> 16) & 255}.{(client >> 8) & 255}.{client & 255}"
+        key = rng.choice(LEGIT_KEYS)
+        for _ in range(rng.randint(1, 20)):
+            bad = rng.random() < 0.02
+            out.append(ScriptedRequest(
+                ip=ip,
+                api_key=f"{key}_typo{client}" if bad else key,
+                item=rng.choice(catalog),
+                malicious=False,
+            ))
+    rng.shuffle(out)
+    return out[:n]
+
+
+def _interleave(rng: random.Random, legit: list[ScriptedRequest],
+                attack: list[ScriptedRequest]) -> list[ScriptedRequest]:
+    """Merge *attack* into *legit* at random positions, keeping each stream's order."""
+    legit_pos = sorted(rng.random() for _ in legit)
+    attack_pos = sorted(rng.random() for _ in attack)
+    merged = list(zip(legit_pos, legit)) + list(zip(attack_pos, attack))
+    merged.sort(key=lambda t: t[0])
+    return [req for _, req in merged]
+
+
+def profile_legit(rng: random.Random, n: int) -> list[ScriptedRequest]:
+    return _legit(rng, n)
+
+
+def profile_burst(rng: random.Random, n: int) -> list[ScriptedRequest]:
+    attack = [
+        ScriptedRequest("203.0.113.66", rng.choice(LEGIT_KEYS), "sha256:00", True)
+        for _ in range(n // 2)
+    ]
+    return _interleave(rng, _legit(rng, n - len(attack)), attack)
+
+
+def profile_botnet(rng: random.Random, n: int) -> list[ScriptedRequest]:
+    attack = [
+        ScriptedRequest(
+            ip=f"198.51.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            api_key=BOTNET_KEY,
+            item=f"sha256:{rng.getrandbits(64):016x}",
+            malicious=True,
+        )
+        for _ in range(n // 2)
+    ]
+    return _interleave(rng, _legit(rng, n - len(attack)), attack)
+
+
+def profile_credstuff(rng: random.Random, n: int) -> list[ScriptedRequest]:
+    stuffers = [f"192.0.2.{i}" for i in range(1, 9)]
+    attack = [
+        ScriptedRequest(
+            ip=rng.choice(stuffers),
+            api_key=f"key_guess_{rng.getrandbits(40):010x}",
+            item="sha256:00",
+            malicious=True,
+        )
+        for _ in range(n // 2)
+    ]
+    return _interleave(rng, _legit(rng, n - len(attack)), attack)
+
+
+def profile_scraper(rng: random.Random, n: int) -> list[ScriptedRequest]:
+    attack = [
+        ScriptedRequest("203.0.113.77", SCRAPER_KEY, f"sha256:{i:064x}", True)
+        for i in range(n // 2)
+    ]
+    return _interleave(rng, _legit(rng, n - len(attack)), attack)
+
+
+PROFILES: dict[str, Callable[[random.Random, int], list[ScriptedRequest]]] = {
+    "legit": profile_legit,
+    "burst": profile_burst,
+    "botnet": profile_botnet,
+    "credstuff": profile_credstuff,
+    "scraper": profile_scraper,
+}
+
+# ---------------------------------------------------------------------------
+# Redis command accounting
+# ---------------------------------------------------------------------------
+
+
+class CommandCounter:
+    """Counts Redis commands and network round trips issued through a client."""
+
+    def __init__(self) -> None:
+        self.commands = 0
+        self.round_trips = 0
+
+    def reset(self) -> None:
+        self.commands = 0
+        self.round_trips = 0
+
+
+def instrument(client: Any, counter: CommandCounter) -> Any:
+    """
+    Wrap *client* in place so every command and pipeline flush is counted.
+    A pipeline counts all queued commands but a single round trip; a
+    ``ShardedRedis`` ring is instrumented per shard, so a pipeline spanning
+    two shards counts two round trips.
+    """
+    if isinstance(client, ShardedRedis):
+        for shard in client.shards:
+            instrument(shard, counter)
+        return client
+
+    execute_command = client.execute_command
+    make_pipeline = client.pipeline
+
+    def _execute_command(*args: Any, **kwargs: Any) -> Any:
+        counter.commands += 1
+        counter.round_trips += 1
+        return execute_command(*args, **kwargs)
+
+    def _pipeline(*args: Any, **kwargs: Any) -> Any:
+        pipe = make_pipeline(*args, **kwargs)
+        pipe_execute = pipe.execute
+
+        def _execute(*e_args: Any, **e_kwargs: Any) -> Any:
+            counter.commands += len(pipe.command_stack)
+            counter.round_trips += 1
+            return pipe_execute(*e_args, **e_kwargs)
+
+        pipe.execute = _execute
+        return pipe
+
+    client.execute_command = _execute_command
+    client.pipeline = _pipeline
+    return client
+
+
+BACKENDS = ("fakeredis", "sharded", "redis", "cluster")
+# Backends whose keys must be hash-tagged per identifier.
+SHARDED_BACKENDS = ("sharded", "cluster")
+
+
+def make_backend(name: str, redis_url: str, shards: int = 3) -> Any:
+    """
+    Return a fresh client for one of ``BACKENDS``:
+    ``fakeredis`` (in memory), ``sharded`` (consistent-hash ring over
+    *shards* in-memory servers), ``redis`` (a local ``redis-server`` at
+    *redis_url*) or ``cluster`` (a Redis Cluster reachable at *redis_url*).
+    """
+    if name in ("fakeredis", "sharded"):
+        try:
+            import fakeredis
+        except ImportError as exc:
+            raise SystemExit("fakeredis is not installed: pip install fakeredis") from exc
+        if name == "fakeredis":
+            return fakeredis.FakeRedis(decode_responses=True)
+        return ShardedRedis([
+            fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+            for _ in range(shards)
+        ])
+    if name == "redis":
+        client = redis.from_url(redis_url, decode_responses=True)
+        client.ping()
+        return client
+    if name == "cluster":
+        from redis.cluster import RedisCluster
+
+        client = RedisCluster.from_url(redis_url, decode_responses=True)
+        client.ping()
+        return client
+    raise ValueError(f"Unknown backend '{name}'")
+
+# ---------------------------------------------------------------------------
+# In-process ASGI driver
+# ---------------------------------------------------------------------------
+
+
+def _queried_item(request: Any) -> Optional[str]:
+    path = request.url.path
+    return path[len(CHECK_PATH):] if path.startswith(CHECK_PATH) else None
+
+
+def build_app() -> Any:
+    """
+    A minimal API protected by the middleware: 401 on unknown keys, else
+    200. The checked hash is passed on for anomaly detection.
+    """
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    from .fastapi_middleware import RedisBlacklistMiddleware
+
+    valid = set(VALID_KEYS)
+
+    async def check(request: Request) -> JSONResponse:
+        if request.headers.get("x-api-key") not in valid:
+            return JSONResponse({"error": "invalid api key"}, status_code=401)
+        return JSONResponse({"item": request.path_params["item"], "verdict": "clean"})
+
+    app = Starlette(routes=[Route(CHECK_PATH + "{item}", check)])
+    app.add_middleware(RedisBlacklistMiddleware, query_item=_queried_item)
+    return app
+
+
+async def asgi_request(app: Any, req: ScriptedRequest) -> tuple[int, float]:
+    """
+    Send one GET through *app* via the raw ASGI interface.
+    Returns the status and the time at which the last body chunk was sent,
+    so work deferred to background tasks is not counted as response latency.
+    """
+    headers = [(b"host", b"loadtest"), (b"x-forwarded-for", req.ip.encode())]
+    if req.api_key is not None:
+        headers.append((b"x-api-key", req.api_key.encode()))
+    path = CHECK_PATH + req.item
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": headers,
+        "client": (req.ip, 50000),
+        "server": ("loadtest", 80),
+    }
+    done = asyncio.Event()
+    status = 0
+    sent_at = 0.0
+    request_sent = False
+
+    async def receive() -> dict[str, Any]:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict[str, Any]) -> None:
+        nonlocal status, sent_at
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            sent_at = time.perf_counter()
+            done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return status, sent_at or time.perf_counter()
+
+# ---------------------------------------------------------------------------
+# Runner & report
+# ---------------------------------------------------------------------------
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+async def _replay(app: Any, traffic: Iterable[ScriptedRequest],
+                  latencies: list[float], outcomes: list[tuple[bool, int]]) -> None:
+    # Sequential on purpose: one client, so each latency is one request's own cost.
+    for req in traffic:
+        t0 = time.perf_counter()
+        status, sent_at = await asgi_request(app, req)
+        latencies.append(sent_at - t0)
+        outcomes.append((req.malicious, status))
+
+
+def run_profile(profile: str, backend: str, requests: int = 2000, seed: int = 1,
+                redis_url: str = "redis://localhost:6379/15") -> dict[str, Any]:
+    """Replay one traffic profile against one backend and return its metrics."""
+    traffic = PROFILES[profile](random.Random(seed), requests)
+    counter = CommandCounter()
+    client = make_backend(backend, redis_url)
+    client.flushdb()
+    instrument(client, counter)
+
+    previous_client, previous_tags = sda._redis_client, sda.REDIS_HASH_TAGS
+    sda._redis_client = client
+    sda.REDIS_HASH_TAGS = backend in SHARDED_BACKENDS
+    latencies: list[float] = []
+    outcomes: list[tuple[bool, int]] = []
+    try:
+        app = build_app()
+        t0 = time.perf_counter()
+        asyncio.run(_replay(app, traffic, latencies, outcomes))
+        wall = time.perf_counter() - t0
+    finally:
+        sda._redis_client, sda.REDIS_HASH_TAGS = previous_client, previous_tags
+
+    tp = sum(1 for mal, st in outcomes if mal and st == 403)
+    fp = sum(1 for mal, st in outcomes if not mal and st == 403)
+    fn = sum(1 for mal, st in outcomes if mal and st != 403)
+    latencies.sort()
+    n = len(outcomes)
+    statuses = Counter(st for _, st in outcomes)
+    return {
+        "profile": profile,
+        "backend": backend,
+        "requests": n,
+        "malicious": tp + fn,
+        "blocked": tp + fp,
+        "statuses": {str(st): statuses[st] for st in sorted(statuses)},
+        "throughput_rps": round(n / wall, 1) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50) * 1000, 3),
+            "p90": round(_percentile(latencies, 90) * 1000, 3),
+            "p99": round(_percentile(latencies, 99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+        "precision": round(tp / (tp + fp), 4) if tp + fp else None,
+        "recall": round(tp / (tp + fn), 4) if tp + fn else None,
+        "redis_commands_per_request": round(counter.commands / n, 2) if n else 0.0,
+        "redis_round_trips_per_request": round(counter.round_trips / n, 2) if n else 0.0,
+    }
+
+
+def _format_row(result: dict[str, Any]) -> str:
+    def _ratio(value: Optional[float]) -> str:
+        return "   n/a" if value is None else f"{value:6.3f}"
+
+    lat = result["latency_ms"]
+    return (
+        f"{result['backend']:<10} {result['profile']:<10} {result['requests']:>7} "
+        f"{result['throughput_rps']:>9.1f} {lat['p50']:>8.3f} {lat['p99']:>8.3f} "
+        f"{_ratio(result['precision'])} {_ratio(result['recall'])} "
+        f"{result['redis_commands_per_request']:>6.2f} {result['redis_round_trips_per_request']:>6.2f}"
+    )
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Replay scripted attack traffic through RedisBlacklistMiddleware in process.",
+    )
+    parser.add_argument("--profile", action="append", choices=sorted(PROFILES),
+                        help="Profile to run (repeatable, default: all)")
+    parser.add_argument("--backend", action="append", choices=BACKENDS,
+                        help="Redis backend (repeatable, default: fakeredis)")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15",
+                        help="Scratch database for the redis/cluster backends (it is flushed!)")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per profile")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Emit a JSON report instead of a table")
+    args = parser.parse_args(argv)
+
+    # Every block logs a WARNING – keep the report readable.
+    sda.logger.setLevel(logging.ERROR)
+
+    results = [
+        run_profile(profile, backend, args.requests, args.seed, args.redis_url)
+        for backend in (args.backend or ["fakeredis"])
+        for profile in (args.profile or list(PROFILES))
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'backend':<10} {'profile':<10} {'reqs':>7} {'req/s':>9} {'p50 ms':>8} "
+          f"{'p99 ms':>8} {'prec':>6} {'recall':>6} {'cmd/r':>6} {'rtt/r':>6}")
+    for result in results:
+        print(_format_row(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Client-Side Redis Sharding – Consistent-Hash Ring
+=================================================
+A drop-in stand-in for ``redis.Redis`` that spreads keys over several
+independent Redis servers, for deployments that want to scale the
+rate-limit store horizontally without running Redis Cluster.
+
+Keys are routed with the same hash-tag rule as Redis Cluster: when a key
+contains ``{…}``, only the tag is hashed.  ``self_defending_api`` tags every
+key with its identifier, so all counters and blacklist entries of one IP or
+API key live on the same shard.
+
+Pipelines are batched per shard: queued commands are grouped by shard,
+each group is flushed as one pipeline and the groups are sent concurrently,
+so a pipeline spanning several shards still costs one round trip of wall
+time.  Results are returned in the original order.
+
+Only single-key commands (and multi-key commands whose keys share a shard)
+are supported – exactly what the detection engine issues.
+"""
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable
+
+import redis
+from redis.commands import CoreCommands
+
+# Virtual nodes per shard on the ring – smooths out key distribution.
+RING_REPLICAS: int = 160
+
+# Commands whose every argument after the name is a key.
+_MULTI_KEY_COMMANDS = {"EXISTS", "DEL", "UNLINK", "TOUCH", "MGET"}
+
+
+def hash_tag(key: str) -> str:
+    """Return the part of *key* that is hashed, following Redis Cluster rules."""
+    start = key.find("{")
+    if start != -1:
+        end = key.find("}", start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def _ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class ShardedRedis(CoreCommands):
+    """Routes each command to one of *shards* via a consistent-hash ring."""
+
+    def __init__(self, shards: list[redis.Redis], names: Iterable[str] | None = None) -> None:
+        if not shards:
+            raise ValueError("ShardedRedis needs at least one shard")
+        self.shards = list(shards)
+        names = list(names) if names is not None else [f"shard-{i}" for i in range(len(shards))]
+        ring: list[tuple[int, int]] = []
+        for index, name in enumerate(names):
+            for replica in range(RING_REPLICAS):
+                ring.append((_ring_hash(f"{name}#{replica}"), index))
+        ring.sort()
+        self._ring_points = [point for point, _ in ring]
+        self._ring_shards = [index for _, index in ring]
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.shards), thread_name_prefix="redis-shard",
+        )
+
+    @classmethod
+    def from_urls(cls, urls: list[str], **kwargs: Any) -> "ShardedRedis":
+        """Build a ring from Redis URLs; the URL is the shard's ring identity."""
+        return cls([redis.from_url(url, **kwargs) for url in urls], names=urls)
+
+    def shard_index(self, key: str) -> int:
+        """Return the index of the shard that owns *key*."""
+        pos = bisect.bisect(self._ring_points, _ring_hash(hash_tag(key)))
+        return self._ring_shards[pos % len(self._ring_shards)]
+
+    def _route(self, args: tuple[Any, ...]) -> int:
+        if len(args) < 2:
+            raise redis.RedisError(f"Cannot route keyless command {args[0]!r} to a shard")
+        index = self.shard_index(str(args[1]))
+        if str(args[0]).upper() in _MULTI_KEY_COMMANDS:
+            for key in args[2:]:
+                if self.shard_index(str(key)) != index:
+                    raise redis.RedisError(f"{args[0]} keys span several shards")
+        return index
+
+    def execute_command(self, *args: Any, **options: Any) -> Any:
+        return self.shards[self._route(args)].execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Any = None) -> "ShardedPipeline":
+        return ShardedPipeline(self, transaction)
+
+    # Keyless administrative commands fan out to every shard.
+
+    def ping(self, **kwargs: Any) -> bool:
+        return all(shard.ping(**kwargs) for shard in self.shards)
+
+    def flushdb(self, asynchronous: bool = False, **kwargs: Any) -> bool:
+        return all(shard.flushdb(asynchronous, **kwargs) for shard in self.shards)
+
+
+class ShardedPipeline(CoreCommands):
+    """Buffers commands and flushes them as one pipeline per shard."""
+
+    def __init__(self, client: ShardedRedis, transaction: bool = True) -> None:
+        self.client = client
+        self.transaction = transaction
+        self.command_stack: list[tuple[int, tuple[Any, ...], dict[str, Any]]] = []
+
+    def execute_command(self, *args: Any, **options: Any) -> "ShardedPipeline":
+        self.command_stack.append((self.client._route(args), args, options))
+        return self
+
+    def execute(self, raise_on_error: bool = True) -> list[Any]:
+        stack, self.command_stack = self.command_stack, []
+        by_shard: dict[int, list[int]] = {}
+        for pos, (index, _, _) in enumerate(stack):
+            by_shard.setdefault(index, []).append(pos)
+
+        def _flush(index: int) -> list[Any]:
+            pipe = self.client.shards[index].pipeline(transaction=self.transaction)
+            for pos in by_shard[index]:
+                _, args, options = stack[pos]
+                pipe.execute_command(*args, **options)
+            return pipe.execute(raise_on_error=raise_on_error)
+
+        if len(by_shard) == 1:
+            flushed = {index: _flush(index) for index in by_shard}
+        else:
+            futures = {index: self.client._executor.submit(_flush, index) for index in by_shard}
+            flushed = {index: future.result() for index, future in futures.items()}
+
+        results: list[Any] = [None] * len(stack)
+        for index, positions in by_shard.items():
+            for pos, value in zip(positions, flushed[index]):
+                results[pos] = value
+        return results
+
+    def reset(self) -> None:
+        self.command_stack = []
+
+    def __enter__(self) -> "ShardedPipeline":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.reset()
+
+    def __len__(self) -> int:
+        return len(self.command_stack)
@@ -8,6 +8,12 @@ Protects ClawGuru.org API endpoints from:
 
 All blocks expire after 1 hour (SETEX cool-down).
 Whitelisted IPs / keys are never blocked.
+
+The store can be a single Redis, a Redis Cluster (``REDIS_CLUSTER=1``) or a
+client-side consistent-hash ring over several servers (``REDIS_SHARD_URLS``).
+In both sharded modes every key is hash-tagged with its identifier
+(``rate:burst:{1.2.3.4}``) so one IP's or key's state stays on one slot/shard
+and per-identifier pipelines never cross nodes.
 """
 
 from __future__ import annotations
@@ -16,7 +22,7 @@ import time
 import os
 import logging
 import requests as http_requests
-from typing import Optional
+from typing import Any, Optional
 
 import redis
 
@@ -26,6 +32,17 @@ import redis
 
 REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
+# Sharded deployments
+REDIS_CLUSTER: bool = os.getenv("REDIS_CLUSTER", "0").lower() in ("1", "true", "yes")
+REDIS_SHARD_URLS: list[str] = [
+    url.strip() for url in os.getenv("REDIS_SHARD_URLS", "").split(",") if url.strip()
+]
+# Hash-tag keys per identifier; on by default whenever the store is sharded.
+# Note: toggling this changes the key layout – existing blocks are not migrated.
+REDIS_HASH_TAGS: bool = os.getenv(
+    "REDIS_HASH_TAGS", "1" if (REDIS_CLUSTER or REDIS_SHARD_URLS) else "0"
+).lower() in ("1", "true", "yes")
+
 # Thresholds
 BURST_LIMIT: int = int(os.getenv("BURST_LIMIT", "50"))          # req/s per IP
 AUTH_FAIL_LIMIT: int = int(os.getenv("AUTH_FAIL_LIMIT", "10"))  # fails/min
@@ -78,17 +95,38 @@ def _notify(message: str) -> None:
 # Redis client (lazy singleton)
 # ---------------------------------------------------------------------------
 
-_redis_client: Optional[redis.Redis] = None
+_redis_client: Optional[Any] = None
 
 
-def get_redis() -> redis.Redis:
-    """Return a shared Redis client, creating it on first call."""
+def get_redis() -> Any:
+    """
+    Return a shared Redis client, creating it on first call.
+    Depending on configuration this is a ``redis.Redis``, a
+    ``redis.cluster.RedisCluster`` or a ``ShardedRedis`` ring – all expose
+    the same command and pipeline interface.
+    """
     global _redis_client  # noqa: PLW0603
     if _redis_client is None:
-        _redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+        if REDIS_CLUSTER:
+            from redis.cluster import RedisCluster
+
+            _redis_client = RedisCluster.from_url(REDIS_URL, decode_responses=True)
+        elif REDIS_SHARD_URLS:
+            from .redis_shards import ShardedRedis
+
+            _redis_client = ShardedRedis.from_urls(REDIS_SHARD_URLS, decode_responses=True)
+        else:
+            _redis_client = redis.from_url(REDIS_URL, decode_responses=True)
     return _redis_client
 
 
+def _key(prefix: str, identifier: str) -> str:
+    """Build the Redis key for *identifier*, hash-tagged in sharded mode."""
+    if REDIS_HASH_TAGS:
+        return f"{prefix}{{{identifier}}}"
+    return f"{prefix}{identifier}"
+
+
 # ---------------------------------------------------------------------------
 # Whitelist helpers
 # ---------------------------------------------------------------------------
@@ -98,7 +136,7 @@ def add_to_whitelist(identifier: str, is_key: bool = False) -> None:
     """Permanently whitelist an IP address or API key."""
     r = get_redis()
     prefix = PREFIX_WHITELIST_KEY if is_key else PREFIX_WHITELIST_IP
-    r.set(f"{prefix}{identifier}", "1")
+    r.set(_key(prefix, identifier), "1")
     logger.info("Whitelisted %s '%s'", "key" if is_key else "IP", identifier)
 
 
@@ -106,14 +144,14 @@ def remove_from_whitelist(identifier: str, is_key: bool = False) -> None:
     """Remove an IP address or API key from the whitelist."""
     r = get_redis()
     prefix = PREFIX_WHITELIST_KEY if is_key else PREFIX_WHITELIST_IP
-    r.delete(f"{prefix}{identifier}")
+    r.delete(_key(prefix, identifier))
 
 
 def is_whitelisted(identifier: str, is_key: bool = False) -> bool:
     """Return True if the identifier is on the whitelist."""
     r = get_redis()
     prefix = PREFIX_WHITELIST_KEY if is_key else PREFIX_WHITELIST_IP
-    return r.exists(f"{prefix}{identifier}") > 0
+    return r.exists(_key(prefix, identifier)) > 0
 
 
 # ---------------------------------------------------------------------------
@@ -125,7 +163,7 @@ def _block(identifier: str, is_key: bool, reason: str) -> None:
     """Write a SETEX blacklist entry and send a notification."""
     r = get_redis()
     prefix = PREFIX_BLACKLIST_KEY if is_key else PREFIX_BLACKLIST_IP
-    r.setex(f"{prefix}{identifier}", BLOCK_DURATION, reason)
+    r.setex(_key(prefix, identifier), BLOCK_DURATION, reason)
     _notify(
         f"🚨 Security Block activated | {'API-Key' if is_key else 'IP'}: {identifier} "
         f"| Reason: {reason} | Duration: {BLOCK_DURATION}s"
@@ -136,14 +174,14 @@ def is_blocked(identifier: str, is_key: bool = False) -> bool:
     """Return True if the identifier is currently blacklisted."""
     r = get_redis()
     prefix = PREFIX_BLACKLIST_KEY if is_key else PREFIX_BLACKLIST_IP
-    return r.exists(f"{prefix}{identifier}") > 0
+    return r.exists(_key(prefix, identifier)) > 0
 
 
 def unblock(identifier: str, is_key: bool = False) -> None:
     """Manually remove a blacklist entry before it expires."""
     r = get_redis()
     prefix = PREFIX_BLACKLIST_KEY if is_key else PREFIX_BLACKLIST_IP
-    r.delete(f"{prefix}{identifier}")
+    r.delete(_key(prefix, identifier))
     logger.info("Manually unblocked %s '%s'", "key" if is_key else "IP", identifier)
 
 
@@ -162,7 +200,7 @@ def check_burst(ip: str) -> bool:
         return False
 
     r = get_redis()
-    key = f"{PREFIX_BURST}{ip}"
+    key = _key(PREFIX_BURST, ip)
     pipe = r.pipeline()
     pipe.incr(key)
     pipe.expire(key, BURST_WINDOW)
@@ -180,26 +218,39 @@ def check_auth_fail(ip: str, api_key: Optional[str] = None) -> bool:
     invalid API-key attempts within AUTH_FAIL_WINDOW seconds.
     Returns True if a block was applied.
     """
-    blocked = False
+    candidates = [
+        (identifier, use_key)
+        for identifier, use_key in ((ip, False), (api_key, True))
+        if identifier is not None
+    ]
+    r = get_redis()
 
-    for identifier, use_key in ((ip, False), (api_key, True)):
-        if identifier is None:
-            continue
-        if is_whitelisted(identifier, is_key=use_key):
-            continue
+    # Round trip 1: whitelist + existing-block flags for every identifier.
+    pipe = r.pipeline()
+    for identifier, use_key in candidates:
+        wl_prefix = PREFIX_WHITELIST_KEY if use_key else PREFIX_WHITELIST_IP
+        bl_prefix = PREFIX_BLACKLIST_KEY if use_key else PREFIX_BLACKLIST_IP
+        pipe.exists(_key(wl_prefix, identifier))
+        pipe.exists(_key(bl_prefix, identifier))
+    flags = pipe.execute()
 
-        r = get_redis()
-        prefix = PREFIX_BLACKLIST_KEY if use_key else PREFIX_BLACKLIST_IP
-        if r.exists(f"{prefix}{identifier}"):
-            # Already blocked – skip counter increment
+    # Round trip 2: bump the counters of identifiers that are neither
+    # whitelisted nor already blocked.
+    pipe = r.pipeline()
+    counted: list[tuple[str, bool]] = []
+    for i, (identifier, use_key) in enumerate(candidates):
+        if flags[2 * i] or flags[2 * i + 1]:
             continue
-
-        fail_key = f"{PREFIX_AUTH_FAIL}{'key:' if use_key else 'ip:'}{identifier}"
-        pipe = r.pipeline()
+        fail_key = _key(PREFIX_AUTH_FAIL + ("key:" if use_key else "ip:"), identifier)
         pipe.incr(fail_key)
         pipe.expire(fail_key, AUTH_FAIL_WINDOW)
-        count, _ = pipe.execute()
+        counted.append((identifier, use_key))
+    if not counted:
+        return False
+    results = pipe.execute()
 
+    blocked = False
+    for (identifier, use_key), count in zip(counted, results[::2]):
         if count > AUTH_FAIL_LIMIT:
             _block(
                 identifier,
@@ -222,14 +273,14 @@ def record_anomaly_item(identifier: str, item: str, is_key: bool = False) -> boo
 
     r = get_redis()
     ts_bucket = int(time.time()) // ANOMALY_WINDOW  # coarse time-bucket
-    anomaly_key = f"{PREFIX_ANOMALY}{'key:' if is_key else 'ip:'}{identifier}:{ts_bucket}"
+    kind = "key:" if is_key else "ip:"
+    anomaly_key = f"{_key(PREFIX_ANOMALY + kind, identifier)}:{ts_bucket}"
 
     pipe = r.pipeline()
     pipe.sadd(anomaly_key, item)
     pipe.expire(anomaly_key, ANOMALY_WINDOW * 2)  # keep slightly longer for overlap
-    cardinality, _ = pipe.execute()
-
-    unique_count = r.scard(anomaly_key)
+    pipe.scard(anomaly_key)
+    _, _, unique_count = pipe.execute()
 
     if unique_count > ANOMALY_LIMIT:
         _block(
@@ -271,23 +322,23 @@ def inspect_request(
     """
     r = get_redis()
 
-    # --- 1. Already on blacklist? ---
-    for identifier, use_key in ((ip, False), (api_key, True)):
-        if identifier is None:
-            continue
-        bl_prefix = PREFIX_BLACKLIST_KEY if use_key else PREFIX_BLACKLIST_IP
-        reason = r.get(f"{bl_prefix}{identifier}")
+    # --- 1. Already on blacklist? (one pipelined lookup for IP and key) ---
+    pipe = r.pipeline()
+    pipe.get(_key(PREFIX_BLACKLIST_IP, ip))
+    if api_key is not None:
+        pipe.get(_key(PREFIX_BLACKLIST_KEY, api_key))
+    for reason in pipe.execute():
         if reason:
             return reason
 
     # --- 2. Burst check ---
     if check_burst(ip):
-        return r.get(f"{PREFIX_BLACKLIST_IP}{ip}") or "Burst limit exceeded"
+        return r.get(_key(PREFIX_BLACKLIST_IP, ip)) or "Burst limit exceeded"
 
     # --- 3. Auth-fail check ---
     if auth_failed:
         if check_auth_fail(ip, api_key):
-            bl_key = f"{PREFIX_BLACKLIST_IP}{ip}"
+            bl_key = _key(PREFIX_BLACKLIST_IP, ip)
             return r.get(bl_key) or "Auth-fail limit exceeded"
 
     # --- 4. Anomaly check ---
@@ -297,6 +348,6 @@ def inspect_request(
                 continue
             if record_anomaly_item(identifier, query_item, is_key=use_key):
                 bl_prefix = PREFIX_BLACKLIST_KEY if use_key else PREFIX_BLACKLIST_IP
-                return r.get(f"{bl_prefix}{identifier}") or "Anomaly limit exceeded"
+                return r.get(_key(bl_prefix, identifier)) or "Anomaly limit exceeded"
 
     return None
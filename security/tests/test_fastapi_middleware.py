@@ -0,0 +1,79 @@
+"""
+Tests for security/fastapi_middleware.py, driven in process through the
+load-test harness' raw ASGI client.
+Run: python -m pytest security/tests/ -v
+"""
+
+from __future__ import annotations
+
+import sys
+import os
+import asyncio
+import unittest
+
+import fakeredis
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import security.loadtest as lt
+import security.self_defending_api as sda
+
+
+class TestAuthFailAccounting(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.previous = sda._redis_client
+        self.r = fakeredis.FakeRedis(decode_responses=True)
+        sda._redis_client = self.r
+        self.app = lt.build_app()
+
+    def tearDown(self) -> None:
+        sda._redis_client = self.previous
+
+    def _send(self, req: lt.ScriptedRequest) -> int:
+        status, _ = asyncio.run(lt.asgi_request(self.app, req))
+        return status
+
+    def test_401_counts_burst_once_and_auth_fail_once(self):
+        status = self._send(lt.ScriptedRequest("30.30.30.30", "wrong_key", "h", True))
+        self.assertEqual(status, 401)
+        self.assertEqual(self.r.get(f"{sda.PREFIX_BURST}30.30.30.30"), "1")
+        self.assertEqual(self.r.get(f"{sda.PREFIX_AUTH_FAIL}ip:30.30.30.30"), "1")
+        self.assertEqual(self.r.get(f"{sda.PREFIX_AUTH_FAIL}key:wrong_key"), "1")
+
+    def test_successful_request_leaves_auth_fail_counters_alone(self):
+        status = self._send(lt.ScriptedRequest("31.31.31.31", lt.VALID_KEYS[0], "h", False))
+        self.assertEqual(status, 200)
+        self.assertIsNone(self.r.get(f"{sda.PREFIX_AUTH_FAIL}ip:31.31.31.31"))
+
+    def test_credential_stuffing_ends_in_403(self):
+        statuses = [
+            self._send(lt.ScriptedRequest("32.32.32.32", f"guess_{i}", "h", True))
+            for i in range(sda.AUTH_FAIL_LIMIT + 2)
+        ]
+        self.assertEqual(statuses[: sda.AUTH_FAIL_LIMIT + 1], [401] * (sda.AUTH_FAIL_LIMIT + 1))
+        self.assertEqual(statuses[-1], 403)
+
+
+class TestAnomalyTracking(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.previous = sda._redis_client
+        self.r = fakeredis.FakeRedis(decode_responses=True)
+        sda._redis_client = self.r
+
+    def tearDown(self) -> None:
+        sda._redis_client = self.previous
+
+    def test_queried_item_reaches_the_anomaly_check(self):
+        req = lt.ScriptedRequest("33.33.33.33", lt.VALID_KEYS[5], "sha256:abc", False)
+        status, _ = asyncio.run(lt.asgi_request(lt.build_app(), req))
+        self.assertEqual(status, 200)
+        keys = self.r.keys(f"{sda.PREFIX_ANOMALY}*")
+        self.assertEqual(len(keys), 2)  # one set per IP, one per key
+        for key in keys:
+            self.assertEqual(self.r.smembers(key), {"sha256:abc"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Tests for security/loadtest.py – the in-process ASGI load-test harness.
+Run: python -m pytest security/tests/ -v
+"""
+
+from __future__ import annotations
+
+import sys
+import os
+import random
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import security.loadtest as lt
+import security.self_defending_api as sda
+
+
+class TestProfiles(unittest.TestCase):
+
+    def test_profiles_are_deterministic(self):
+        for name, profile in lt.PROFILES.items():
+            a = profile(random.Random(7), 300)
+            b = profile(random.Random(7), 300)
+            self.assertEqual(a, b, name)
+            self.assertEqual(len(a), 300, name)
+
+    def test_legit_profile_has_no_attackers(self):
+        self.assertFalse(any(r.malicious for r in lt.profile_legit(random.Random(1), 500)))
+
+    def test_attack_profiles_are_half_malicious(self):
+        for name in ("burst", "botnet", "credstuff", "scraper"):
+            traffic = lt.PROFILES[name](random.Random(1), 400)
+            self.assertEqual(sum(r.malicious for r in traffic), 200, name)
+
+
+class TestCommandCounter(unittest.TestCase):
+
+    def test_pipeline_is_one_round_trip(self):
+        counter = lt.CommandCounter()
+        r = lt.instrument(fakeredis.FakeRedis(decode_responses=True), counter)
+        r.get("a")
+        pipe = r.pipeline()
+        pipe.incr("b")
+        pipe.expire("b", 1)
+        pipe.execute()
+        self.assertEqual(counter.commands, 3)
+        self.assertEqual(counter.round_trips, 2)
+
+
+class TestRunProfile(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.previous = sda._redis_client
+
+    def tearDown(self) -> None:
+        sda._redis_client = self.previous
+
+    def test_legit_traffic_is_never_blocked(self):
+        result = lt.run_profile("legit", "fakeredis", requests=300)
+        self.assertEqual(result["requests"], 300)
+        self.assertEqual(result["blocked"], 0)
+        self.assertGreater(result["redis_commands_per_request"], 0)
+
+    def test_legit_blocks_do_not_grow_with_run_length(self):
+        # Well past both limits per key if every lookup were a new hash and
+        # every client mistyped its key the same way.
+        with patch.object(sda, "ANOMALY_LIMIT", 20), patch.object(sda, "AUTH_FAIL_LIMIT", 3):
+            for requests in (200, 3000):
+                self.assertEqual(lt.run_profile("legit", "fakeredis", requests=requests)["blocked"], 0)
+            result = lt.run_profile("scraper", "fakeredis", requests=3000)
+        self.assertEqual(result["precision"], 1.0)
+
+    def test_burst_attacker_is_blocked_without_false_positives(self):
+        result = lt.run_profile("burst", "fakeredis", requests=400)
+        self.assertEqual(result["precision"], 1.0)
+        self.assertGreater(result["recall"], 0.5)
+
+    def test_app_answers_with_real_statuses(self):
+        # Only the app's own 200/401 and the middleware's 403 – never a
+        # framework error such as 422 standing in for every response.
+        expected = {
+            "legit": {"200", "401"},
+            "burst": {"200", "401", "403"},
+            "credstuff": {"200", "401", "403"},
+        }
+        for profile, codes in expected.items():
+            result = lt.run_profile(profile, "fakeredis", requests=300)
+            statuses = result["statuses"]
+            self.assertEqual(set(statuses), codes, profile)
+            self.assertEqual(sum(statuses.values()), 300, profile)
+            self.assertEqual(statuses.get("403", 0), result["blocked"], profile)
+            self.assertGreater(statuses["200"], 100, profile)
+        self.assertGreater(lt.run_profile("credstuff", "fakeredis", requests=300)["recall"], 0.3)
+
+    def test_botnet_is_caught_by_the_per_key_anomaly_check(self):
+        with patch.object(sda, "ANOMALY_LIMIT", 50):
+            result = lt.run_profile("botnet", "fakeredis", requests=400)
+        self.assertEqual(result["precision"], 1.0)
+        self.assertGreater(result["recall"], 0.5)
+
+    def test_client_singleton_is_restored(self):
+        sda._redis_client = None
+        lt.run_profile("legit", "fakeredis", requests=10)
+        self.assertIsNone(sda._redis_client)
+
+
+if __name__ == "__main__":
+    unittest.main()
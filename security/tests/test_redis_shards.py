@@ -0,0 +1,112 @@
+"""
+Unit tests for security/redis_shards.py and the hash-tagged key layout.
+Uses one fakeredis server per shard.
+Run: python -m pytest security/tests/ -v
+"""
+
+from __future__ import annotations
+
+import sys
+import os
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import security.self_defending_api as sda
+from security.redis_shards import ShardedRedis, hash_tag
+
+
+def _ring(n: int = 4) -> ShardedRedis:
+    return ShardedRedis([
+        fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+        for _ in range(n)
+    ])
+
+
+class TestHashTag(unittest.TestCase):
+
+    def test_tag_is_hashed(self):
+        self.assertEqual(hash_tag("rate:burst:{1.2.3.4}"), "1.2.3.4")
+
+    def test_no_tag_hashes_whole_key(self):
+        self.assertEqual(hash_tag("rate:burst:1.2.3.4"), "rate:burst:1.2.3.4")
+
+    def test_empty_tag_hashes_whole_key(self):
+        self.assertEqual(hash_tag("a{}b"), "a{}b")
+
+
+class TestShardedRedis(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.r = _ring()
+
+    def test_keys_spread_over_shards(self):
+        used = {self.r.shard_index(f"key:{i}") for i in range(200)}
+        self.assertEqual(used, {0, 1, 2, 3})
+
+    def test_commands_round_trip(self):
+        self.r.set("a", "1")
+        self.assertEqual(self.r.get("a"), "1")
+        self.assertEqual(self.r.incr("counter"), 1)
+        self.assertEqual(self.r.exists("a"), 1)
+        self.r.delete("a")
+        self.assertIsNone(self.r.get("a"))
+
+    def test_pipeline_preserves_result_order(self):
+        pipe = self.r.pipeline()
+        for i in range(20):
+            pipe.incrby(f"k{i}", i)
+        self.assertEqual(pipe.execute(), list(range(20)))
+
+    def test_cross_shard_multi_key_command_is_rejected(self):
+        a = "x0"
+        b = next(f"x{i}" for i in range(1, 100) if self.r.shard_index(f"x{i}") != self.r.shard_index(a))
+        with self.assertRaises(Exception):
+            self.r.exists(a, b)
+
+
+class TestHashTaggedEngine(unittest.TestCase):
+    """The detection engine on a sharded store with hash-tagged keys."""
+
+    def setUp(self) -> None:
+        self.r = _ring()
+        self.patchers = [
+            patch.object(sda, "get_redis", return_value=self.r),
+            patch.object(sda, "REDIS_HASH_TAGS", True),
+        ]
+        for p in self.patchers:
+            p.start()
+
+    def tearDown(self) -> None:
+        for p in self.patchers:
+            p.stop()
+
+    def test_identifier_keys_share_a_shard(self):
+        ip = "40.40.40.40"
+        keys = [
+            sda._key(sda.PREFIX_BURST, ip),
+            sda._key(sda.PREFIX_BLACKLIST_IP, ip),
+            sda._key(sda.PREFIX_WHITELIST_IP, ip),
+            sda._key(sda.PREFIX_AUTH_FAIL + "ip:", ip),
+        ]
+        self.assertEqual(len({self.r.shard_index(k) for k in keys}), 1)
+
+    def test_burst_block_on_sharded_store(self):
+        result = None
+        for _ in range(sda.BURST_LIMIT + 2):
+            result = sda.inspect_request(ip="41.41.41.41", api_key="k")
+        self.assertIsNotNone(result)
+        self.assertTrue(sda.is_blocked("41.41.41.41"))
+
+    def test_auth_fail_blocks_ip_and_key(self):
+        for _ in range(sda.AUTH_FAIL_LIMIT + 1):
+            sda.check_auth_fail("42.42.42.42", "stuffed_key")
+        self.assertTrue(sda.is_blocked("42.42.42.42"))
+        self.assertTrue(sda.is_blocked("stuffed_key", is_key=True))
+
+
+if __name__ == "__main__":
+    unittest.main()